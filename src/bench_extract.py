@@ -0,0 +1,75 @@
+"""
+Micro-benchmark for the crawler's anchor extraction backends
+
+Times extract.anchors() with every available backend over the saved
+fixture pages (fixtures/dadi360). Each page is also blown up to a
+large-listing size by repeating its body --scale times, since that is
+where parsing dominates a crawl. All backends must agree on the titles
+they extract.
+
+    python src/bench_extract.py --scale 200 --repeat 5
+"""
+
+import argparse
+import os
+import time
+
+from crawler import extract_titles
+from extract import BACKENDS, decode
+from fixture_site import FIXTURE_DIR
+
+
+def load_pages(directory=FIXTURE_DIR, scale=1):
+    """{name: html} for every fixture page, body repeated scale times"""
+    pages = {}
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.html'):
+            continue
+        with open(os.path.join(directory, name), 'rb') as f:
+            html = decode(f.read())
+        if scale > 1:
+            head, _, rest = html.partition('<body>')
+            body, _, tail = rest.partition('</body>')
+            html = head + '<body>' + body * scale + '</body>' + tail
+        pages[name] = html
+    return pages
+
+
+def bench(pages, backends=None, repeat=5):
+    """Best-of-repeat seconds per backend to extract titles from all pages"""
+    results = {}
+    for backend in backends or sorted(BACKENDS):
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            titles = [extract_titles(html, backend) for html in pages.values()]
+            best = min(best, time.perf_counter() - start)
+        results[backend] = {'seconds': best, 'titles': titles}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare anchor extraction backends')
+    parser.add_argument('--scale', type=int, default=200,
+                        help='repeat each page body this many times')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    pages = load_pages(scale=args.scale)
+    size = sum(len(html.encode('utf-8')) for html in pages.values())
+    print(f"{len(pages)} pages, {size / 1024:.0f} KiB total (scale {args.scale})")
+
+    results = bench(pages, repeat=args.repeat)
+    baseline = results['soup']['seconds']
+    for backend, r in sorted(results.items(), key=lambda item: item[1]['seconds']):
+        print(f"{backend:>10}: {r['seconds'] * 1000:8.1f} ms  "
+              f"{size / r['seconds'] / 2**20:6.1f} MiB/s  x{baseline / r['seconds']:.1f} vs soup")
+
+    reference = results['soup']['titles']
+    mismatched = [b for b, r in results.items() if r['titles'] != reference]
+    if mismatched:
+        raise SystemExit(f"backends disagree with soup: {', '.join(mismatched)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,288 @@
+"""
+Benchmark suite for the web endpoints and the crawler at production scale
+
+Generates synthetic datasets (scraped services, climate rows, user posts),
+points climate_api at them and drives every endpoint through Flask's
+test_client, reporting p50/p95/p99 latency, throughput and peak traced
+memory per case. The crawler case runs discovery_engine() against the
+local FixtureSite serving the recorded pages, blown up to listing size.
+
+Results can be saved as a baseline and later runs compared against it;
+a case whose p50 or p95 grew by more than --threshold counts as a
+regression.
+
+    python src/benchmark.py --save-baseline benchmark_baseline.json
+    python src/benchmark.py --baseline benchmark_baseline.json --fail-on-regression
+"""
+
+import argparse
+import contextlib
+import csv
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import climate_api
+from catalog import ServiceCatalog
+from crawler import discovery_engine
+from db import ConnectionPool
+from fetcher import FetchEngine
+from fixture_site import FixtureSite
+
+CATEGORIES = ['租房', '招聘', '二手', '美食', '搬家', '汽车', '医疗', '教育']
+AREAS = ['Queens', 'Brooklyn', 'Manhattan', 'Flushing', 'San Jose', 'Oakland']
+
+# (name, method, url, form data); every case runs against the same datasets
+CASES = [
+    ('home', 'GET', '/', None),
+    ('home_search', 'GET', '/?search=Queens', None),
+    ('home_category', 'GET', '/?category=租房&page=3', None),
+    ('climate_range', 'GET', '/api/climate/range?min_temp=14&max_temp=15', None),
+    ('climate_range_columns', 'GET',
+     '/api/climate/range?min_temp=14&max_temp=15&format=columns', None),
+    ('climate_aggregate', 'GET', '/api/v2/climate/aggregate?bucket=decade', None),
+    ('statistics', 'GET', '/api/statistics', None),
+    ('user_posts', 'GET', '/api/user-posts?limit=50', None),
+    ('database_stats', 'GET', '/api/database-stats', None),
+    ('post', 'POST', '/post', {'category': '二手', 'title': '九成新自行车', 'desc': 'benchmark'}),
+]
+
+
+# --- 合成数据 ---
+def make_services_csv(path, rows, seed=0):
+    """Crawler-style Title,Source CSV with `rows` distinct titles"""
+    rng = np.random.default_rng(seed)
+    categories = rng.integers(len(CATEGORIES), size=rows)
+    areas = rng.integers(len(AREAS), size=rows)
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Title', 'Source'])
+        writer.writerows((f'{CATEGORIES[c]}({AREAS[a]}) 第{i}号信息', f'https://example.com/{c}')
+                         for i, (c, a) in enumerate(zip(categories.tolist(), areas.tolist())))
+
+
+def make_climate_csv(path, rows, seed=0):
+    """Year,Avg_Temp CSV with one row per year, ending in 2024"""
+    years = np.arange(2025 - rows, 2025)
+    temps = np.round(np.random.default_rng(seed).normal(14.5, 0.6, rows), 2)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('Year,Avg_Temp\n')
+        f.writelines(f'{y},{t!r}\n' for y, t in zip(years.tolist(), temps.tolist()))
+
+
+def make_user_posts(conn, rows, seed=0):
+    """Insert `rows` user posts (the triggers keep services and stats in sync)"""
+    rng = np.random.default_rng(seed)
+    categories = rng.integers(len(CATEGORIES), size=rows).tolist()
+    conn.executemany(
+        'INSERT INTO user_posts (category, title, description, contact) VALUES (?, ?, ?, ?)',
+        ((CATEGORIES[c], f'{CATEGORIES[c]} 用户信息 {i}', f'第{i}条用户发布', '未提供')
+         for i, c in enumerate(categories)))
+    conn.commit()
+
+
+@contextlib.contextmanager
+def synthetic_app(directory, services=100_000, climate=1_000_000, posts=100_000):
+    """
+    climate_api pointed at freshly generated datasets in directory; the
+    module's paths, store, pool and catalog are restored afterwards
+    """
+    names = ('CLIMATE_CSV_PATH', 'SERVICES_CSV_PATH', 'climate_journal', 'climate_store',
+             'db_pool', '_database_ready', 'catalog')
+    saved = {name: getattr(climate_api, name) for name in names}
+    services_path = os.path.join(directory, 'bayarea_services.csv')
+    climate_path = os.path.join(directory, 'climate_data.csv')
+    make_services_csv(services_path, services)
+    make_climate_csv(climate_path, climate)
+    pool = ConnectionPool(os.path.join(directory, 'bench.db'))
+    try:
+        climate_api.CLIMATE_CSV_PATH = climate_path
+        climate_api.SERVICES_CSV_PATH = services_path
+        climate_api.climate_journal = climate_api.climate_store = None
+        climate_api.db_pool = pool
+        climate_api.catalog = ServiceCatalog(services_path,
+                                             load_scraped=climate_api.get_services,
+                                             connect=climate_api.get_db_connection)
+        with contextlib.redirect_stdout(io.StringIO()):
+            climate_api.init_database()
+            with climate_api.get_db_connection() as conn:
+                make_user_posts(conn, posts)
+            climate_api.response_cache.clear()
+        yield climate_api.create_app({'TESTING': True})
+    finally:
+        for name, value in saved.items():
+            setattr(climate_api, name, value)
+        climate_api.response_cache.clear()
+        pool.close()
+
+
+# --- 测量 ---
+def summarize(latencies, elapsed, peak_bytes):
+    """p50/p95/p99 in ms, requests per second and peak memory in MiB"""
+    p50, p95, p99 = np.percentile(np.asarray(latencies) * 1000, [50, 95, 99]).tolist()
+    return {'requests': len(latencies), 'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99,
+            'throughput_rps': len(latencies) / elapsed, 'peak_mib': peak_bytes / 2**20}
+
+
+def measure(client, method, url, data=None, requests=50, cached=False):
+    """
+    Time `requests` calls of one endpoint after a warm-up call. Unless
+    cached, the response cache is cleared before every call so the data
+    path is what gets measured. Peak memory is traced over one extra call.
+    """
+    def call():
+        if not cached:
+            climate_api.response_cache.clear()
+        response = client.open(url, method=method, data=data)
+        response.get_data()
+        if response.status_code >= 400:
+            raise RuntimeError(f'{method} {url} -> {response.status_code}')
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        call()
+        latencies = []
+        started = time.perf_counter()
+        for _ in range(requests):
+            start = time.perf_counter()
+            call()
+            latencies.append(time.perf_counter() - start)
+        elapsed = time.perf_counter() - started
+
+        tracemalloc.start()
+        try:
+            call()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return summarize(latencies, elapsed, peak)
+
+
+def bench_endpoints(flask_app, requests=50, cached=False, cases=CASES):
+    """{case name: summary} for every endpoint case"""
+    results = {}
+    with flask_app.test_client() as client:
+        for name, method, url, data in cases:
+            results[name] = measure(client, method, url, data, requests, cached)
+    return results
+
+
+def bench_crawler(directory, scale=200, repeat=3):
+    """
+    discovery_engine() against the fixture site with every page body
+    repeated `scale` times: a cold crawl (no previous output) and an
+    incremental re-crawl where every page answers 304
+    """
+    from bench_extract import load_pages
+    output_path = os.path.join(directory, 'crawl.csv')
+    results = {}
+    with FixtureSite() as site, contextlib.redirect_stdout(io.StringIO()):
+        site.overrides = {name: html.encode('utf-8')
+                          for name, html in load_pages(scale=scale).items()}
+        for case in ('crawl_cold', 'crawl_incremental'):
+            latencies, peak, written = [], 0, 0
+            for _ in range(repeat):
+                if case == 'crawl_cold':
+                    for path in (output_path, os.path.join(directory, 'crawl_state.db')):
+                        if os.path.exists(path):
+                            os.remove(path)
+                engine = FetchEngine(concurrency=8, rate=1000, burst=50)
+                tracemalloc.start()
+                start = time.perf_counter()
+                try:
+                    stats = discovery_engine(site.url, engine, output_path=output_path)
+                    latencies.append(time.perf_counter() - start)
+                    peak = max(peak, tracemalloc.get_traced_memory()[1])
+                finally:
+                    tracemalloc.stop()
+                    engine.close()
+                written = stats['written']
+            results[case] = dict(summarize(latencies, sum(latencies), peak), rows=written)
+    return results
+
+
+# --- 基线对比 ---
+def compare(results, baseline, threshold=1.25):
+    """[(case, metric, baseline, current, ratio)] for latencies that grew past threshold"""
+    regressions = []
+    for case, current in results.items():
+        previous = baseline.get(case)
+        if previous is None:
+            continue
+        for metric in ('p50_ms', 'p95_ms'):
+            ratio = current[metric] / previous[metric] if previous[metric] else 1.0
+            if ratio > threshold:
+                regressions.append((case, metric, previous[metric], current[metric], ratio))
+    return regressions
+
+
+def report(results, baseline=None):
+    print(f"{'case':>22} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9} "
+          f"{'peak MiB':>9}" + ('  p50 vs baseline' if baseline else ''))
+    for case, r in results.items():
+        line = (f"{case:>22} {r['p50_ms']:9.2f} {r['p95_ms']:9.2f} {r['p99_ms']:9.2f} "
+                f"{r['throughput_rps']:9.1f} {r['peak_mib']:9.1f}")
+        previous = (baseline or {}).get(case)
+        if previous and previous['p50_ms']:
+            line += f"  x{r['p50_ms'] / previous['p50_ms']:.2f}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark endpoints and the crawler')
+    parser.add_argument('--services', type=int, default=100_000)
+    parser.add_argument('--climate', type=int, default=1_000_000)
+    parser.add_argument('--posts', type=int, default=100_000)
+    parser.add_argument('--requests', type=int, default=50, help='timed calls per endpoint')
+    parser.add_argument('--cached', action='store_true',
+                        help='keep the response cache between calls')
+    parser.add_argument('--crawl-scale', type=int, default=200,
+                        help='repeat each fixture page body this many times (0: skip)')
+    parser.add_argument('--baseline', help='compare against this results JSON')
+    parser.add_argument('--save-baseline', help='write the results JSON here')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='p50/p95 ratio over the baseline that counts as a regression')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        with synthetic_app(directory, args.services, args.climate, args.posts) as flask_app:
+            print(f"Datasets: {args.services} services, {args.climate} climate rows, "
+                  f"{args.posts} user posts ({time.perf_counter() - start:.1f} s to generate)")
+            results = bench_endpoints(flask_app, args.requests, args.cached)
+        if args.crawl_scale:
+            results.update(bench_crawler(directory, args.crawl_scale))
+
+    sizes = {'services': args.services, 'climate': args.climate, 'posts': args.posts,
+             'crawl_scale': args.crawl_scale}
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            stored = json.load(f)
+        baseline = stored['results']
+        if stored.get('sizes') != sizes:
+            print(f"⚠ Baseline was recorded with different sizes: {stored.get('sizes')}")
+    report(results, baseline)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump({'sizes': sizes, 'sqlite': sqlite3.sqlite_version,
+                       'results': results}, f, indent=2)
+        print(f"✓ Baseline saved to {args.save_baseline}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        for case, metric, before, after, ratio in regressions:
+            print(f"⚠ {case} {metric}: {before:.2f} -> {after:.2f} ms (x{ratio:.2f})")
+        if regressions and args.fail_on_regression:
+            raise SystemExit(f"{len(regressions)} regression(s) over x{args.threshold}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,385 @@
+"""
+Service catalog - the Bay Area services listing, backed by SQLite
+
+Scraped services are imported from the CSV into the indexed `services`
+table next to `user_posts` (triggers mirror user posts into it), so the
+homepage can filter, count and page with indexed queries instead of
+building the whole list in Python. The CSV is only re-imported when its
+mtime/size differs from what the database last imported.
+
+Search goes through in-memory n-gram indexes keyed by services.id: one
+for the scraped rows and one for user posts. Category facets (category ->
+member ids) are kept the same way and serve the dropdown counts, the
+listing totals and category filtering of search results. They follow the
+database, not the process that wrote it: the `services_csv` marker in
+catalog_meta changes on every import (rebuilding the scraped indexes) and
+the user_posts triggers bump user_post_stats.version, so imports and
+posts made by any worker (or a sidecar refresher) reach every worker.
+User posts are applied as deltas - rows past the last indexed id are
+added, deleted ones removed - so a post costs O(post), not O(all posts).
+
+Rebuilds happen off to the side and are swapped in. An import inserts
+the scraped rows as a new `generation` next to the current one (which is
+only deleted by the import after it), so the table holds the rows of
+both the old and the new indexes; the catalog lists the generation its
+indexes were built from and switches to the new one in the same step as
+the index swap. While one thread rebuilds, readers keep using the
+current indexes - and the matching rows - instead of waiting for it. With
+watch_csv=False requests never import the CSV themselves (after the
+first load); a background refresher calls refresh(reload_csv=True).
+
+Queries read the indexes as of the last refresh(); the web app refreshes
+once per request (the services cache key is refresh()'s return value).
+"""
+
+import os
+import threading
+
+import post_stats
+from search import NgramIndex
+
+LISTING_COLUMNS = 'id, category, title, description, contact, source, created_at'
+
+# Listing order is newest first; (created_at, id) is the keyset cursor
+ORDER_NEWEST = 'ORDER BY created_at DESC, id DESC'
+ORDER_OLDEST = 'ORDER BY created_at ASC, id ASC'
+
+
+
+def encode_cursor(service):
+    """Opaque page cursor for a listing row"""
+    return f"{service['created_at']}_{service['id']}"
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor(); raises ValueError on garbage"""
+    created_at, sep, row_id = cursor.rpartition('_')
+    if not sep or not created_at:
+        raise ValueError(f'Invalid cursor: {cursor!r}')
+    return created_at, int(row_id)
+
+
+def category_list(category):
+    """None, one category or several -> list of distinct categories"""
+    if not category:
+        return []
+    if isinstance(category, str):
+        return [category]
+    return list(dict.fromkeys(c for c in category if c))
+
+
+class FacetIndex:
+    """category -> ids of its member services (insertion-ordered dict keys)"""
+
+    def __init__(self, rows=()):
+        self.members = {}
+        self.category_of = {}
+        for key, category in rows:
+            self.add(key, category)
+
+    def __len__(self):
+        return len(self.category_of)
+
+    def add(self, key, category):
+        self.members.setdefault(category, {})[key] = None
+        self.category_of[key] = category
+
+    def remove(self, key):
+        category = self.category_of.pop(key)
+        ids = self.members[category]
+        del ids[key]
+        if not ids:
+            del self.members[category]
+
+    def counts(self):
+        return {category: len(ids) for category, ids in self.members.items()}
+
+
+def row_to_service(row):
+    """Convert a services row to the dict the templates expect"""
+    service = {
+        'id': row['id'],
+        'Category': row['category'],
+        'Title': row['title'],
+        'Description': row['description'] or row['title'],
+        'Contact': row['contact'] or '未提供',
+        'Source': row['source'],
+        'created_at': row['created_at'],
+    }
+    service['cursor'] = encode_cursor(service)
+    return service
+
+
+class ServiceCatalog:
+    """Process-wide view of scraped services merged with user posts"""
+
+    def __init__(self, csv_path, load_scraped, connect, watch_csv=True):
+        # connect() returns a context manager yielding a sqlite3 connection
+        self.csv_path = csv_path
+        self.watch_csv = watch_csv
+        self._load_scraped = load_scraped
+        self._connect = connect
+        self._lock = threading.Lock()          # guards the swapped-in state below
+        self._refresh_lock = threading.Lock()  # one rebuild at a time
+
+        self._scraped_index = NgramIndex()
+        self._scraped_facets = FacetIndex()
+        self._generation = 0                   # scraped rows the indexes point at
+        self._indexed_key = None
+        self._user_index = NgramIndex()
+        self._user_facets = FacetIndex()
+        self._user_last_id = 0                 # refresh thread only
+
+    def _stat(self):
+        """Cheap change detector for the CSV file: (mtime, size)"""
+        try:
+            st = os.stat(self.csv_path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    @staticmethod
+    def _marker(signature):
+        """catalog_meta value recording which CSV the scraped rows came from"""
+        return '%d:%d' % signature if signature else ''
+
+    @staticmethod
+    def _db_state(conn):
+        """
+        (imported CSV marker, scraped generation, user_posts version),
+        shared by every process
+        """
+        meta = dict(conn.execute("SELECT key, value FROM catalog_meta WHERE key IN "
+                                 "('services_csv', 'services_generation')").fetchall())
+        return (meta.get('services_csv'), int(meta.get('services_generation') or 0),
+                post_stats.version(conn))
+
+    @property
+    def version(self):
+        """Changes whenever the merged service list would change"""
+        with self._connect() as conn:
+            state = self._db_state(conn)
+        return (self._stat() if self.watch_csv else None,) + state
+
+    def _import_scraped(self, conn, signature):
+        """
+        Import the CSV as a new generation of scraped rows if it differs
+        from the last import, in one write transaction (committed by the
+        caller's `with conn:`). The current generation stays for readers
+        that haven't switched yet; the one before it is deleted.
+        Returns whether it imported.
+        """
+        marker = self._marker(signature)
+        if self._db_state(conn)[0] == marker:
+            return False
+
+        # Parsed and classified before the write transaction starts
+        services = self._load_scraped() if signature else []
+        # Checked again under the write lock: another process may have
+        # imported the same CSV meanwhile, and doing it twice would change ids
+        conn.execute('BEGIN IMMEDIATE')
+        imported, current, _ = self._db_state(conn)
+        if imported == marker:
+            return False
+        conn.execute("DELETE FROM services WHERE origin = 'scraped' AND generation < ?",
+                     (current,))
+        # Inserted in reverse so the newest-first listing keeps CSV order
+        conn.executemany('''
+            INSERT INTO services (origin, category, title, description, contact, source,
+                                  generation)
+            VALUES ('scraped', ?, ?, ?, ?, ?, ?)
+        ''', ((s['Category'], s['Title'], s['Description'], s['Contact'], s['Source'],
+               current + 1) for s in reversed(services)))
+        conn.executemany("INSERT OR REPLACE INTO catalog_meta (key, value) VALUES (?, ?)",
+                         [('services_csv', marker), ('services_generation', current + 1)])
+        print(f"✓ Imported {len(services)} scraped services")
+        return True
+
+    def refresh(self, reload_csv=False):
+        """
+        Import the CSV if it changed, and rebuild search indexes if the
+        database changed - including imports and posts made by other
+        processes. Returns at once, keeping the current indexes, if another
+        thread is already rebuilding (unless nothing has been loaded yet).
+        reload_csv=True picks up a changed CSV even when watch_csv is off.
+        Returns the version of the indexes now being served.
+        """
+        check_csv = reload_csv or self.watch_csv or self._indexed_key is None
+        signature = self._stat() if check_csv else None
+        with self._connect() as conn:
+            state = self._db_state(conn)
+        if (not check_csv or self._marker(signature) == state[0]) and \
+                self._indexed_key == state:
+            return state
+        if not self._refresh_lock.acquire(blocking=self._indexed_key is None or reload_csv):
+            return self._indexed_key
+        try:
+            scraped = None
+            with self._connect() as conn:
+                if check_csv:
+                    with conn:
+                        self._import_scraped(conn, signature)
+                # One read snapshot: the marker and version match the rows indexed
+                with conn:
+                    conn.execute('BEGIN')
+                    state = self._db_state(conn)
+                    if self._indexed_key is None or state[1] != self._indexed_key[1]:
+                        scraped = self._build_indexes(conn, 'scraped', state[1])
+                    if self._indexed_key is None or \
+                            self._user_index.tombstones > len(self._user_index):
+                        user, added, removed = self._build_indexes(conn, 'user'), [], []
+                    elif state[2] != self._indexed_key[2]:
+                        user, (added, removed) = None, self._user_changes(conn)
+                    else:
+                        user, added, removed = None, [], []
+
+            # Swap: readers see either the old indexes and rows or all of the new ones
+            with self._lock:
+                if scraped is not None:
+                    self._scraped_index, self._scraped_facets = scraped
+                    self._generation = state[1]
+                if user is not None:
+                    self._user_index, self._user_facets = user
+                for key in removed:
+                    self._user_index.remove(key)
+                    self._user_facets.remove(key)
+                for r in added:
+                    self._user_index.add(r['id'], r['title'], r['description'])
+                    self._user_facets.add(r['id'], r['category'])
+                self._indexed_key = state
+            if user is not None or added:
+                self._user_last_id = max(self._user_facets.category_of, default=0)
+        finally:
+            self._refresh_lock.release()
+        return state
+
+    def _ensure_loaded(self):
+        if self._indexed_key is None:
+            self.refresh()
+
+    @staticmethod
+    def _build_indexes(conn, origin, generation=0):
+        """N-gram and facet indexes over one origin's rows (of one generation)"""
+        rows = conn.execute('SELECT id, category, title, description FROM services '
+                            'WHERE origin = ? AND generation = ?',
+                            (origin, generation)).fetchall()
+        return (NgramIndex((r['id'], r['title'], r['description']) for r in rows),
+                FacetIndex((r['id'], r['category']) for r in rows))
+
+    def _user_changes(self, conn):
+        """
+        (rows added, ids removed) for user posts since the last refresh:
+        new rows are the ones past the last indexed id (ids only grow);
+        the id list is only read when the row count says some were deleted
+        """
+        added = conn.execute('SELECT id, category, title, description FROM services '
+                             "WHERE origin = 'user' AND id > ?",
+                             (self._user_last_id,)).fetchall()
+        # Every user row (and only those) has a post_id: idx_services_post covers this
+        total = conn.execute('SELECT COUNT(*) FROM services '
+                             'WHERE post_id IS NOT NULL').fetchone()[0]
+        if total == len(self._user_facets) + len(added):
+            return added, []
+        present = {row[0] for row in conn.execute(
+            'SELECT id FROM services WHERE post_id IS NOT NULL')}
+        return added, [key for key in self._user_facets.category_of if key not in present]
+
+    # --- 查询 ---
+    def facets(self):
+        """[(category, count)] over scraped and user rows, sorted by category"""
+        self._ensure_loaded()
+        with self._lock:
+            counts = self._scraped_facets.counts()
+            for category, n in self._user_facets.counts().items():
+                counts[category] = counts.get(category, 0) + n
+        return sorted(counts.items())
+
+    def count(self, category=None, facets=None):
+        """
+        Number of listed services, optionally within some categories
+        (from `facets` when the caller already has them)
+        """
+        counts = dict(self.facets() if facets is None else facets)
+        categories = category_list(category)
+        if not categories:
+            return sum(counts.values())
+        return sum(counts.get(c, 0) for c in categories)
+
+    def categories(self):
+        """Distinct categories, sorted (served from the facet index)"""
+        return [category for category, _ in self.facets()]
+
+    def page(self, category=None, after=None, before=None, last=False,
+             offset=0, per_page=20, total=None):
+        """
+        One page of services, newest first. `after`/`before` are cursors
+        from a neighbouring page (keyset pagination); `last` returns the
+        final page (sized from `total`, the count(category), if given);
+        `offset` is only a fallback for bare ?page=N links.
+        `category` may be one category or a list of them.
+        """
+        # Only the scraped rows the current indexes were built from
+        where, params = ["(origin = 'user' OR generation = ?)"], [self._generation]
+        categories = category_list(category)
+        if categories:
+            where.append(f'category IN ({",".join("?" * len(categories))})')
+            params.extend(categories)
+
+        order, reverse = ORDER_NEWEST, False
+        if after:
+            where.append('(created_at, id) < (?, ?)')
+            params.extend(decode_cursor(after))
+        elif before:
+            where.append('(created_at, id) > (?, ?)')
+            params.extend(decode_cursor(before))
+            order, reverse = ORDER_OLDEST, True
+        elif last:
+            order, reverse = ORDER_OLDEST, True
+            remainder = (self.count(category) if total is None else total) % per_page
+            per_page = remainder or per_page
+
+        sql = f'SELECT {LISTING_COLUMNS} FROM services WHERE ' + ' AND '.join(where)
+        sql += f' {order} LIMIT ?'
+        params.append(per_page)
+        if offset and not (after or before or last):
+            sql += ' OFFSET ?'
+            params.append(offset)
+
+        with self._connect() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        if reverse:
+            rows.reverse()
+        return [row_to_service(row) for row in rows]
+
+    def fetch(self, ids):
+        """Services for the given ids, in the given order"""
+        if not ids:
+            return []
+        with self._connect() as conn:
+            rows = conn.execute(
+                f'SELECT {LISTING_COLUMNS} FROM services WHERE id IN '
+                f'({",".join("?" * len(ids))})', list(ids)).fetchall()
+        by_id = {row['id']: row_to_service(row) for row in rows}
+        return [by_id[i] for i in ids if i in by_id]
+
+    def search(self, query, category=None):
+        """Ids of services matching query, best match first"""
+        self._ensure_loaded()
+        with self._lock:
+            scraped_index, user_index = self._scraped_index, self._user_index
+
+        ranked = scraped_index.matches(query) + user_index.matches(query)
+        ranked.sort()
+        ids = [key for _, key in ranked]
+        if category_list(category) and ids:
+            ids = self._filter_category(ids, category)
+        return ids
+
+    def _filter_category(self, ids, category):
+        """Keep ids in any of the categories, preserving order"""
+        keep = set()
+        with self._lock:  # the user facets change in place
+            for name in category_list(category):
+                for facet in (self._scraped_facets, self._user_facets):
+                    keep.update(facet.members.get(name, ()))
+        return [i for i in ids if i in keep]
@@ -0,0 +1,179 @@
+"""
+Vectorized classification of scraped services
+
+Turns the crawler's (Title, Source) CSV into the Category/Title/
+Description/Contact/Source rows the catalog imports, using pandas string
+operations over whole columns instead of a Python loop per row.
+
+Rules are pluggable through Classifier:
+- keywords: {keyword: category}, compiled into one alternation regex;
+  the first (longest) keyword found in a title decides its category
+- otherwise the text before the first '(', '·' or '｜' is the category
+  ('其他' if that text is empty)
+- otherwise the default category ('生活服务')
+
+The result is persisted next to the CSV as a precomputed catalog artifact
+(bayarea_services.catalog.json) by the crawler. load_services() uses it
+when it still matches the CSV (mtime/size) and the rules, and classifies
+the CSV again only when it doesn't.
+"""
+
+import hashlib
+import json
+import os
+import re
+
+import pandas as pd
+
+ARTIFACT_FORMAT = 1
+COLUMNS = ['Category', 'Title', 'Description', 'Contact', 'Source']
+SEPARATORS = '(·｜'
+DESCRIPTION_LIMIT = 100
+
+
+class Classifier:
+    """Category rules applied to a whole Title column at once"""
+
+    def __init__(self, keywords=None, default='生活服务', empty='其他'):
+        self.keywords = dict(keywords or {})
+        self.default = default
+        self.empty = empty
+        # Longest keywords first, so '二手车' wins over '二手'
+        alternatives = sorted(self.keywords, key=len, reverse=True)
+        self._keyword_re = re.compile(
+            '(' + '|'.join(map(re.escape, alternatives)) + ')') if alternatives else None
+        self._prefix_re = re.compile(f'^([^{re.escape(SEPARATORS)}]*)[{re.escape(SEPARATORS)}]')
+
+    @property
+    def fingerprint(self):
+        """Changes whenever the rules do (stored in the artifact)"""
+        rules = json.dumps([sorted(self.keywords.items()), self.default, self.empty,
+                            SEPARATORS, DESCRIPTION_LIMIT], ensure_ascii=False)
+        return hashlib.sha1(rules.encode('utf-8')).hexdigest()
+
+    def categories(self, titles):
+        """Category for every title in a Series of strings"""
+        prefix = titles.str.extract(self._prefix_re, expand=False)
+        category = prefix.str.strip().where(prefix != '', self.empty)
+        category = category.fillna(self.default)
+        if self._keyword_re is not None:
+            keyword = titles.str.extract(self._keyword_re, expand=False)
+            category = keyword.map(self.keywords).fillna(category)
+        return category
+
+    def classify(self, frame):
+        """DataFrame with Title/Source columns -> DataFrame with COLUMNS"""
+        titles = frame['Title'].astype(str)
+        long = titles.str.len() > DESCRIPTION_LIMIT
+        description = titles.where(~long, titles.str.slice(0, DESCRIPTION_LIMIT) + '...')
+        return pd.DataFrame({
+            'Category': self.categories(titles),
+            'Title': titles,
+            'Description': description,
+            'Contact': frame['Source'],
+            'Source': frame['Source'],
+        }, columns=COLUMNS)
+
+
+DEFAULT_CLASSIFIER = Classifier()
+
+
+def artifact_path(csv_path):
+    """data/bayarea_services.csv -> data/bayarea_services.catalog.json"""
+    return os.path.splitext(csv_path)[0] + '.catalog.json'
+
+
+def _signature(path):
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def read_scraped(csv_path):
+    """The crawler's CSV as strings, without rows that lack a title"""
+    frame = pd.read_csv(csv_path, dtype=str, keep_default_na=False)
+    return frame[frame['Title'] != '']
+
+
+def _encode(values):
+    """Dictionary-encode a column: {'values': distinct, 'codes': [index]}"""
+    codes, distinct = pd.factorize(values)
+    return {'values': distinct.tolist(), 'codes': codes.tolist()}
+
+
+def _decode(column):
+    values = column['values']
+    return [values[code] for code in column['codes']]
+
+
+def build_artifact(csv_path, classifier=DEFAULT_CLASSIFIER):
+    """Classify csv_path and write its artifact atomically; returns the services"""
+    signature = _signature(csv_path)
+    classified = classifier.classify(read_scraped(csv_path)).reset_index(drop=True)
+    truncated = classified['Description'][classified['Description'] != classified['Title']]
+    # Columnar, with the low-cardinality columns dictionary-encoded; Contact
+    # is the Source and Description the Title unless it was truncated
+    artifact = {
+        'format': ARTIFACT_FORMAT,
+        'source_signature': signature,
+        'rules': classifier.fingerprint,
+        'category': _encode(classified['Category']),
+        'title': classified['Title'].tolist(),
+        'description': {str(i): d for i, d in truncated.items()},
+        'source': _encode(classified['Source']),
+    }
+    path = artifact_path(csv_path)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(artifact, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_path, path)
+    return classified.to_dict('records')
+
+
+def _load_artifact(csv_path, classifier):
+    """Services from a fresh artifact, or None if it's missing or stale"""
+    try:
+        with open(artifact_path(csv_path), encoding='utf-8') as f:
+            artifact = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if artifact.get('format') != ARTIFACT_FORMAT or \
+            artifact.get('source_signature') != _signature(csv_path) or \
+            artifact.get('rules') != classifier.fingerprint:
+        return None
+
+    descriptions = artifact['description']
+    return [{'Category': category, 'Title': title,
+             'Description': descriptions.get(str(i), title),
+             'Contact': source, 'Source': source}
+            for i, (category, title, source) in enumerate(zip(
+                _decode(artifact['category']), artifact['title'],
+                _decode(artifact['source'])))]
+
+
+def load_services(csv_path, classifier=DEFAULT_CLASSIFIER):
+    """
+    Classified services for csv_path as dicts with COLUMNS keys, from the
+    artifact when it is fresh, else by classifying (and saving) again
+    """
+    services = _load_artifact(csv_path, classifier)
+    if services is None:
+        try:
+            services = build_artifact(csv_path, classifier)
+        except OSError:
+            # Read-only data directory: classify without persisting
+            services = classifier.classify(read_scraped(csv_path)).to_dict('records')
+    return services
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+    parser = argparse.ArgumentParser(description='Rebuild the precomputed services catalog')
+    parser.add_argument('csv_path', nargs='?', default=os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data',
+        'bayarea_services.csv'))
+    args = parser.parse_args()
+    start = time.perf_counter()
+    services = build_artifact(args.csv_path)
+    print(f"✓ Classified {len(services)} services into {artifact_path(args.csv_path)} "
+          f"({(time.perf_counter() - start) * 1000:.1f} ms)")
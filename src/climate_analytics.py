@@ -0,0 +1,155 @@
+"""
+Vectorized analytics over year-ordered climate series
+
+Every function takes NumPy columns sorted by year and works in a single
+pass with cumulative sums / ufunc.reduceat, so there are no Python-level
+loops over rows.
+"""
+
+import numpy as np
+
+
+def _none_if_nan(values):
+    return [None if np.isnan(v) else float(v) for v in values]
+
+
+def rolling_stats(years, temps, window):
+    """
+    Moving mean and sample std over `window` consecutive rows. Each window
+    is labelled with its last year. Values are centered before the
+    cumulative sums to keep the variance numerically stable.
+    """
+    n = len(temps)
+    if window < 1 or window > n:
+        return []
+
+    shift = temps.mean()
+    x = temps - shift
+    c1 = np.concatenate(([0.0], np.cumsum(x)))
+    c2 = np.concatenate(([0.0], np.cumsum(x * x)))
+    s1 = c1[window:] - c1[:-window]
+    s2 = c2[window:] - c2[:-window]
+
+    means = s1 / window + shift
+    if window > 1:
+        stds = np.sqrt(np.clip((s2 - s1 * s1 / window) / (window - 1), 0, None))
+    else:
+        stds = np.full(len(s1), np.nan)
+
+    return [{'Year': int(y), 'mean': float(m), 'std': s}
+            for y, m, s in zip(years[window - 1:].tolist(), means.tolist(),
+                               _none_if_nan(stds))]
+
+
+def group_stats(years, temps, size=10):
+    """
+    count/mean/min/max/std per bucket of `size` years (10 = decades).
+    Buckets are contiguous because the input is year-ordered.
+    """
+    if len(years) == 0:
+        return []
+
+    keys = (years // size) * size
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    counts = np.diff(np.r_[starts, len(keys)])
+    means = np.add.reduceat(temps, starts) / counts
+    mins = np.minimum.reduceat(temps, starts)
+    maxs = np.maximum.reduceat(temps, starts)
+    deviations = temps - np.repeat(means, counts)
+    m2 = np.add.reduceat(deviations * deviations, starts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        stds = np.where(counts > 1, np.sqrt(m2 / (counts - 1)), np.nan)
+
+    return [{'start': int(k), 'count': int(c), 'mean': float(mean),
+             'min': float(lo), 'max': float(hi), 'std': s}
+            for k, c, mean, lo, hi, s in zip(keys[starts].tolist(), counts.tolist(),
+                                             means.tolist(), mins.tolist(),
+                                             maxs.tolist(), _none_if_nan(stds))]
+
+
+def lttb(x, y, points):
+    """
+    Indices of `points` samples picked by Largest-Triangle-Three-Buckets:
+    the first and last points, plus per bucket the point forming the
+    largest triangle with the previous pick and the next bucket's mean.
+    Each bucket is one vectorized step, so the loop runs `points` times
+    however long the series is.
+    """
+    n = len(x)
+    if points >= n or points < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # points - 2 buckets over the interior rows 1 .. n-2
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    selected = np.empty(points, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x = x[hi:edges[i + 2]].mean()
+            next_y = y[hi:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        area = np.abs((x[a] - next_x) * (y[lo:hi] - y[a]) -
+                      (x[a] - x[lo:hi]) * (next_y - y[a]))
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def _bucket_reduce(keys, counts, sums, mins, maxs):
+    """Merge runs of equal (sorted) keys; every array is per input bucket"""
+    if len(keys) == 0:
+        return keys, counts, sums, mins, maxs
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    return (keys[starts], np.add.reduceat(counts, starts), np.add.reduceat(sums, starts),
+            np.minimum.reduceat(mins, starts), np.maximum.reduceat(maxs, starts))
+
+
+class BucketPyramid:
+    """
+    count/sum/min/max per bucket of 10, 100, 1000, ... years, each level
+    built from the one below. A query for any bucket size starts from the
+    coarsest level that divides it, so it touches len/level buckets
+    instead of every row.
+    """
+
+    def __init__(self, years, temps, factor=10):
+        years = np.asarray(years, dtype=np.int64)
+        temps = np.asarray(temps, dtype=np.float64)
+        # Level 1: one bucket per distinct year of the (year-ordered) series
+        level = _bucket_reduce(years, np.ones(len(years), dtype=np.int64), temps, temps, temps)
+        self.levels = {1: level}
+        span = int(years.max() - years.min()) if len(years) else 0
+        size = factor
+        # Until one bucket could hold every year (keys straddling 0 never merge)
+        while size <= span * factor:
+            keys = (level[0] // size) * size
+            level = _bucket_reduce(keys, *level[1:])
+            self.levels[size] = level
+            size *= factor
+
+    def buckets(self, size, min_year=None, max_year=None):
+        """
+        Columns start/count/min/mean/max for buckets of `size` years over
+        the rows within [min_year, max_year]; edge buckets are clipped to
+        the range (they keep their start but only count rows inside it)
+        """
+        # The coarsest level whose buckets lie wholly inside or outside the range
+        base = max(s for s in self.levels if size % s == 0
+                   and (min_year is None or min_year % s == 0)
+                   and (max_year is None or (max_year + 1) % s == 0))
+        keys, counts, sums, mins, maxs = self.levels[base]
+        lo = 0 if min_year is None else np.searchsorted(keys, min_year, side='left')
+        hi = len(keys) if max_year is None else np.searchsorted(keys, max_year, side='right')
+        keys, counts, sums, mins, maxs = (column[lo:hi] for column in
+                                          (keys, counts, sums, mins, maxs))
+        if base != size:
+            keys, counts, sums, mins, maxs = _bucket_reduce(
+                (keys // size) * size, counts, sums, mins, maxs)
+
+        return {'start': keys.tolist(), 'count': counts.tolist(), 'min': mins.tolist(),
+                'mean': (sums / counts).tolist(), 'max': maxs.tolist()}
@@ -8,217 +8,459 @@ This lab teaches:
 2. Building REST APIs with Flask
 3. JSON handling and serialization
 4. Error handling and validation
+
+create_app() builds the Flask app from the routes blueprint; the module
+keeps a ready-made `app` for `gunicorn climate_api:app` and the tests.
+Nothing heavy happens at import: the climate store, the SQLite schema
+and pandas (only needed to re-classify services) are loaded on first use,
+and startup_report records what each step cost.
 """
 
-from flask import Flask, jsonify, render_template, request
-import pandas as pd
+import time
+_import_started = time.perf_counter()
+
+from flask import Blueprint, Flask, Response, current_app, g, jsonify, render_template, request
+from flask.json.provider import DefaultJSONProvider
 from datetime import datetime
-import sqlite3
+import atexit
+import threading
+import csv
+import io
+import json
+import math
 import os
-
-# Initialize Flask with correct paths (since we're in src/ directory)
-app = Flask(__name__,
-            template_folder='../templates',
-            static_folder='../static')
+from contextlib import nullcontext
+
+import numpy as np
+
+from catalog import ServiceCatalog, decode_cursor, encode_cursor
+from climate_store import ClimateStore
+import climate_snapshot
+from climate_journal import ClimateJournal, format_line
+from climate_analytics import BucketPyramid, group_stats, lttb, rolling_stats
+from db import ConnectionPool
+from metrics import Metrics
+import post_stats
+from refresher import CatalogRefresher, crawl_to
+from response_cache import ResponseCache
+
+bp = Blueprint('climate_api', __name__)
+
+# 启动耗时（毫秒）：导入、建 app，以及首次使用时才执行的加载步骤
+startup_report = {'import_ms': None, 'create_app_ms': None,
+                  'climate_load_ms': None, 'database_init_ms': None}
+
+# 运行指标：路由延迟 + 热点内部步骤的计时，/api/metrics 以 Prometheus 文本格式导出
+metrics = Metrics()
+metrics.describe('http_requests_total', 'Requests by endpoint, method and status')
+metrics.describe('http_request_duration_seconds', 'Request latency by endpoint and method')
+metrics.describe('sqlite_query_duration_seconds', 'SQLite statement time by statement kind')
+metrics.describe('services_csv_load_seconds', 'Loading classified services from the CSV/artifact')
+metrics.describe('template_render_duration_seconds', 'Jinja2 render time by template')
+metrics.describe('json_serialize_duration_seconds', 'JSON response serialization time')
+metrics.describe('user_posts_created_total', 'User posts created via /post')
+metrics.describe('errors_total', 'Errors handled without a 5xx response, by location')
 
 # Get the base directory (project root)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DATA_DIR = os.path.join(BASE_DIR, 'data')
 
 # Load climate data with absolute path
-df = pd.read_csv(os.path.join(DATA_DIR, 'climate_data.csv'))
+CLIMATE_CSV_PATH = os.path.join(DATA_DIR, 'climate_data.csv')
+
+def write_climate_snapshot(years, temps):
+    """Publish a fresh snapshot after the journal is compacted into the CSV"""
+    climate_snapshot.write(CLIMATE_CSV_PATH, years, temps)
+
+def load_climate_store(locked=False):
+    """
+    Year hash index + sorted Avg_Temp/Year views over the memory-mapped
+    snapshot (shared by every worker; rebuilt from the CSV when stale),
+    plus the records appended to the journal since the CSV was last
+    compacted. locked=True if the caller already holds the journal's
+    exclusive or shared lock; otherwise a shared lock keeps compaction out.
+    """
+    with (nullcontext() if locked else climate_journal.shared()):
+        store = ClimateStore.from_snapshot(climate_snapshot.load(CLIMATE_CSV_PATH))
+        store.extend(climate_journal.replay())
+    return store
+
+# Loaded by ensure_climate() on first use
+climate_journal = None
+climate_store = None
+_climate_init_lock = threading.Lock()
+_climate_sync_lock = threading.Lock()
+
+def ensure_climate():
+    """Open the journal and load the store, once per process"""
+    global climate_journal, climate_store
+    if climate_journal is not None and climate_store is not None:
+        return
+    with _climate_init_lock:
+        started = time.perf_counter()
+        if climate_journal is None:
+            climate_journal = ClimateJournal(CLIMATE_CSV_PATH, on_compact=write_climate_snapshot)
+        if climate_store is None:
+            climate_store = load_climate_store()
+            startup_report['climate_load_ms'] = (time.perf_counter() - started) * 1000
+
+def sync_climate(locked=False):
+    """
+    Apply writes made by other worker processes since the last call: one
+    stat() of the journal when nothing changed, the new journal rows when
+    it grew, a full reload when another worker compacted it. Called before
+    every climate read, so all workers see a write once it's journaled.
+
+    Lock order is always journal flock -> _climate_sync_lock (writers hold
+    exclusive() when they get here with locked=True), so a reload never
+    waits for the flock while holding _climate_sync_lock.
+    """
+    global climate_store
+    ensure_climate()
+    with _climate_sync_lock:
+        reset, rows = climate_journal.poll()
+        if not reset:
+            if rows:
+                climate_store.extend(rows)
+            return climate_store
+        if locked:
+            climate_store = load_climate_store(locked=True)
+            return climate_store
+
+    # Compacted elsewhere: take the shared flock first, then poll again
+    # (another thread may have reloaded in the meantime)
+    with climate_journal.shared(), _climate_sync_lock:
+        reset, rows = climate_journal.poll()
+        if reset:
+            climate_store = load_climate_store(locked=True)
+        elif rows:
+            climate_store.extend(rows)
+    return climate_store
+
+def add_climate_rows(rows):
+    """
+    Validate and durably record [(year, temp), ...] for every worker;
+    returns (added records, duplicate years) like ClimateStore.extend()
+    """
+    ensure_climate()
+    with climate_journal.exclusive():
+        # Catch up first so the duplicate check covers every worker's rows
+        store = sync_climate(locked=True)
+        new, duplicates = store.partition(rows)
+        if not new:
+            return [], duplicates
+        # Journal first: a failed write must not leave the rows in memory only
+        ticket = climate_journal.write(new, snapshot=lambda: store.snapshot(new))
+        added, _ = store.extend(new)
+    climate_journal.wait_durable(ticket)
+    response_cache.invalidate('climate')
+    return added, duplicates
 
 # --- 数据库配置 ---
 DATABASE_PATH = os.path.join(DATA_DIR, 'climate.db')
+SERVICES_CSV_PATH = os.path.join(DATA_DIR, 'bayarea_services.csv')
+
+def observe_query(kind, seconds):
+    metrics.observe('sqlite_query_duration_seconds', seconds, statement=kind)
+
+# 连接池：跨请求复用连接（WAL 模式），进程退出时关闭；每条语句计时
+db_pool = ConnectionPool(DATABASE_PATH, on_query=observe_query)
+atexit.register(db_pool.close)
+
+# 表结构在第一次借连接时才初始化（每个连接池一次）
+_database_ready = None
+_database_init_lock = threading.Lock()
 
 def get_db_connection():
-    """创建数据库连接"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row  # 允许通过列名访问
-    return conn
+    """借用一个池化连接: `with get_db_connection() as conn:`"""
+    if _database_ready is not db_pool:
+        init_database()
+    return db_pool.connection()
 
 def init_database():
     """初始化数据库表结构"""
+    global _database_ready
+    started = time.perf_counter()
     # Ensure data directory exists
     os.makedirs(DATA_DIR, exist_ok=True)
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    # 创建用户发布信息表
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_posts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            category TEXT NOT NULL,
-            title TEXT NOT NULL,
-            description TEXT,
-            contact TEXT,
-            source TEXT DEFAULT '用户发布',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-
-    conn.commit()
-    conn.close()
-    print("✓ Database initialized successfully")
+    with _database_init_lock, db_pool.connection() as conn:
+        cursor = conn.cursor()
 
-# 初始化数据库（应用启动时）
-init_database()
+        # 创建用户发布信息表
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS user_posts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                category TEXT NOT NULL,
+                title TEXT NOT NULL,
+                description TEXT,
+                contact TEXT,
+                source TEXT DEFAULT '用户发布',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
 
-def get_services():
-    """Load and process services from CSV with better data structure"""
-    df = pd.read_csv(os.path.join(DATA_DIR, 'bayarea_services.csv'))
-    services = []
-
-    for _, row in df.iterrows():
-        title = row['Title']
-        source = row['Source']
-
-        # Extract category from title (most titles start with category info)
-        if '(' in title or '·' in title or '｜' in title:
-            parts = title.split('(')[0].split('·')[0].split('｜')[0]
-            category = parts.strip() if parts else "其他"
-            description = title
-        else:
-            category = "生活服务"
-            description = title
-
-        services.append({
-            'Category': category,
-            'Title': title,
-            'Description': description[:100] + '...' if len(description) > 100 else description,
-            'Contact': source,
-            'Source': source
-        })
-
-    return services
-
-def get_user_posts_from_db():
-    """从数据库获取用户发布的信息"""
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        # 用户发布的游标分页索引
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_user_posts_created
+            ON user_posts (created_at, id)
+        ''')
+
+        # 首页列表：抓取的服务 + 用户发布（由触发器同步），带索引以便分页
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS services (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                origin TEXT NOT NULL,
+                post_id INTEGER,
+                category TEXT NOT NULL,
+                title TEXT NOT NULL,
+                description TEXT,
+                contact TEXT,
+                source TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                generation INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        # Import generation of scraped rows (see ServiceCatalog); 0 for user posts
+        columns = [row[1] for row in cursor.execute('PRAGMA table_info(services)')]
+        if 'generation' not in columns:
+            cursor.execute('ALTER TABLE services ADD COLUMN generation INTEGER NOT NULL DEFAULT 0')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_services_created
+            ON services (created_at, id)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_services_category
+            ON services (category, created_at, id)
+        ''')
         cursor.execute('''
-            SELECT category, title, description, contact, source, created_at
+            CREATE INDEX IF NOT EXISTS idx_services_post
+            ON services (post_id) WHERE post_id IS NOT NULL
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS catalog_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS user_posts_to_services
+            AFTER INSERT ON user_posts
+            BEGIN
+                INSERT INTO services (origin, post_id, category, title, description,
+                                      contact, source, created_at)
+                VALUES ('user', NEW.id, NEW.category, NEW.title, NEW.description,
+                        NEW.contact, NEW.source, NEW.created_at);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS user_posts_from_services
+            AFTER DELETE ON user_posts
+            BEGIN
+                DELETE FROM services WHERE post_id = OLD.id;
+            END
+        ''')
+
+        # 统计表（由触发器维护）
+        post_stats.install(conn)
+
+        # Posts created before the services table existed
+        cursor.execute('''
+            INSERT INTO services (origin, post_id, category, title, description,
+                                  contact, source, created_at)
+            SELECT 'user', id, category, title, description, contact, source, created_at
             FROM user_posts
-            ORDER BY created_at DESC
+            WHERE id NOT IN (SELECT post_id FROM services WHERE post_id IS NOT NULL)
         ''')
-        rows = cursor.fetchall()
-        conn.close()
-
-        posts = []
-        for row in rows:
-            posts.append({
-                'Category': row['category'],
-                'Title': row['title'],
-                'Description': row['description'] if row['description'] else row['title'],
-                'Contact': row['contact'] if row['contact'] else '未提供',
-                'Source': row['source']
-            })
-        return posts
-    except Exception as e:
-        print(f"Error fetching user posts: {e}")
-        return []
-
-def get_all_services():
-    """Get both scraped and user-submitted services"""
-    services = get_services()
-    # Add user-submitted posts from database
-    user_posts = get_user_posts_from_db()
-    services.extend(user_posts)
-    return services
-
-def get_categories(services):
-    """Extract unique categories from services"""
-    categories = set()
-    for service in services:
-        categories.add(service['Category'])
-    return sorted(list(categories))
+
+        conn.commit()
+        _database_ready = db_pool
+    startup_report['database_init_ms'] = (time.perf_counter() - started) * 1000
+    print("✓ Database initialized successfully")
+
+def get_services():
+    """
+    Load classified services (Category, Title, Description, Contact,
+    Source) from the precomputed catalog artifact the crawler writes;
+    classify.py rebuilds it (vectorized) when the CSV has changed
+    """
+    from classify import load_services  # pandas: only when the CSV is (re)imported
+    with metrics.timer('services_csv_load_seconds'):
+        return load_services(SERVICES_CSV_PATH)
+
+# 服务目录：CSV 只在文件变化时导入数据库，用户发布通过版本号重建搜索索引
+catalog = ServiceCatalog(SERVICES_CSV_PATH,
+                         load_scraped=get_services,
+                         connect=get_db_connection)
+
+# 后台刷新（create_app 按配置启动）：定时抓取并在请求路径之外重建目录
+catalog_refresher = None
+
+# 响应缓存：键里带数据版本，写操作后再按范围清空
+response_cache = ResponseCache(max_entries=256, max_bytes=16 * 2**20)
+# The key is the catalog version refresh() brings the indexes to: one refresh per request
+services_cached = response_cache.cached('services', lambda: catalog.refresh())
+climate_cached = response_cache.cached('climate', lambda: sync_climate().version)
+
+PER_PAGE = 20
+
+def render(template, **context):
+    """render_template(), timed per template"""
+    with metrics.timer('template_render_duration_seconds', template=template):
+        return render_template(template, **context)
+
+def render_services_page(search_query='', category_filters=(), page=1,
+                         after=None, before=None, last=False, **messages):
+    """
+    Render one page of the services listing (any of category_filters)
+    from the catalog as of the request's refresh()
+    """
+    category = list(category_filters)
+    facets = catalog.facets()
+
+    if search_query:
+        # Ranked search results are paged by position within the matches
+        ids = catalog.search(search_query, category)
+        total_services = len(ids)
+        start_idx = (page - 1) * PER_PAGE
+        services = catalog.fetch(ids[start_idx:start_idx + PER_PAGE])
+    else:
+        # Keyset pagination; bare ?page=N links fall back to OFFSET
+        total_services = catalog.count(category, facets)
+        try:
+            services = catalog.page(category, after=after, before=before, last=last,
+                                    offset=(page - 1) * PER_PAGE, per_page=PER_PAGE,
+                                    total=total_services)
+        except ValueError:
+            services = catalog.page(category, per_page=PER_PAGE)
+            page = 1
+
+    total_pages = (total_services + PER_PAGE - 1) // PER_PAGE
+    if last:
+        page = max(total_pages, 1)
+
+    cursors = {}
+    if services and not search_query:
+        cursors = {'prev_cursor': services[0]['cursor'],
+                   'next_cursor': services[-1]['cursor']}
+
+    return render('bayarea.html',
+                           services=services,
+                           facets=facets,
+                           search_query=search_query,
+                           category_filters=category,
+                           page=page,
+                           total_pages=total_pages,
+                           total_services=total_services,
+                           **cursors,
+                           **messages)
 
 # --- 关键部分：首页路由 ---
-@app.route('/')
+@bp.route('/')
+@services_cached
 def index():
     # Get query parameters
     search_query = request.args.get('search', '').strip()
-    category_filter = request.args.get('category', '').strip()
-    page = int(request.args.get('page', 1))
-    per_page = 20
+    # ?category= may repeat to filter on several categories at once
+    category_filters = [c.strip() for c in request.args.getlist('category') if c.strip()]
+    page = max(int(request.args.get('page', 1)), 1)
 
-    # Get all services
-    services = get_all_services()
-
-    # Apply filters
-    if search_query:
-        services = [s for s in services if search_query.lower() in s['Title'].lower()
-                   or search_query.lower() in s['Description'].lower()]
-
-    if category_filter:
-        services = [s for s in services if s['Category'] == category_filter]
-
-    # Pagination
-    total_services = len(services)
-    total_pages = (total_services + per_page - 1) // per_page
-    start_idx = (page - 1) * per_page
-    end_idx = start_idx + per_page
-    paginated_services = services[start_idx:end_idx]
-
-    # Get categories for filter dropdown
-    all_categories = get_categories(get_all_services())
-
-    return render_template('bayarea.html',
-                         services=paginated_services,
-                         categories=all_categories,
-                         search_query=search_query,
-                         category_filter=category_filter,
-                         page=page,
-                         total_pages=total_pages,
-                         total_services=total_services)
+    return render_services_page(search_query, category_filters, page,
+                                after=request.args.get('after'),
+                                before=request.args.get('before'),
+                                last=request.args.get('last') == '1')
 
 # --- 数据库管理 API ---
-@app.route('/api/user-posts', methods=['GET'])
+USER_POSTS_DEFAULT_LIMIT = 100
+USER_POSTS_MAX_LIMIT = 1000
+
+USER_POST_COLUMNS = 'id, category, title, description, contact, source, created_at'
+
+def user_post_to_dict(row):
+    """Convert a user_posts row to its API representation"""
+    return {
+        'id': row['id'],
+        'category': row['category'],
+        'title': row['title'],
+        'description': row['description'],
+        'contact': row['contact'],
+        'source': row['source'],
+        'created_at': row['created_at']
+    }
+
+def query_user_posts(conn, after=None, limit=None):
+    """Cursor over user posts, newest first, starting after a cursor"""
+    sql = f'SELECT {USER_POST_COLUMNS} FROM user_posts'
+    params = []
+    if after:
+        sql += ' WHERE (created_at, id) < (?, ?)'
+        params.extend(decode_cursor(after))
+    sql += ' ORDER BY created_at DESC, id DESC'
+    if limit is not None:
+        sql += ' LIMIT ?'
+        params.append(limit)
+    return conn.execute(sql, params)
+
+def stream_user_posts(after=None):
+    """Yield user posts as NDJSON lines straight from the DB cursor"""
+    with get_db_connection() as conn:
+        for row in query_user_posts(conn, after):
+            yield json.dumps(user_post_to_dict(row), ensure_ascii=False) + '\n'
+
+@bp.route('/api/user-posts', methods=['GET'])
+@services_cached
 def get_user_posts_api():
-    """API endpoint to retrieve all user posts from database"""
+    """
+    API endpoint to retrieve user posts from database
+    - Query params: ?limit=100&after=<next_cursor>
+    - ?format=ndjson streams every post (after the cursor) one per line
+    """
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT id, category, title, description, contact, source, created_at
-            FROM user_posts
-            ORDER BY created_at DESC
-        ''')
-        rows = cursor.fetchall()
-        conn.close()
-
-        posts = []
-        for row in rows:
-            posts.append({
-                'id': row['id'],
-                'category': row['category'],
-                'title': row['title'],
-                'description': row['description'],
-                'contact': row['contact'],
-                'source': row['source'],
-                'created_at': row['created_at']
-            })
+        after = request.args.get('after') or None
+        if after:
+            decode_cursor(after)
+
+        if request.args.get('format') == 'ndjson':
+            return Response(stream_user_posts(after), mimetype='application/x-ndjson')
+
+        limit = int(request.args.get('limit', USER_POSTS_DEFAULT_LIMIT))
+        if not 1 <= limit <= USER_POSTS_MAX_LIMIT:
+            raise ValueError(f'limit must be between 1 and {USER_POSTS_MAX_LIMIT}')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        with get_db_connection() as conn:
+            total = post_stats.total(conn)
+            posts = [user_post_to_dict(row)
+                     for row in query_user_posts(conn, after, limit + 1)]
+
+        next_cursor = None
+        if len(posts) > limit:
+            posts = posts[:limit]
+            next_cursor = encode_cursor(posts[-1])
 
         return jsonify({
-            'total': len(posts),
-            'posts': posts
+            'total': total,
+            'posts': posts,
+            'next_cursor': next_cursor
         }), 200
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/user-posts/<int:post_id>', methods=['DELETE'])
+@bp.route('/api/user-posts/<int:post_id>', methods=['DELETE'])
 def delete_user_post(post_id):
     """Delete a user post by ID"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM user_posts WHERE id = ?', (post_id,))
-        conn.commit()
-        rows_deleted = cursor.rowcount
-        conn.close()
+        with get_db_connection() as conn:
+            cursor = conn.execute('DELETE FROM user_posts WHERE id = ?', (post_id,))
+            conn.commit()
+            rows_deleted = cursor.rowcount
+
+        if rows_deleted:
+            response_cache.invalidate('services')
 
         if rows_deleted == 0:
             return jsonify({'error': 'Post not found'}), 404
@@ -228,52 +470,31 @@ def delete_user_post(post_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/database-stats', methods=['GET'])
+@bp.route('/api/database-stats', methods=['GET'])
 def database_stats():
-    """Get statistics about the database"""
+    """
+    Get statistics about the database (from trigger-maintained tables)
+    - ?verify=1 recomputes from user_posts and rebuilds the tables on drift
+    """
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Count total posts
-        cursor.execute('SELECT COUNT(*) as count FROM user_posts')
-        total_posts = cursor.fetchone()['count']
-
-        # Count by category
-        cursor.execute('''
-            SELECT category, COUNT(*) as count
-            FROM user_posts
-            GROUP BY category
-            ORDER BY count DESC
-        ''')
-        categories = [{'category': row['category'], 'count': row['count']}
-                     for row in cursor.fetchall()]
-
-        # Get most recent post
-        cursor.execute('''
-            SELECT title, created_at
-            FROM user_posts
-            ORDER BY created_at DESC
-            LIMIT 1
-        ''')
-        recent = cursor.fetchone()
+        with get_db_connection() as conn:
+            stats = post_stats.read(conn)
 
-        conn.close()
+            if request.args.get('verify') == '1':
+                expected = post_stats.recompute(conn)
+                drifted = expected != stats
+                if drifted:
+                    post_stats.rebuild(conn)
+                    stats = expected
+                stats['verified'] = {'drifted': drifted}
 
-        return jsonify({
-            'total_user_posts': total_posts,
-            'categories': categories,
-            'most_recent_post': {
-                'title': recent['title'] if recent else None,
-                'created_at': recent['created_at'] if recent else None
-            }
-        }), 200
+        return jsonify(stats), 200
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 # --- 新增：处理用户发布信息 ---
-@app.route('/post', methods=['POST'])
+@bp.route('/post', methods=['POST'])
 def post_service():
     """Handle new service posting from users - saves to database"""
     try:
@@ -284,83 +505,122 @@ def post_service():
 
         # Validation
         if not title:
-            return render_template('bayarea.html',
-                                 services=get_all_services()[:20],
-                                 categories=get_categories(get_all_services()),
-                                 error="标题不能为空",
-                                 page=1,
-                                 total_pages=(len(get_all_services()) + 19) // 20,
-                                 total_services=len(get_all_services()))
+            return render_services_page(error="标题不能为空")
 
         # Save to database
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO user_posts (category, title, description, contact, source)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (category, title, description, contact if contact else '未提供', '用户发布'))
-        conn.commit()
-        post_id = cursor.lastrowid
-        conn.close()
-
+        with get_db_connection() as conn:
+            cursor = conn.execute('''
+                INSERT INTO user_posts (category, title, description, contact, source)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (category, title, description, contact if contact else '未提供', '用户发布'))
+            conn.commit()
+            post_id = cursor.lastrowid
+        response_cache.invalidate('services')
+        catalog.refresh()
+
+        metrics.inc('user_posts_created_total')
         print(f"✓ New post created with ID: {post_id}")
 
         # Redirect to home page with success message
-        all_services = get_all_services()
-        return render_template('bayarea.html',
-                             services=all_services[:20],
-                             categories=get_categories(all_services),
-                             success="信息发布成功！已保存到数据库",
-                             page=1,
-                             total_pages=(len(all_services) + 19) // 20,
-                             total_services=len(all_services))
+        return render_services_page(success="信息发布成功！已保存到数据库")
 
     except Exception as e:
+        metrics.inc('errors_total', where='post_service')
         print(f"Error posting service: {e}")
-        all_services = get_all_services()
-        return render_template('bayarea.html',
-                             services=all_services[:20],
-                             categories=get_categories(all_services),
-                             error=f"发布失败: {str(e)}",
-                             page=1,
-                             total_pages=(len(all_services) + 19) // 20,
-                             total_services=len(all_services))
+        return render_services_page(error=f"发布失败: {str(e)}")
+
+def optional_arg(name, convert):
+    """Query parameter converted with convert(), or None when absent"""
+    value = request.args.get(name, '').strip()
+    return convert(value) if value else None
+
+
+# --- 气候数据的输出格式：直接从列数组生成，不再逐行构造 dict ---
+CLIMATE_FORMATS = ('records', 'columns', 'csv', 'ndjson')
+STREAM_CHUNK_ROWS = 8192
+
+def _stream_rows(years, temps, header, line):
+    """Yield the rows formatted by line(year, temp), a chunk of lines at a time"""
+    if header:
+        yield header
+    # Only one chunk's worth of Python objects exists at a time
+    for start in range(0, len(years), STREAM_CHUNK_ROWS):
+        stop = start + STREAM_CHUNK_ROWS
+        yield ''.join(map(line, years[start:stop].tolist(), temps[start:stop].tolist()))
+
+def _ndjson_line(year, temp):
+    return f'{{"Year":{year},"Avg_Temp":{temp!r}}}\n'
+
+def climate_response(years, temps, fmt):
+    """
+    Climate rows in the ?format= the client asked for:
+    - records (default): [{"Year", "Avg_Temp"}, ...]
+    - columns: {"Year": [...], "Avg_Temp": [...]}, built from the arrays
+    - csv / ndjson: streamed in chunks (not cached; gzipped on the fly)
+    """
+    if fmt == 'columns':
+        return jsonify({'Year': years.tolist(), 'Avg_Temp': temps.tolist()}), 200
+    if fmt == 'csv':
+        return Response(_stream_rows(years, temps, 'Year,Avg_Temp\n', format_line),
+                        mimetype='text/csv')
+    if fmt == 'ndjson':
+        return Response(_stream_rows(years, temps, None, _ndjson_line),
+                        mimetype='application/x-ndjson')
+    return jsonify([{'Year': y, 'Avg_Temp': t}
+                    for y, t in zip(years.tolist(), temps.tolist())]), 200
+
+def climate_format():
+    """The requested ?format=, or None if it isn't one of CLIMATE_FORMATS"""
+    fmt = request.args.get('format', 'records')
+    return fmt if fmt in CLIMATE_FORMATS else None
+
+def invalid_format():
+    return jsonify({'error': f"format must be one of {', '.join(CLIMATE_FORMATS)}"}), 400
+
 
 # ============================================================================
 # EXERCISE 1: GET endpoint - Retrieve all climate records
 # ============================================================================
-@app.route('/api/climate', methods=['GET'])
+@bp.route('/api/climate', methods=['GET'])
+@climate_cached
 def get_all_climate():
     """
     TODO: Implement this endpoint
     - Return all climate records as JSON
     - Hint: Use df.to_dict('records')
+    - Now served from climate_store (same rows, insertion order)
+    - ?format=columns|csv|ndjson skip the per-row dicts (see climate_response);
+      large cached bodies are also served gzipped when accepted
     """
-    records = df.to_dict('records')
-    return jsonify(records), 200
+    fmt = climate_format()
+    if fmt is None:
+        return invalid_format()
+    return climate_response(*climate_store.columns(), fmt)
 
 
 # ============================================================================
 # EXERCISE 2: GET endpoint with ID - Retrieve specific year
 # ============================================================================
-@app.route('/api/climate/<int:year>', methods=['GET'])
+@bp.route('/api/climate/<int:year>', methods=['GET'])
+@climate_cached
 def get_climate_by_year(year):
     """
     TODO: Implement this endpoint
     - Find record matching the given year
     - Return 404 if year not found
     - Hint: Use df[df['Year'] == year]
+    - Now an O(1) lookup in the year -> row hash index
     """
-    record = df[df['Year'] == year]
-    if record.empty:
+    record = climate_store.get(year)
+    if record is None:
         return jsonify({'error': 'Year not found'}), 404
-    return jsonify(record.iloc[0].to_dict()), 200
+    return jsonify(record), 200
 
 
 # ============================================================================
 # EXERCISE 3: POST endpoint - Add new climate record
 # ============================================================================
-@app.route('/api/climate', methods=['POST'])
+@bp.route('/api/climate', methods=['POST'])
 def add_climate_record():
     """
     TODO: Implement this endpoint
@@ -369,8 +629,10 @@ def add_climate_record():
     - Add to DataFrame and CSV
     - Return 201 Created with new record
     - Hint: Use df.loc[] to append and df.to_csv()
+    - Now appends one line to the journal (group commit) instead of
+      rewriting the CSV; the journal is compacted into the CSV periodically
+      and shared by every worker process (see add_climate_rows)
     """
-    global df
     try:
         data = request.get_json()
 
@@ -378,77 +640,348 @@ def add_climate_record():
         if not data or 'Year' not in data or 'Avg_Temp' not in data:
             return jsonify({'error': 'Missing Year or Avg_Temp'}), 400
 
-        year = data['Year']
+        try:
+            year = int(data['Year'])
+            avg_temp = finite_float(data['Avg_Temp'])
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Year must be an integer and Avg_Temp a finite number'}), 400
 
-        # Check for duplicates
-        if not df[df['Year'] == year].empty:
+        # Check for duplicates (hash index, all workers) and journal the record
+        added, _ = add_climate_rows([(year, avg_temp)])
+        if not added:
             return jsonify({'error': f'Year {year} already exists'}), 409
+        record = added[0]
 
-        # Add record
-        new_record = pd.DataFrame([{'Year': year, 'Avg_Temp': data['Avg_Temp']}])
-        df = pd.concat([df, new_record], ignore_index=True)
-        df.to_csv(os.path.join(DATA_DIR, 'climate_data.csv'), index=False)
-        
-        return jsonify({'message': 'Record added', 'record': new_record.iloc[0].to_dict()}), 201
+        return jsonify({'message': 'Record added', 'record': record}), 201
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+def finite_float(value):
+    """float(value), rejecting NaN and infinities with ValueError"""
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f'not a finite number: {value!r}')
+    return number
+
+
+def parse_climate_rows():
+    """
+    Parse a bulk request body into [(year, temp), ...]. Accepts a JSON
+    array of {"Year", "Avg_Temp"} objects, NDJSON, or CSV with a header.
+    Raises ValueError naming the first bad row.
+    """
+    mimetype = request.mimetype
+    text = request.get_data(as_text=True)
+
+    if mimetype == 'text/csv':
+        items = csv.DictReader(io.StringIO(text))
+    elif mimetype == 'application/x-ndjson':
+        items = (json.loads(line) for line in text.splitlines() if line.strip())
+    else:
+        items = json.loads(text)
+        if not isinstance(items, list):
+            raise ValueError('Expected a JSON array of records')
+
+    rows = []
+    for number, item in enumerate(items, start=1):
+        try:
+            rows.append((int(item['Year']), finite_float(item['Avg_Temp'])))
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f'Row {number}: need integer Year and finite numeric Avg_Temp')
+    return rows
+
+
+# ============================================================================
+# Bulk ingest endpoint
+# ============================================================================
+@bp.route('/api/v2/climate/bulk', methods=['POST'])
+def bulk_add_climate():
+    """
+    Add many climate records in one request
+    - Body: JSON array, NDJSON (application/x-ndjson) or CSV (text/csv)
+    - Duplicate years (existing or repeated in the body) are skipped and
+      reported; the rest are journaled as a single batch
+    """
+    try:
+        rows = parse_climate_rows()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        added, duplicates = add_climate_rows(rows)
+        return jsonify({
+            'message': f'{len(added)} records added',
+            'added': len(added),
+            'duplicates': duplicates
+        }), 201 if added else 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 # ============================================================================
 # EXERCISE 4: Statistics endpoint - Compute analytics
 # ============================================================================
-@app.route('/api/statistics', methods=['GET'])
+@bp.route('/api/statistics', methods=['GET'])
+@climate_cached
 def get_statistics():
     """
     TODO: Implement this endpoint
     - Return: mean, min, max, std of Avg_Temp
     - Hint: Use df['Avg_Temp'].mean(), .min(), .max(), .std()
+    - Now maintained online (Welford) by climate_store, so this is O(1)
     """
-    stats = {
-        'mean': float(df['Avg_Temp'].mean()),
-        'min': float(df['Avg_Temp'].min()),
-        'max': float(df['Avg_Temp'].max()),
-        'std': float(df['Avg_Temp'].std()),
-        'count': len(df)
-    }
+    stats = climate_store.statistics()
     return jsonify(stats), 200
 
 
+@bp.route('/api/v2/statistics/rolling', methods=['GET'])
+@climate_cached
+def get_rolling_statistics():
+    """
+    Moving mean/std over a window of consecutive rows (year-sorted; years
+    missing from the data are skipped, not counted) plus per-bucket
+    aggregates (count/mean/min/max/std)
+    - Query params: ?window=10&bucket=10 (bucket=10 gives decades)
+    """
+    try:
+        window = int(request.args.get('window', 10))
+        bucket = int(request.args.get('bucket', 10))
+        if window < 1 or bucket < 1:
+            raise ValueError
+    except ValueError:
+        return jsonify({'error': 'window and bucket must be positive integers'}), 400
+
+    years, temps = climate_store.by_year()
+    return jsonify({
+        'window': window,
+        'bucket': bucket,
+        'rolling': rolling_stats(years, temps, window),
+        'buckets': group_stats(years, temps, bucket)
+    }), 200
+
+
+# ============================================================================
+# Chart aggregation endpoint
+# ============================================================================
+BUCKET_NAMES = {'year': 1, 'decade': 10, 'century': 100}
+AGGREGATE_MAX_POINTS = 10000
+
+_climate_pyramid = (None, None)
+_climate_pyramid_lock = threading.Lock()
+
+def climate_pyramid(store):
+    """Bucket pyramid for store, rebuilt only after the data changed"""
+    global _climate_pyramid
+    key = (id(store), store.version)
+    with _climate_pyramid_lock:
+        if _climate_pyramid[0] != key:
+            _climate_pyramid = (key, BucketPyramid(*store.by_year()))
+        return _climate_pyramid[1]
+
+@bp.route('/api/v2/climate/aggregate', methods=['GET'])
+@climate_cached
+def get_climate_aggregate():
+    """
+    Chart-sized views of the climate series, as columns
+    - ?bucket=year|decade|century|<years>: count/min/mean/max per bucket,
+      served from a precomputed pyramid
+    - ?points=<n>: the series downsampled to n points with LTTB instead
+    - ?min_year=&max_year= restrict either view
+    """
+    try:
+        min_year = optional_arg('min_year', int)
+        max_year = optional_arg('max_year', int)
+        points = optional_arg('points', int)
+        bucket = request.args.get('bucket', 'decade').strip()
+        size = BUCKET_NAMES[bucket] if bucket in BUCKET_NAMES else int(bucket)
+        if size < 1 or (points is not None and not 3 <= points <= AGGREGATE_MAX_POINTS):
+            raise ValueError
+    except ValueError:
+        return jsonify({'error': f'bucket must be year, decade, century or a positive '
+                                 f'integer; points between 3 and {AGGREGATE_MAX_POINTS}'}), 400
+
+    store = climate_store
+    if points is None:
+        return jsonify({'bucket': size,
+                        **climate_pyramid(store).buckets(size, min_year, max_year)}), 200
+
+    years, temps = store.by_year()
+    lo = 0 if min_year is None else np.searchsorted(years, min_year, side='left')
+    hi = len(years) if max_year is None else np.searchsorted(years, max_year, side='right')
+    years, temps = years[lo:hi], temps[lo:hi]
+    keep = lttb(years, temps, points)
+    return jsonify({'points': len(keep), 'total': len(years),
+                    'Year': years[keep].tolist(), 'Avg_Temp': temps[keep].tolist()}), 200
+
+
 # ============================================================================
 # EXERCISE 5: Temperature range query
 # ============================================================================
-@app.route('/api/climate/range', methods=['GET'])
+@bp.route('/api/climate/range', methods=['GET'])
+@climate_cached
 def get_temperature_range():
     """
     TODO: Implement this endpoint
     - Query params: ?min_temp=14&max_temp=15
     - Return records within temperature range
     - Hint: Use df[(df['Avg_Temp'] >= min_temp) & (df['Avg_Temp'] <= max_temp)]
+    - Now binary-searches the sorted Avg_Temp view; optional
+      ?min_year=&max_year= narrow it further via the sorted Year view
+    - ?format= as for /api/climate
     """
+    fmt = climate_format()
+    if fmt is None:
+        return invalid_format()
+
     try:
         min_temp = float(request.args.get('min_temp', 0))
         max_temp = float(request.args.get('max_temp', 100))
-        
-        filtered = df[(df['Avg_Temp'] >= min_temp) & (df['Avg_Temp'] <= max_temp)]
-        return jsonify(filtered.to_dict('records')), 200
-    
     except ValueError:
         return jsonify({'error': 'Invalid temperature values'}), 400
 
+    try:
+        min_year = optional_arg('min_year', int)
+        max_year = optional_arg('max_year', int)
+    except ValueError:
+        return jsonify({'error': 'Invalid year values'}), 400
+
+    years, temps = climate_store.columns(min_temp, max_temp, min_year, max_year)
+    return climate_response(years, temps, fmt)
+
 
 # ============================================================================
 # Health check endpoint
 # ============================================================================
-@app.route('/api/health', methods=['GET'])
+@bp.route('/api/health', methods=['GET'])
 def health_check():
-    return jsonify({'status': 'API is running', 'timestamp': datetime.now().isoformat()}), 200
+    return jsonify({'status': 'API is running', 'timestamp': datetime.now().isoformat(),
+                    'startup': startup_report}), 200
+
 
+# --- 气候图表页面：只下载图表宽度的降采样点，而不是内联全部数据 ---
+@bp.route('/climate')
+def climate_chart():
+    return render('index.html')
 
-# @app.route('/')
-# def index():
-#    records = df.to_dict('records')
-#    return render_template('index.html', data=records)
+
+# ============================================================================
+# Metrics and profiling
+# ============================================================================
+PROFILE_LINES = 40
+
+@bp.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if current_app.config['PROFILING'] and request.args.get('profile') == '1':
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            return  # another profiler is active (e.g. a concurrent ?profile=1)
+        g.profiler = profiler
+
+@bp.after_app_request
+def record_request(response):
+    """Per-route latency and status counts; ?profile=1 swaps in the cProfile summary"""
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        import pstats
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(PROFILE_LINES)
+        response = Response(out.getvalue(), mimetype='text/plain')
+
+    started = g.pop('request_started', None)
+    if started is not None:
+        endpoint = request.endpoint or 'unmatched'
+        metrics.observe('http_request_duration_seconds', time.perf_counter() - started,
+                        endpoint=endpoint, method=request.method)
+        metrics.inc('http_requests_total', endpoint=endpoint, method=request.method,
+                    status=str(response.status_code))
+    return response
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider with serialization timed"""
+
+    def dumps(self, obj, **kwargs):
+        with metrics.timer('json_serialize_duration_seconds'):
+            return super().dumps(obj, **kwargs)
+
+@bp.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus text format: counters, histograms and current cache/pool gauges"""
+    cache = response_cache.stats()
+    pool = db_pool.stats()
+    gauges = {f'response_cache_{name}': cache[name]
+              for name in ('entries', 'bytes', 'hits', 'misses', 'evictions')}
+    gauges.update(db_pool_open_connections=pool['open'], db_pool_idle_connections=pool['idle'])
+    if climate_store is not None:
+        gauges['climate_rows'] = len(climate_store)
+    return Response(metrics.render(gauges),
+                    content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@bp.route('/api/v2/catalog/refresh', methods=['GET'])
+def catalog_refresh_status():
+    """Background refresh status: state, last run's durations, item counts"""
+    if catalog_refresher is None:
+        return jsonify({'enabled': False}), 200
+    return jsonify({'enabled': True, **catalog_refresher.status()}), 200
+
+@bp.route('/api/v2/catalog/refresh', methods=['POST'])
+def trigger_catalog_refresh():
+    """Run the background refresh now instead of at the next interval"""
+    if catalog_refresher is None:
+        return jsonify({'error': 'Background catalog refresh is disabled'}), 409
+    catalog_refresher.trigger()
+    return jsonify({'message': 'Refresh scheduled', **catalog_refresher.status()}), 202
+
+
+# ============================================================================
+# Application factory
+# ============================================================================
+def create_app(config=None):
+    """
+    Build the Flask app. Data is loaded lazily on first use; set
+    config['PRELOAD'] to load the climate store and database schema now
+    instead (e.g. before forking workers with gunicorn --preload).
+    config['PROFILING'] (or CLIMATE_API_PROFILING=1) enables ?profile=1.
+    config['CATALOG_REFRESH_INTERVAL'] > 0 (seconds) starts the background
+    catalog refresh; with CATALOG_REFRESH_CRAWL off it only follows a CSV
+    crawled elsewhere (e.g. by `python src/refresher.py` as a sidecar).
+    """
+    global catalog_refresher
+    started = time.perf_counter()
+    # Correct paths, since we're in the src/ directory
+    flask_app = Flask(__name__,
+                      template_folder='../templates',
+                      static_folder='../static')
+    flask_app.json = TimedJSONProvider(flask_app)
+    flask_app.config.update(PRELOAD=False,
+                            PROFILING=os.environ.get('CLIMATE_API_PROFILING') == '1',
+                            CATALOG_REFRESH_INTERVAL=float(
+                                os.environ.get('CATALOG_REFRESH_INTERVAL', 0)),
+                            CATALOG_REFRESH_CRAWL=os.environ.get('CATALOG_REFRESH_CRAWL') != '0')
+    flask_app.config.update(config or {})
+    flask_app.register_blueprint(bp)
+    interval = flask_app.config['CATALOG_REFRESH_INTERVAL']
+    if interval > 0 and catalog_refresher is None:
+        # Requests stop importing the CSV themselves; the refresher swaps it in
+        catalog.watch_csv = False
+        crawl = crawl_to(SERVICES_CSV_PATH) if flask_app.config['CATALOG_REFRESH_CRAWL'] else None
+        catalog_refresher = CatalogRefresher(catalog, crawl, interval).start()
+    if flask_app.config['PRELOAD']:
+        ensure_climate()
+        init_database()
+    startup_report['create_app_ms'] = (time.perf_counter() - started) * 1000
+    return flask_app
+
+startup_report['import_ms'] = (time.perf_counter() - _import_started) * 1000
+app = create_app()
 
 
 if __name__ == '__main__':
@@ -456,16 +989,24 @@ if __name__ == '__main__':
     print("\n📱 Web Interface:")
     print("   GET  /                         - Bay Area Services (主页)")
     print("   POST /post                     - Submit new service")
+    print("   GET  /climate                  - Climate chart")
     print("\n📚 Climate API Endpoints:")
-    print("   GET  /api/climate              - All climate records")
+    print("   GET  /api/climate              - All climate records (?format=columns|csv|ndjson)")
     print("   GET  /api/climate/<year>       - Record by year")
     print("   POST /api/climate              - Add new record")
+    print("   POST /api/v2/climate/bulk      - Bulk add (JSON/NDJSON/CSV)")
     print("   GET  /api/statistics           - Temperature stats")
-    print("   GET  /api/climate/range        - Filter by range")
+    print("   GET  /api/v2/statistics/rolling - Moving window + per-decade stats")
+    print("   GET  /api/climate/range        - Filter by temp/year range")
+    print("   GET  /api/v2/climate/aggregate - Bucketed min/mean/max or LTTB downsample")
     print("   GET  /api/health               - Health check")
+    print("   GET  /api/metrics              - Prometheus metrics")
     print("\n💾 Database API Endpoints:")
-    print("   GET  /api/user-posts           - All user posts from database")
-    print("   GET  /api/database-stats       - Database statistics")
+    print("   GET  /api/user-posts           - User posts (?limit=&after=, ?format=ndjson)")
+    print("   GET  /api/database-stats       - Database statistics (?verify=1)")
     print("   DEL  /api/user-posts/<id>      - Delete user post by ID")
+    print("   GET  /api/v2/catalog/refresh   - Background refresh status (POST: run now)")
+    print(f"\n⏱  Startup: import {startup_report['import_ms']:.0f} ms, "
+          f"create_app {startup_report['create_app_ms']:.1f} ms (data loads on first use)")
     app.run(debug=True, port=5000, host='0.0.0.0')
     
@@ -0,0 +1,278 @@
+"""
+Append-only write path for climate_data.csv
+
+New records are appended as CSV lines to a journal next to the data file
+(`climate_data.csv.log`) instead of rewriting the whole CSV per insert.
+Once the journal holds `compact_every` rows it is folded back into the
+CSV, which is rewritten atomically (temp file + rename);
+on_compact(years, temps) then runs, e.g. to refresh a snapshot of the
+CSV, and the journal is replaced by an empty file.
+
+The journal is shared by every worker process:
+- writers hold exclusive() - a thread lock plus an flock on
+  `climate_data.csv.lock` - while they catch up, validate and write, so
+  duplicate checks see every process's rows
+- fsyncs are group-committed: whoever arrives first fsyncs on behalf of
+  every write made so far while the others wait for it
+- readers poll() with one stat(): a grown journal yields just the new
+  rows, a journal with a new inode (compacted by another process) means
+  reload the CSV and replay() it, under shared() so no compaction can
+  run in between
+"""
+
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # no flock (Windows): only safe with a single process
+    fcntl = None
+
+
+def format_line(year, temp):
+    """One journal/CSV line, matching DataFrame.to_csv() output"""
+    return f'{int(year)},{float(temp)!r}\n'
+
+
+def parse_lines(lines):
+    """Yield (year, temp) from journal lines, skipping torn/blank lines"""
+    for line in lines:
+        if not line.endswith('\n'):
+            break  # torn write at the tail of the journal
+        year, sep, temp = line.strip().partition(',')
+        if not sep:
+            continue
+        try:
+            yield int(year), float(temp)
+        except ValueError:
+            continue
+
+
+def _parse_chunk(data):
+    """(rows, complete_bytes, line_count) for journal bytes; ignores a torn tail"""
+    complete = data.rfind(b'\n') + 1
+    text = data[:complete].decode('utf-8')
+    return list(parse_lines(text.splitlines(keepends=True))), complete, text.count('\n')
+
+
+class ClimateJournal:
+    """Cross-process append-only journal with group fsync and compaction"""
+
+    def __init__(self, csv_path, journal_path=None, compact_every=1000, fsync=True,
+                 on_compact=None):
+        self.csv_path = csv_path
+        self.journal_path = journal_path or csv_path + '.log'
+        self.lock_path = csv_path + '.lock'
+        self.compact_every = compact_every
+        self.fsync = fsync
+        self.on_compact = on_compact
+
+        self._write_lock = threading.Lock()
+        self._state = threading.Lock()   # guards _position/_journaled
+        self._position = (None, 0)       # (inode, offset) of journal rows applied here
+        self._journaled = 0              # lines before _position
+
+        self._cond = threading.Condition()
+        self._written = 0      # last write ticket handed out
+        self._durable = 0      # every ticket up to here has been fsynced
+        self._syncing = False  # a leader is fsyncing
+        self._failed = {}      # ticket -> fsync error
+        self._recover()
+
+    # --- locking ---
+    @contextmanager
+    def _flock(self, mode):
+        if fcntl is None:
+            yield
+            return
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, mode)
+            yield
+        finally:
+            os.close(fd)  # releases the lock
+
+    @contextmanager
+    def exclusive(self):
+        """Write lock across threads and processes (not reentrant)"""
+        with self._write_lock, self._flock(fcntl.LOCK_EX if fcntl else None):
+            yield
+
+    @contextmanager
+    def shared(self):
+        """Keeps other processes from compacting (e.g. while reloading)"""
+        with self._flock(fcntl.LOCK_SH if fcntl else None):
+            yield
+
+    def _recover(self):
+        """Create the journal if needed and drop a torn last line left by a crash"""
+        with self.exclusive():
+            fd = os.open(self.journal_path, os.O_RDWR | os.O_CREAT, 0o644)
+            with os.fdopen(fd, 'rb+') as f:
+                data = f.read()
+                complete = data.rfind(b'\n') + 1
+                if complete < len(data):
+                    f.truncate(complete)
+                with self._state:
+                    self._position = (os.fstat(f.fileno()).st_ino, complete)
+                    self._journaled = data.count(b'\n')
+
+    # --- reading ---
+    def replay(self):
+        """
+        (year, temp) rows recorded in the journal, oldest first. poll()
+        continues from here.
+        """
+        try:
+            with open(self.journal_path, 'rb') as f:
+                data = f.read()
+                inode = os.fstat(f.fileno()).st_ino
+        except FileNotFoundError:
+            return []
+        rows, complete, lines = _parse_chunk(data)
+        with self._state:
+            self._position = (inode, complete)
+            self._journaled = lines
+        return rows
+
+    def poll(self):
+        """
+        Catch up with other processes: (reset, rows). rows were appended
+        since the last replay()/poll()/write(); reset means the journal
+        was compacted elsewhere, so reload the CSV and replay() instead.
+        """
+        try:
+            st = os.stat(self.journal_path)
+        except FileNotFoundError:
+            return False, []
+        with self._state:
+            inode, offset = self._position
+            if st.st_ino != inode:
+                return True, []
+            if st.st_size <= offset:
+                return False, []
+            with open(self.journal_path, 'rb') as f:
+                if os.fstat(f.fileno()).st_ino != inode:
+                    return True, []
+                f.seek(offset)
+                data = f.read()
+            rows, complete, lines = _parse_chunk(data)
+            self._position = (inode, offset + complete)
+            self._journaled += lines
+        return False, rows
+
+    @property
+    def pending_rows(self):
+        """Rows in the journal that are not yet folded into the CSV"""
+        return self._journaled
+
+    # --- writing ---
+    def append(self, rows, snapshot=None):
+        """
+        Durably record rows [(year, temp), ...]: write() under exclusive(),
+        then wait for the group fsync
+        """
+        with self.exclusive():
+            ticket = self.write(rows, snapshot)
+        self.wait_durable(ticket)
+
+    def write(self, rows, snapshot=None):
+        """
+        Append rows to the journal; call inside exclusive(). Returns a
+        ticket for wait_durable(). snapshot() -> (years, temps) is used to
+        compact the CSV once the journal is long enough, provided this
+        process had applied every journaled row before writing.
+        """
+        data = ''.join(format_line(year, temp) for year, temp in rows).encode('utf-8')
+        fd = os.open(self.journal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            st = os.fstat(fd)
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+        finally:
+            os.close(fd)
+
+        with self._state:
+            caught_up = self._position == (st.st_ino, st.st_size)
+            if caught_up:
+                # Otherwise poll() will read these rows along with the others'
+                self._position = (st.st_ino, st.st_size + len(data))
+                self._journaled += len(rows)
+            compact = caught_up and snapshot is not None and \
+                self._journaled >= self.compact_every
+        if compact:
+            try:
+                self._compact(snapshot)
+            except OSError as e:
+                # The rows are safe in the journal; retry next time
+                print(f"Climate journal compaction failed: {e}")
+
+        with self._cond:
+            self._written += 1
+            return self._written
+
+    def wait_durable(self, ticket):
+        """Block until the write with this ticket is fsynced (grouped)"""
+        if not self.fsync:
+            return
+        with self._cond:
+            while self._durable < ticket:
+                if self._syncing:
+                    self._cond.wait()
+                    continue
+                self._syncing = True
+                start, target = self._durable, self._written
+                self._cond.release()
+                error = None
+                try:
+                    fd = os.open(self.journal_path, os.O_RDONLY)
+                    try:
+                        os.fsync(fd)
+                    finally:
+                        os.close(fd)
+                except OSError as e:
+                    error = e
+                finally:
+                    self._cond.acquire()
+                if error is not None:
+                    for failed in range(start + 1, target + 1):
+                        self._failed[failed] = error
+                self._durable = target
+                self._syncing = False
+                self._cond.notify_all()
+            error = self._failed.pop(ticket, None)
+        if error is not None:
+            raise error
+
+    def compact(self, snapshot):
+        """Fold the journal into the CSV now"""
+        with self.exclusive():
+            self._compact(snapshot)
+
+    def _compact(self, snapshot):
+        """Rewrite the CSV from snapshot() and start a new journal"""
+        years, temps = snapshot()
+        tmp_path = self.csv_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write('Year,Avg_Temp\n')
+            f.writelines(format_line(y, t) for y, t in zip(years.tolist(), temps.tolist()))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.csv_path)
+        if self.on_compact is not None:
+            try:
+                self.on_compact(years, temps)
+            except OSError as e:
+                # The CSV is already current; a stale snapshot gets rebuilt on load
+                print(f"Climate snapshot refresh failed: {e}")
+
+        # Every journaled row is in the CSV now. The journal is replaced
+        # rather than truncated: the new inode tells other processes to reload.
+        tmp_path = self.journal_path + '.tmp'
+        open(tmp_path, 'wb').close()
+        os.replace(tmp_path, self.journal_path)
+        with self._state:
+            self._position = (os.stat(self.journal_path).st_ino, 0)
+            self._journaled = 0
@@ -0,0 +1,128 @@
+"""
+Columnar, memory-mapped snapshot of climate_data.csv
+
+The Year/Avg_Temp columns and the store's sorted views are saved as .npy
+arrays and opened with np.load(mmap_mode='r'), so worker processes share
+the pages through the OS cache and a cold start doesn't parse the CSV or
+re-sort anything.
+
+Layout (next to the CSV):
+
+    climate_data_snapshot/
+        CURRENT             {"format", "generation", "source_signature", "rows"}
+        <generation>/       Year.npy, Avg_Temp.npy, temp_order.npy,
+                            temp_sorted.npy, year_order.npy, year_sorted.npy
+
+A new generation is written to its own directory and published by
+atomically replacing CURRENT, so readers never see half a snapshot; old
+generations are removed afterwards (already-mapped files stay valid).
+The snapshot is stale once the CSV's mtime/size differs from
+source_signature - it is then rebuilt from the CSV, and the journal
+compaction writes a fresh one right after rewriting the CSV.
+"""
+
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+SNAPSHOT_FORMAT = 1
+ARRAYS = ('Year', 'Avg_Temp', 'temp_order', 'temp_sorted', 'year_order', 'year_sorted')
+
+
+def snapshot_dir(csv_path):
+    """data/climate_data.csv -> data/climate_data_snapshot"""
+    return os.path.splitext(csv_path)[0] + '_snapshot'
+
+
+def _signature(path):
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def read_csv_columns(csv_path):
+    """(years int64, temps float64) parsed from the CSV"""
+    import pandas as pd  # only needed when the snapshot is (re)built
+    frame = pd.read_csv(csv_path, usecols=['Year', 'Avg_Temp'],
+                        dtype={'Year': np.int64, 'Avg_Temp': np.float64})
+    return frame['Year'].to_numpy(), frame['Avg_Temp'].to_numpy()
+
+
+def build_columns(years, temps):
+    """The snapshot arrays for (years, temps): columns plus sorted views"""
+    years = np.asarray(years, dtype=np.int64)
+    temps = np.asarray(temps, dtype=np.float64)
+    temp_order = np.argsort(temps, kind='stable')
+    year_order = np.argsort(years, kind='stable')
+    return {'Year': years, 'Avg_Temp': temps,
+            'temp_order': temp_order, 'temp_sorted': temps[temp_order],
+            'year_order': year_order, 'year_sorted': years[year_order]}
+
+
+def write(csv_path, years, temps, directory=None, signature=None):
+    """
+    Publish a new snapshot generation of (years, temps) for csv_path.
+    signature is the CSV's as of when the columns were read (default: now).
+    """
+    directory = directory or snapshot_dir(csv_path)
+    columns = build_columns(years, temps)
+    generation = f'{time.time_ns()}-{os.getpid()}'
+    path = os.path.join(directory, generation)
+    os.makedirs(path)
+    for name in ARRAYS:
+        np.save(os.path.join(path, name + '.npy'), columns[name])
+
+    meta = {'format': SNAPSHOT_FORMAT, 'generation': generation,
+            'source_signature': signature or _signature(csv_path),
+            'rows': len(columns['Year'])}
+    current = os.path.join(directory, 'CURRENT')
+    with open(current + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(current + '.tmp', current)
+
+    for name in os.listdir(directory):
+        if name != generation and os.path.isdir(os.path.join(directory, name)):
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+    return columns
+
+
+def open_snapshot(csv_path, directory=None):
+    """Memory-mapped snapshot arrays, or None if missing, stale or damaged"""
+    directory = directory or snapshot_dir(csv_path)
+    try:
+        with open(os.path.join(directory, 'CURRENT'), encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('format') != SNAPSHOT_FORMAT or \
+                meta.get('source_signature') != _signature(csv_path):
+            return None
+        path = os.path.join(directory, meta['generation'])
+        columns = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+                   for name in ARRAYS}
+    except (OSError, ValueError, KeyError):
+        return None
+    if any(len(array) != meta['rows'] for array in columns.values()):
+        return None
+    return columns
+
+
+def load(csv_path, directory=None):
+    """
+    Snapshot arrays for csv_path: memory-mapped when the snapshot is
+    fresh, else rebuilt from the CSV (and saved, if the directory is
+    writable - otherwise kept in memory)
+    """
+    columns = open_snapshot(csv_path, directory)
+    if columns is not None:
+        return columns
+    signature = _signature(csv_path)
+    years, temps = read_csv_columns(csv_path)
+    try:
+        write(csv_path, years, temps, directory, signature)
+    except OSError as e:
+        print(f"Climate snapshot not saved ({e}); using the CSV in memory")
+        return build_columns(years, temps)
+    return open_snapshot(csv_path, directory) or build_columns(years, temps)
@@ -0,0 +1,318 @@
+"""
+Indexed in-memory climate store
+
+Keeps the Year/Avg_Temp columns as NumPy arrays plus three indexes:
+- a year -> row hash index for O(1) lookups
+- a sorted view of Avg_Temp (values + row positions) for searchsorted
+  range queries
+- a sorted view of Year for min_year/max_year range queries
+
+Appends update all indexes incrementally (amortized O(1) for the columns,
+one searchsorted + memmove per sorted view) instead of rebuilding them;
+extend() merges a whole batch into each sorted view at once. Summary
+statistics of Avg_Temp are maintained online the same way.
+"""
+
+import math
+import threading
+
+import numpy as np
+
+
+def _record(year, temp):
+    return {'Year': int(year), 'Avg_Temp': float(temp)}
+
+
+class RunningStats:
+    """
+    Online count/mean/variance (Welford) with min/max tracking. Batches are
+    merged with Chan et al.'s parallel update, so both add() and merge()
+    avoid touching earlier values.
+    """
+
+    def __init__(self, values=()):
+        values = np.asarray(values, dtype=np.float64)
+        self.count = len(values)
+        self.mean = float(values.mean()) if self.count else 0.0
+        self.m2 = float(((values - self.mean) ** 2).sum()) if self.count else 0.0
+        self.min = float(values.min()) if self.count else math.inf
+        self.max = float(values.max()) if self.count else -math.inf
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        if not other.count:
+            return
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self.m2 += other.m2 + delta * delta * self.count * other.count / total
+        self.mean += delta * other.count / total
+        self.count = total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def as_dict(self):
+        """mean/min/max/std (sample, like pandas) and count; None if undefined"""
+        return {
+            'mean': self.mean if self.count else None,
+            'min': self.min if self.count else None,
+            'max': self.max if self.count else None,
+            'std': math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else None,
+            'count': self.count
+        }
+
+
+class ClimateStore:
+    """Climate rows with hash and sorted indexes"""
+
+    def __init__(self, years=(), temps=()):
+        years = np.asarray(years, dtype=np.int64)
+        temps = np.asarray(temps, dtype=np.float64)
+        if years.shape != temps.shape:
+            raise ValueError('Year and Avg_Temp columns differ in length')
+
+        self._lock = threading.RLock()
+        self._size = len(years)
+        capacity = max(16, self._size)
+        self._years = np.empty(capacity, dtype=np.int64)
+        self._temps = np.empty(capacity, dtype=np.float64)
+        self._years[:self._size] = years
+        self._temps[:self._size] = temps
+
+        self._year_index = dict(zip(years.tolist(), range(self._size)))
+        self._temp_order = np.argsort(temps, kind='stable')
+        self._temp_sorted = temps[self._temp_order]
+        self._year_order = np.argsort(years, kind='stable')
+        self._year_sorted = years[self._year_order]
+        self._stats = RunningStats(temps)
+
+    @classmethod
+    def from_snapshot(cls, columns):
+        """
+        Build a store over climate_snapshot arrays without copying them,
+        so read-only memory maps stay shared between processes. The first
+        write copies whatever it has to change (growing a column or
+        inserting into a sorted view already allocates new arrays).
+        """
+        store = cls.__new__(cls)
+        store._lock = threading.RLock()
+        store._size = len(columns['Year'])
+        store._years = columns['Year']
+        store._temps = columns['Avg_Temp']
+        store._year_index = None  # built on first lookup, see _index()
+        store._temp_order = columns['temp_order']
+        store._temp_sorted = columns['temp_sorted']
+        store._year_order = columns['year_order']
+        store._year_sorted = columns['year_sorted']
+        store._stats = RunningStats(store._temps)
+        return store
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, year):
+        with self._lock:
+            return year in self._index()
+
+    def _index(self):
+        """The year -> row hash index (built lazily for snapshot-backed stores)"""
+        if self._year_index is None:
+            self._year_index = dict(zip(self._years[:self._size].tolist(), range(self._size)))
+        return self._year_index
+
+    @property
+    def version(self):
+        """Changes on every write (the store is append-only)"""
+        return self._size
+
+    @property
+    def years(self):
+        """Year column in insertion order (read-only view)"""
+        view = self._years[:self._size]
+        view.flags.writeable = False
+        return view
+
+    @property
+    def temps(self):
+        """Avg_Temp column in insertion order (read-only view)"""
+        view = self._temps[:self._size]
+        view.flags.writeable = False
+        return view
+
+    def append(self, year, temp):
+        """Add a row and update every index; raises KeyError on duplicates"""
+        year, temp = int(year), float(temp)
+        with self._lock:
+            if year in self._index():
+                raise KeyError(year)
+            if self._size == len(self._years):
+                capacity = max(16, 2 * len(self._years))
+                self._years = np.resize(self._years, capacity)
+                self._temps = np.resize(self._temps, capacity)
+
+            row = self._size
+            self._years[row] = year
+            self._temps[row] = temp
+            self._size += 1
+            self._year_index[year] = row
+
+            pos = np.searchsorted(self._temp_sorted, temp, side='right')
+            self._temp_sorted = np.insert(self._temp_sorted, pos, temp)
+            self._temp_order = np.insert(self._temp_order, pos, row)
+            pos = np.searchsorted(self._year_sorted, year, side='right')
+            self._year_sorted = np.insert(self._year_sorted, pos, year)
+            self._year_order = np.insert(self._year_order, pos, row)
+            self._stats.add(temp)
+        return _record(year, temp)
+
+    def _partition(self, rows):
+        added, duplicates, seen = [], [], set()
+        for year, temp in rows:
+            year, temp = int(year), float(temp)
+            if year in self._index() or year in seen:
+                duplicates.append(year)
+            else:
+                seen.add(year)
+                added.append((year, temp))
+        return added, duplicates
+
+    def partition(self, rows):
+        """
+        ([(year, temp)] that extend() would add, duplicate_years) without
+        changing the store, so the rows can be persisted first
+        """
+        with self._lock:
+            return self._partition(rows)
+
+    def extend(self, rows):
+        """
+        Add many (year, temp) rows in one pass. Duplicates (against the
+        store and within rows) are skipped; returns (added, duplicate_years).
+        """
+        with self._lock:
+            added, duplicates = self._partition(rows)
+            if not added:
+                return [], duplicates
+
+            years = np.fromiter((y for y, _ in added), dtype=np.int64, count=len(added))
+            temps = np.fromiter((t for _, t in added), dtype=np.float64, count=len(added))
+            start, stop = self._size, self._size + len(added)
+            if stop > len(self._years):
+                capacity = max(stop, 2 * len(self._years))
+                self._years = np.resize(self._years, capacity)
+                self._temps = np.resize(self._temps, capacity)
+            self._years[start:stop] = years
+            self._temps[start:stop] = temps
+            self._size = stop
+            rows_added = np.arange(start, stop)
+            self._year_index.update(zip(years.tolist(), rows_added.tolist()))
+
+            # One merge per sorted view instead of k separate inserts
+            order = np.argsort(temps, kind='stable')
+            pos = np.searchsorted(self._temp_sorted, temps[order], side='right')
+            self._temp_sorted = np.insert(self._temp_sorted, pos, temps[order])
+            self._temp_order = np.insert(self._temp_order, pos, rows_added[order])
+            order = np.argsort(years, kind='stable')
+            pos = np.searchsorted(self._year_sorted, years[order], side='right')
+            self._year_sorted = np.insert(self._year_sorted, pos, years[order])
+            self._year_order = np.insert(self._year_order, pos, rows_added[order])
+            self._stats.merge(RunningStats(temps))
+            return [_record(y, t) for y, t in added], duplicates
+
+    def snapshot(self, pending=()):
+        """
+        Copies of the (years, temps) columns, consistent with each other,
+        followed by the [(year, temp)] rows in pending
+        """
+        with self._lock:
+            years, temps = self._years[:self._size], self._temps[:self._size]
+            if not pending:
+                return years.copy(), temps.copy()
+            return (np.concatenate((years, np.fromiter((y for y, _ in pending), dtype=np.int64,
+                                                       count=len(pending)))),
+                    np.concatenate((temps, np.fromiter((t for _, t in pending), dtype=np.float64,
+                                                       count=len(pending)))))
+
+    def statistics(self):
+        """Avg_Temp summary statistics, O(1)"""
+        with self._lock:
+            return self._stats.as_dict()
+
+    def by_year(self):
+        """Copies of (years, temps) ordered by year"""
+        with self._lock:
+            return self._year_sorted.copy(), self._temps[self._year_order]
+
+    def get(self, year):
+        """Record for a year, or None"""
+        with self._lock:
+            row = self._index().get(year)
+            if row is None:
+                return None
+            return _record(self._years[row], self._temps[row])
+
+    def _rows_to_records(self, rows):
+        return [_record(y, t) for y, t in
+                zip(self._years[rows].tolist(), self._temps[rows].tolist())]
+
+    @staticmethod
+    def _slice(sorted_values, order, low, high):
+        """Row positions whose value lies in [low, high] (None = unbounded)"""
+        start = 0 if low is None else np.searchsorted(sorted_values, low, side='left')
+        stop = len(sorted_values) if high is None else \
+            np.searchsorted(sorted_values, high, side='right')
+        return order[start:max(start, stop)]
+
+    def query(self, min_temp=None, max_temp=None, min_year=None, max_year=None):
+        """
+        Records within the temperature and year bounds (inclusive), in
+        insertion order
+        """
+        with self._lock:
+            return self._rows_to_records(self._rows(min_temp, max_temp, min_year, max_year))
+
+    def columns(self, min_temp=None, max_temp=None, min_year=None, max_year=None):
+        """query() as copies of the (years, temps) columns, without per-row dicts"""
+        with self._lock:
+            if min_temp is None and max_temp is None and min_year is None and max_year is None:
+                return self._years[:self._size].copy(), self._temps[:self._size].copy()
+            rows = self._rows(min_temp, max_temp, min_year, max_year)
+            return self._years[rows], self._temps[rows]
+
+    def _rows(self, min_temp, max_temp, min_year, max_year):
+        """
+        Sorted row positions within the bounds; call with the lock held.
+        The narrower of the two sorted-index slices is taken first, then
+        filtered on the other column.
+        """
+        by_temp = self._slice(self._temp_sorted, self._temp_order, min_temp, max_temp)
+        if min_year is None and max_year is None:
+            rows = by_temp
+        else:
+            by_year = self._slice(self._year_sorted, self._year_order,
+                                  min_year, max_year)
+            if min_temp is None and max_temp is None:
+                rows = by_year
+            elif len(by_year) < len(by_temp):
+                temps = self._temps[by_year]
+                keep = np.ones(len(by_year), dtype=bool)
+                if min_temp is not None:
+                    keep &= temps >= min_temp
+                if max_temp is not None:
+                    keep &= temps <= max_temp
+                rows = by_year[keep]
+            else:
+                years = self._years[by_temp]
+                keep = np.ones(len(by_temp), dtype=bool)
+                if min_year is not None:
+                    keep &= years >= min_year
+                if max_year is not None:
+                    keep &= years <= max_year
+                rows = by_temp[keep]
+        return np.sort(rows)
@@ -0,0 +1,100 @@
+"""
+Persistent crawl state for incremental crawling
+
+Remembers, per URL, the validators the server sent (ETag/Last-Modified)
+and a hash of the body we last parsed. The crawler sends them back as
+If-None-Match/If-Modified-Since and skips parsing on 304 or when the body
+hash is unchanged. The links discovered on a page are stored too, so a
+304 on the start page still yields the category URLs.
+"""
+
+import hashlib
+import json
+
+from db import ConnectionPool
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS pages (
+        url TEXT PRIMARY KEY,
+        etag TEXT,
+        last_modified TEXT,
+        content_hash TEXT,
+        links TEXT,
+        status INTEGER,
+        fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+
+def content_hash(body):
+    """Stable hash of a response body (bytes)"""
+    return hashlib.sha256(body).hexdigest()
+
+
+class CrawlState:
+    """SQLite-backed per-URL validators, body hashes and links"""
+
+    def __init__(self, path):
+        self.path = path
+        self._pool = ConnectionPool(path, size=2)
+        with self._pool.connection() as conn:
+            conn.execute(SCHEMA)
+            conn.commit()
+
+    def get(self, url):
+        """Stored row for url, or None"""
+        with self._pool.connection() as conn:
+            return conn.execute('SELECT * FROM pages WHERE url = ?', (url,)).fetchone()
+
+    def conditional_headers(self, url):
+        """If-None-Match/If-Modified-Since headers for a revisit"""
+        row = self.get(url)
+        headers = {}
+        if row is not None:
+            if row['etag']:
+                headers['If-None-Match'] = row['etag']
+            if row['last_modified']:
+                headers['If-Modified-Since'] = row['last_modified']
+        return headers
+
+    def is_unchanged(self, url, digest):
+        """True if digest matches the last body we parsed for url"""
+        row = self.get(url)
+        return row is not None and row['content_hash'] == digest
+
+    def links(self, url):
+        """Links stored for url by the last record_all()"""
+        row = self.get(url)
+        return json.loads(row['links']) if row is not None and row['links'] else []
+
+    def record_all(self, records):
+        """
+        Store validators, body hash and links after successful fetches,
+        for many (url, response, digest, links) in one transaction
+        """
+        with self._pool.connection() as conn:
+            conn.executemany('''
+                INSERT INTO pages (url, etag, last_modified, content_hash, links, status,
+                                   fetched_at)
+                VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT (url) DO UPDATE SET
+                    etag = excluded.etag,
+                    last_modified = excluded.last_modified,
+                    content_hash = excluded.content_hash,
+                    links = COALESCE(excluded.links, links),
+                    status = excluded.status,
+                    fetched_at = excluded.fetched_at
+            ''', ((url, response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                   digest, json.dumps(links, ensure_ascii=False) if links is not None else None,
+                   response.status_code) for url, response, digest, links in records))
+            conn.commit()
+
+    def touch(self, url, status):
+        """Note a revisit that didn't change the page (e.g. a 304)"""
+        with self._pool.connection() as conn:
+            conn.execute('UPDATE pages SET status = ?, fetched_at = CURRENT_TIMESTAMP '
+                         'WHERE url = ?', (status, url))
+            conn.commit()
+
+    def close(self):
+        self._pool.close()
@@ -1,64 +1,247 @@
-import requests
-from bs4 import BeautifulSoup
-import pandas as pd
 import urllib3
-import time
+import csv
+import hashlib
+import os
+import unicodedata
+from urllib.parse import urljoin
+
+from classify import build_artifact
+from crawl_state import CrawlState, content_hash
+from extract import anchors, response_text
+from fetcher import FetchEngine
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 # 只给一个首页作为起点
 START_URL = "https://www.dadi360.com/"
 
-def discovery_engine():
-    headers = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'}
-    all_data = []
-    
-    print(f"🚀 启动自动发现引擎，目标：{START_URL}")
-    
+# 输出写到项目的 data/ 目录，而不是当前工作目录
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+OUTPUT_PATH = os.path.join(DATA_DIR, 'bayarea_services.csv')
+FIELDNAMES = ('Title', 'Source')
+
+def discover_category_urls(html, start_url):
+    """自动寻找所有包含 "class" 或 "list" 字样的链接"""
+    category_urls = []
+    for href, _ in anchors(html):
+        # 自动识别分类页面的新特征
+        if href and ('list' in href or 'class' in href):
+            full_url = urljoin(start_url, href)
+            if full_url not in category_urls:
+                category_urls.append(full_url)
+    return category_urls
+
+def extract_titles(html, backend=None):
+    """Anchor texts that look like listing titles (15-80 chars)"""
+    titles = []
+    for _, text in anchors(html, backend):
+        t = text.strip()
+        if 15 < len(t) < 80:
+            titles.append(t)
+    return titles
+
+def normalize_title(title):
+    """Dedupe key text: NFKC-folded, whitespace-collapsed, lower-cased"""
+    return ' '.join(unicodedata.normalize('NFKC', title).split()).lower()
+
+class Deduper:
+    """
+    Pipeline stage that drops rows whose normalized title was already
+    seen. Only an 8-byte digest per title is kept, so memory stays small
+    however many rows stream through.
+    """
+
+    def __init__(self):
+        self.seen = set()
+        self.duplicates = 0
+
+    def __call__(self, rows):
+        for row in rows:
+            key = hashlib.blake2b(normalize_title(row['Title']).encode('utf-8'),
+                                  digest_size=8).digest()
+            if key in self.seen:
+                self.duplicates += 1
+                continue
+            self.seen.add(key)
+            yield row
+
+class BatchedCsvWriter:
+    """
+    Streams rows to `<path>.partial`, flushing every batch_size rows, and
+    commit() atomically renames it over path. If the run dies first the
+    flushed rows stay in the .partial file and path is left untouched.
+    """
+
+    def __init__(self, path, fieldnames=FIELDNAMES, batch_size=500):
+        self.path = path
+        self.partial_path = path + '.partial'
+        self.fieldnames = fieldnames
+        self.batch_size = batch_size
+        self.written = 0
+        self._file = None
+        self._writer = None
+        self._pending = 0
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._file = open(self.partial_path, 'w', newline='', encoding='utf-8')
+        self._writer = csv.DictWriter(self._file, fieldnames=self.fieldnames)
+        self._writer.writeheader()
+        return self
+
+    def write_all(self, rows):
+        for row in rows:
+            self._writer.writerow(row)
+            self.written += 1
+            self._pending += 1
+            if self._pending >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+
+    def commit(self):
+        self.flush()
+        self._file.close()
+        os.replace(self.partial_path, self.path)
+
+    def discard(self):
+        self._file.close()
+        os.remove(self.partial_path)
+
+    def __exit__(self, *exc):
+        # Keep whatever was flushed if we're unwinding from a failure
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+def read_rows(path, exclude_sources=()):
+    """Stream rows from an existing output CSV, skipping some Sources"""
+    if not os.path.exists(path):
+        return
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            if row['Source'] not in exclude_sources:
+                yield {'Title': row['Title'], 'Source': row['Source']}
+
+def crawl_rows(start_url, engine, state, incremental, max_categories, stats, records):
+    """
+    Extract stage: fetch start_url and its category pages, yielding
+    {'Title', 'Source'} rows for every page that changed as its response
+    arrives. Changed/unchanged page URLs are recorded in stats; the
+    (url, response, digest, links) to store in state are appended to
+    records, for the caller to persist once the output is committed.
+    """
+    conditional = state.conditional_headers if incremental else None
     try:
-        # 第一步：获取首页，寻找分类链接
-        resp = requests.get(START_URL, headers=headers, verify=False, timeout=10)
-        soup = BeautifulSoup(resp.text, 'html.parser')
-        
-        # 自动寻找所有包含 "class_" 或 "list" 字样的链接
-        links = soup.find_all('a', href=True)
-        category_urls = []
-        for l in links:
-            href = l['href']
-            # 自动识别分类页面的新特征
-            if 'list' in href or 'class' in href:
-                full_url = href if href.startswith('http') else START_URL + href.lstrip('/')
-                if full_url not in category_urls:
-                    category_urls.append(full_url)
-        
+        # 第一步：获取首页，寻找分类链接（未变化时沿用上次发现的链接）
+        resp = engine.fetch(start_url, conditional(start_url) if conditional else None)
+        if resp.error is not None:
+            raise resp.error
+        if resp.status == 304:
+            category_urls = state.links(start_url)
+            state.touch(start_url, 304)
+        else:
+            digest = content_hash(resp.response.content)
+            if incremental and state.is_unchanged(start_url, digest):
+                category_urls = state.links(start_url)
+                records.append((start_url, resp.response, digest, None))
+            else:
+                category_urls = discover_category_urls(response_text(resp.response), start_url)
+                records.append((start_url, resp.response, digest, category_urls))
+
         print(f"🔍 自动发现 {len(category_urls)} 个潜在分类入口。")
-        
-        # 第二步：自动深入前 3 个分类抓取内容
-        for cat_url in category_urls[:50]:
-            print(f"📡 正在自动钻取: {cat_url}")
-            r = requests.get(cat_url, headers=headers, verify=False, timeout=10)
-            if r.status_code == 200:
-                s = BeautifulSoup(r.text, 'html.parser')
-                items = s.find_all('a')
-                count = 0
-                for i in items:
-                    t = i.get_text().strip()
-                    if 15 < len(t) < 80:
-                        all_data.append({'Title': t, 'Source': cat_url})
-                        count += 1
-                print(f"✅ 成功捕获 {count} 条条目")
-                time.sleep(1)
+
+        # 第二步：并发抓取前 max_categories 个分类（按主机限速，失败自动重试）
+        for result in engine.fetch_all(category_urls[:max_categories], conditional):
+            if result.status == 304:
+                stats['unchanged'] += 1
+                state.touch(result.url, 304)
+            elif result.ok:
+                digest = content_hash(result.response.content)
+                if incremental and state.is_unchanged(result.url, digest):
+                    stats['unchanged'] += 1
+                else:
+                    titles = extract_titles(response_text(result.response))
+                    stats['changed'].add(result.url)
+                    print(f"✅ {result.url} 成功捕获 {len(titles)} 条条目 ({result.elapsed:.2f}s)")
+                    for title in titles:
+                        yield {'Title': title, 'Source': result.url}
+                # Stored only after the output is committed: a failed run
+                # must re-extract this page next time, not see it as unchanged
+                records.append((result.url, result.response, digest, None))
             else:
-                print(f"❌ 入口失效 (Status: {r.status_code})")
+                print(f"❌ 入口失效 {result.url} (Status: {result.status}, Error: {result.error})")
 
     except Exception as e:
         print(f"💥 引擎故障: {e}")
 
-    if all_data:
-        pd.DataFrame(all_data).to_csv('bayarea_services.csv', index=False)
-        print(f"\n🏆 自动化任务圆满完成！共捕获 {len(all_data)} 条数据。")
-    else:
-        print("\n🤔 首页虽在，但未发现有效链接。建议直接手动复制浏览器里的一个分类页 URL。")
+def discovery_engine(start_url=START_URL, engine=None, max_categories=50,
+                     output_path=OUTPUT_PATH, state_path=None, batch_size=500):
+    """
+    Crawl start_url, discover category pages and fetch them concurrently.
+    Pages are revisited with conditional GETs; only pages that changed
+    are re-extracted.
+
+    Rows flow through extract -> dedupe -> write without being collected:
+    changed pages first, then the previous output's rows for every other
+    page, into `<output_path>.partial`, which replaces output_path at the
+    end. Returns a stats dict (written, duplicates, changed, unchanged).
+    """
+    own_engine = engine is None
+    engine = engine or FetchEngine()
+    state = CrawlState(state_path or os.path.join(
+        os.path.dirname(os.path.abspath(output_path)), 'crawl_state.db'))
+    # Without the previous output there is nothing to carry unchanged pages from
+    incremental = os.path.exists(output_path)
+    stats = {'changed': set(), 'unchanged': 0}
+    records = []
+    dedupe = Deduper()
+
+    print(f"🚀 启动自动发现引擎，目标：{start_url}")
+
+    try:
+        with BatchedCsvWriter(output_path, batch_size=batch_size) as writer:
+            writer.write_all(dedupe(crawl_rows(start_url, engine, state, incremental,
+                                               max_categories, stats, records)))
+            if stats['changed']:
+                writer.write_all(dedupe(read_rows(output_path, stats['changed'])))
+                writer.commit()
+            else:
+                writer.discard()
+        state.record_all(records)
+    finally:
+        print(f"⏱  抓取统计: {engine.summary()}，未变化页面 {stats['unchanged']} 个")
+        state.close()
+        if own_engine:
+            engine.close()
+
+    result = {'written': writer.written if stats['changed'] else 0,
+              'duplicates': dedupe.duplicates,
+              'changed': len(stats['changed']),
+              'unchanged': stats['unchanged']}
+    if not stats['changed']:
+        print("\n😴 没有页面发生变化，数据保持不变。" if stats['unchanged'] else
+              "\n🤔 首页虽在，但未发现有效链接。建议直接手动复制浏览器里的一个分类页 URL。")
+        return result
+
+    # 预先分类，网站启动时直接加载，无需逐行处理
+    build_artifact(output_path)
+    print(f"\n🏆 自动化任务圆满完成！{result['changed']} 个页面有更新，"
+          f"共 {result['written']} 条数据（去重 {result['duplicates']} 条）。")
+    return result
 
 if __name__ == "__main__":
-    discovery_engine()
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description='Bay Area services crawler')
+    parser.add_argument('--start-url', default=START_URL)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=2.0, help='requests/second per host')
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--output', default=OUTPUT_PATH)
+    args = parser.parse_args()
+    discovery_engine(args.start_url, FetchEngine(concurrency=args.concurrency,
+                                                 rate=args.rate, retries=args.retries),
+                     output_path=args.output)
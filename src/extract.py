@@ -0,0 +1,152 @@
+"""
+Anchor-only HTML extraction for the crawler
+
+The crawler only ever needs the <a> elements of a page (their href and
+text), so building a full BeautifulSoup tree per page is wasted work.
+This module parses just the anchors, through one of several backends:
+
+- htmlparser: a streaming html.parser.HTMLParser subclass (stdlib, no tree)
+- lxml:       lxml.html (C parser), when lxml is installed
+- strainer:   BeautifulSoup with SoupStrainer('a')
+- soup:       a full BeautifulSoup tree (the old behaviour, kept as a baseline)
+
+DEFAULT_BACKEND is htmlparser, which needs nothing beyond the stdlib;
+lxml is opt-in (backend='lxml') since it is not in requirements.txt. See
+bench_extract.py for a comparison on the fixture pages.
+
+Pages are decoded from the raw response bytes: the charset comes from the
+Content-Type header, else a <meta> declaration, else UTF-8 if it decodes,
+else charset_normalizer's guess.
+"""
+
+import re
+from html.parser import HTMLParser
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+try:
+    import lxml.html
+except ImportError:  # optional, htmlparser is the fallback
+    lxml = None
+
+_HEADER_CHARSET = re.compile(r'charset\s*=\s*["\']?([\w.:-]+)', re.I)
+_META_CHARSET = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?([\w.:-]+)', re.I)
+
+
+class AnchorParser(HTMLParser):
+    """Collects (href, text) for every <a>, without building a tree"""
+
+    def __init__(self):
+        super().__init__()
+        self.anchors = []
+        self._href = None
+        self._text = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            # <a> can't nest; a new one closes any unterminated anchor
+            self._close()
+            self._href = dict(attrs).get('href')
+            self._text = []
+
+    def handle_endtag(self, tag):
+        if tag == 'a':
+            self._close()
+
+    def handle_data(self, data):
+        if self._text is not None:
+            self._text.append(data)
+
+    def _close(self):
+        if self._text is not None:
+            self.anchors.append((self._href, ''.join(self._text)))
+            self._href = self._text = None
+
+    def close(self):
+        super().close()
+        self._close()
+
+
+def _htmlparser_anchors(html):
+    parser = AnchorParser()
+    parser.feed(html)
+    parser.close()
+    return parser.anchors
+
+
+def _soup_anchors(soup):
+    return [(a.get('href'), a.get_text()) for a in soup.find_all('a')]
+
+
+def _strainer_anchors(html):
+    return _soup_anchors(BeautifulSoup(html, 'html.parser', parse_only=SoupStrainer('a')))
+
+
+def _full_soup_anchors(html):
+    return _soup_anchors(BeautifulSoup(html, 'html.parser'))
+
+
+def _lxml_anchors(html):
+    if not html.strip():
+        return []
+    root = lxml.html.fromstring(html.encode('utf-8'),
+                                parser=lxml.html.HTMLParser(encoding='utf-8'))
+    return [(a.get('href'), a.text_content()) for a in root.iter('a')]
+
+
+BACKENDS = {
+    'htmlparser': _htmlparser_anchors,
+    'strainer': _strainer_anchors,
+    'soup': _full_soup_anchors,
+}
+if lxml is not None:
+    BACKENDS['lxml'] = _lxml_anchors
+
+DEFAULT_BACKEND = 'htmlparser'
+
+
+def anchors(html, backend=None):
+    """[(href or None, text)] for every <a> in html, in document order"""
+    try:
+        parse = BACKENDS[backend or DEFAULT_BACKEND]
+    except KeyError:
+        raise ValueError(f'unknown extraction backend: {backend!r} '
+                         f'(available: {", ".join(sorted(BACKENDS))})')
+    return parse(html)
+
+
+def _known(encoding):
+    try:
+        b''.decode(encoding)
+        return True
+    except LookupError:
+        return False
+
+
+def detect_charset(content, content_type=None):
+    """Charset of a page body: header, then <meta>, then UTF-8, then a guess"""
+    if content_type:
+        match = _HEADER_CHARSET.search(content_type)
+        if match and _known(match.group(1)):
+            return match.group(1).lower()
+    match = _META_CHARSET.search(content[:4096])
+    if match and _known(match.group(1).decode('ascii')):
+        return match.group(1).decode('ascii').lower()
+    try:
+        content.decode('utf-8')
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    from charset_normalizer import from_bytes
+    best = from_bytes(content).best()
+    return best.encoding if best is not None else 'utf-8'
+
+
+def decode(content, content_type=None):
+    """Page bytes -> str using detect_charset"""
+    return content.decode(detect_charset(content, content_type), errors='replace')
+
+
+def response_text(response):
+    """Decoded body of a requests.Response, from response.content"""
+    return decode(response.content, response.headers.get('Content-Type'))
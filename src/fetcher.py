@@ -0,0 +1,164 @@
+"""
+Concurrent page fetcher for the crawler
+
+A thread pool over one shared requests.Session (keep-alive connection
+pooling), with:
+- a per-host token bucket instead of a fixed sleep between requests
+- retries with exponential backoff on connection errors and 429/5xx
+- per-URL timing stats
+"""
+
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_HEADERS = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'}
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second with bursts up to `capacity`"""
+
+    def __init__(self, rate, capacity=1, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, sleeping until one is available; returns the wait"""
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.capacity,
+                               self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Going negative reserves a future token, so the sleep can
+            # happen outside the lock
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            self._sleep(wait)
+        return wait
+
+
+class FetchResult:
+    """Outcome of fetching one URL"""
+
+    def __init__(self, url, response=None, error=None, elapsed=0.0, attempts=0):
+        self.url = url
+        self.response = response
+        self.error = error
+        self.elapsed = elapsed
+        self.attempts = attempts
+
+    @property
+    def status(self):
+        return self.response.status_code if self.response is not None else None
+
+    @property
+    def ok(self):
+        return self.status == 200
+
+    def as_dict(self):
+        return {'url': self.url, 'status': self.status, 'elapsed': round(self.elapsed, 4),
+                'attempts': self.attempts, 'error': str(self.error) if self.error else None}
+
+
+class FetchEngine:
+    """Fetches many URLs concurrently with pooling, rate limits and retries"""
+
+    def __init__(self, concurrency=8, rate=2.0, burst=2, retries=3, backoff=0.5,
+                 timeout=10, headers=None, verify=False):
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = burst
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.verify = verify
+
+        self.session = requests.Session()
+        self.session.headers.update(headers or DEFAULT_HEADERS)
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.timings = []
+
+    def _bucket(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = self._buckets[host] = TokenBucket(self.rate, self.burst)
+            return bucket
+
+    def _backoff_delay(self, attempt, response):
+        """Honour a numeric Retry-After, else exponential backoff with jitter"""
+        if response is not None:
+            retry_after = response.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                return float(retry_after)
+        return self.backoff * (2 ** (attempt - 1)) * (1 + random.random() / 4)
+
+    def fetch(self, url, headers=None):
+        """GET one URL with rate limiting and retries"""
+        bucket = self._bucket(url)
+        start = time.perf_counter()
+        response, error, attempt = None, None, 0
+        while attempt <= self.retries:
+            attempt += 1
+            bucket.acquire()
+            try:
+                response = self.session.get(url, headers=headers, timeout=self.timeout,
+                                            verify=self.verify)
+                error = None
+            except (requests.ConnectionError, requests.Timeout) as e:
+                response, error = None, e
+            if error is None and response.status_code not in RETRY_STATUSES:
+                break
+            if attempt <= self.retries:
+                time.sleep(self._backoff_delay(attempt, response))
+
+        result = FetchResult(url, response, error, time.perf_counter() - start, attempt)
+        with self._lock:
+            self.timings.append(result.as_dict())
+        return result
+
+    def fetch_all(self, urls, headers=None):
+        """
+        Fetch urls concurrently; yields FetchResults in input order.
+        headers may be a dict or a callable url -> dict (e.g. for
+        per-URL conditional GET validators).
+        """
+        headers_for = headers if callable(headers) else (lambda url: headers)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            yield from pool.map(lambda url: self.fetch(url, headers_for(url)), urls)
+
+    def summary(self):
+        """Aggregate timing stats over every fetch so far"""
+        with self._lock:
+            timings = list(self.timings)
+        elapsed = sorted(t['elapsed'] for t in timings)
+        return {
+            'requests': len(timings),
+            'ok': sum(1 for t in timings if t['status'] == 200),
+            'not_modified': sum(1 for t in timings if t['status'] == 304),
+            'failed': sum(1 for t in timings if t['status'] not in (200, 304)),
+            'retries': sum(t['attempts'] - 1 for t in timings),
+            'mean_elapsed': round(sum(elapsed) / len(elapsed), 4) if elapsed else None,
+            'max_elapsed': elapsed[-1] if elapsed else None
+        }
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,94 @@
+"""
+Local HTTP fixture site for crawler tests and benchmarks
+
+Serves recorded pages from fixtures/dadi360 on 127.0.0.1 (any URL path is
+mapped to a file by its basename, "/" to index.html). Individual pages can
+be made to fail a number of times, and every hit is counted. Pages carry
+an ETag (hash of the body) and honour If-None-Match unless `validators`
+is switched off.
+"""
+
+import hashlib
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'dadi360')
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        site = self.server.site
+        name = os.path.basename(urlsplit(self.path).path) or 'index.html'
+        with site.lock:
+            site.hits[name] = site.hits.get(name, 0) + 1
+            failing = site.failures.get(name, 0)
+            if failing:
+                site.failures[name] = failing - 1
+
+        if failing:
+            self.send_error(503)
+            return
+        body = site.page(name)
+        if body is None:
+            self.send_error(404)
+            return
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        if site.validators and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        if site.validators:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FixtureSite:
+    """`with FixtureSite() as site: site.url` -> http://127.0.0.1:<port>/"""
+
+    def __init__(self, directory=FIXTURE_DIR):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.hits = {}
+        self.failures = {}
+        self.overrides = {}
+        self.validators = True
+        self._server = None
+
+    def page(self, name):
+        """Body for a page name (overrides first), or None"""
+        if name in self.overrides:
+            return self.overrides[name]
+        path = os.path.join(self.directory, name)
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def fail(self, name, times):
+        """Answer the next `times` requests for name with 503"""
+        with self.lock:
+            self.failures[name] = times
+
+    def __enter__(self):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.site = self
+        threading.Thread(target=self._server.serve_forever, kwargs={'poll_interval': 0.05},
+                         daemon=True).start()
+        self.url = f'http://127.0.0.1:{self._server.server_address[1]}/'
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
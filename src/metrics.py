@@ -0,0 +1,130 @@
+"""
+In-process metrics in the Prometheus text exposition format
+
+Counters and histograms are keyed by name and a sorted tuple of label
+pairs and kept in plain dicts under one lock, so recording a sample is a
+dict lookup plus a few additions. render() produces the text served by
+/api/metrics (format 0.0.4):
+
+    # HELP http_request_duration_seconds Request latency by endpoint
+    # TYPE http_request_duration_seconds histogram
+    http_request_duration_seconds_bucket{endpoint="climate_api.index",le="0.005"} 3
+    ...
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds (upper bounds; +Inf is implicit)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(pairs, extra=()):
+    pairs = tuple(pairs) + tuple(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    """Thread-safe registry of counters and histograms"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = {}    # name -> {labels: value}
+        self._histograms = {}  # name -> {labels: [bucket counts..., sum, count]}
+
+    def describe(self, name, text):
+        """HELP text for a metric"""
+        self._help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Record one sample (e.g. seconds) in a histogram"""
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            state = series.get(key)
+            if state is None:
+                state = series[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe the duration of a with-block in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def value(self, name, **labels):
+        """Current counter value, or (count, sum) for a histogram"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            if name in self._histograms:
+                state = self._histograms[name].get(key)
+                return (state[-1], state[-2]) if state else (0, 0.0)
+            return self._counters.get(name, {}).get(key, 0)
+
+    def render(self, gauges=None):
+        """
+        Prometheus text format for every metric, plus gauges given as
+        {name: value} or {name: {labels tuple: value}} (read at scrape time)
+        """
+        with self._lock:
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            histograms = {name: {key: list(state) for key, state in series.items()}
+                          for name, series in self._histograms.items()}
+
+        lines = []
+        def header(name, kind):
+            if name in self._help:
+                lines.append(f'# HELP {name} {self._help[name]}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        for name in sorted(counters):
+            header(name, 'counter')
+            for key, value in sorted(counters[name].items()):
+                lines.append(f'{name}{_labels(key)} {_number(value)}')
+
+        for name in sorted(histograms):
+            header(name, 'histogram')
+            for key, state in sorted(histograms[name].items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), state):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_labels(key, [("le", _number(bound))])} '
+                                 f'{cumulative}')
+                lines.append(f'{name}_sum{_labels(key)} {_number(state[-2])}')
+                lines.append(f'{name}_count{_labels(key)} {state[-1]}')
+
+        for name, value in sorted((gauges or {}).items()):
+            header(name, 'gauge')
+            series = value if isinstance(value, dict) else {(): value}
+            for key, sample in sorted(series.items()):
+                lines.append(f'{name}{_labels(key)} {_number(sample)}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,169 @@
+"""
+Materialized statistics for user_posts
+
+Per-category counts, the total and the latest post are kept in small
+tables that triggers update on every INSERT/UPDATE/DELETE, so
+/api/database-stats reads O(categories) rows instead of scanning and
+grouping the whole table. recompute() derives the same numbers from
+user_posts directly; compare the two to detect drift and rebuild() to fix it.
+
+user_post_stats.version is bumped by every one of those triggers, so any
+process sharing the database can tell that user_posts changed by reading
+one row (version()), whichever process wrote it.
+"""
+
+TRIGGERS = ('user_post_stats_insert', 'user_post_stats_delete', 'user_post_stats_update')
+
+SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS user_post_category_stats (
+        category TEXT PRIMARY KEY,
+        count INTEGER NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS user_post_stats (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        total INTEGER NOT NULL,
+        latest_id INTEGER,
+        version INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS user_post_stats_insert
+    AFTER INSERT ON user_posts
+    BEGIN
+        INSERT INTO user_post_category_stats (category, count)
+        VALUES (NEW.category, 1)
+        ON CONFLICT (category) DO UPDATE SET count = count + 1;
+        UPDATE user_post_stats
+        SET total = total + 1,
+            version = version + 1,
+            latest_id = (SELECT id FROM user_posts ORDER BY created_at DESC, id DESC LIMIT 1)
+        WHERE id = 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS user_post_stats_delete
+    AFTER DELETE ON user_posts
+    BEGIN
+        UPDATE user_post_category_stats SET count = count - 1
+        WHERE category = OLD.category;
+        DELETE FROM user_post_category_stats
+        WHERE category = OLD.category AND count <= 0;
+        UPDATE user_post_stats
+        SET total = total - 1,
+            version = version + 1,
+            latest_id = (SELECT id FROM user_posts ORDER BY created_at DESC, id DESC LIMIT 1)
+        WHERE id = 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS user_post_stats_update
+    AFTER UPDATE OF category, created_at ON user_posts
+    BEGIN
+        UPDATE user_post_category_stats SET count = count - 1
+        WHERE category = OLD.category;
+        DELETE FROM user_post_category_stats
+        WHERE category = OLD.category AND count <= 0;
+        INSERT INTO user_post_category_stats (category, count)
+        VALUES (NEW.category, 1)
+        ON CONFLICT (category) DO UPDATE SET count = count + 1;
+        UPDATE user_post_stats
+        SET version = version + 1,
+            latest_id = (SELECT id FROM user_posts ORDER BY created_at DESC, id DESC LIMIT 1)
+        WHERE id = 1;
+    END
+    ''',
+]
+
+
+def install(conn):
+    """Create the stats tables/triggers and seed them on first run"""
+    columns = [r[1] for r in conn.execute('PRAGMA table_info(user_post_stats)')]
+    if columns and 'version' not in columns:
+        # Tables from before the version counter: add it, recreate the triggers
+        conn.execute('ALTER TABLE user_post_stats '
+                     'ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+        for name in TRIGGERS:
+            conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+    for statement in SCHEMA:
+        conn.execute(statement)
+    if conn.execute('SELECT 1 FROM user_post_stats WHERE id = 1').fetchone() is None:
+        rebuild(conn)
+
+
+def total(conn):
+    """Number of user posts, without counting rows"""
+    row = conn.execute('SELECT total FROM user_post_stats WHERE id = 1').fetchone()
+    return row['total'] if row else 0
+
+
+def version(conn):
+    """Counter bumped by every change to user_posts"""
+    row = conn.execute('SELECT version FROM user_post_stats WHERE id = 1').fetchone()
+    return row['version'] if row else 0
+
+
+def read(conn):
+    """Current stats from the materialized tables"""
+    row = conn.execute('''
+        SELECT s.total, p.title, p.created_at
+        FROM user_post_stats s
+        LEFT JOIN user_posts p ON p.id = s.latest_id
+        WHERE s.id = 1
+    ''').fetchone()
+    categories = [{'category': r['category'], 'count': r['count']}
+                  for r in conn.execute('''
+                      SELECT category, count FROM user_post_category_stats
+                      ORDER BY count DESC, category
+                  ''')]
+    return {
+        'total_user_posts': row['total'] if row else 0,
+        'categories': categories,
+        'most_recent_post': {
+            'title': row['title'] if row else None,
+            'created_at': row['created_at'] if row else None
+        }
+    }
+
+
+def recompute(conn):
+    """The same stats computed from scratch by scanning user_posts"""
+    total = conn.execute('SELECT COUNT(*) FROM user_posts').fetchone()[0]
+    categories = [{'category': r['category'], 'count': r['count']}
+                  for r in conn.execute('''
+                      SELECT category, COUNT(*) AS count FROM user_posts
+                      GROUP BY category
+                      ORDER BY count DESC, category
+                  ''')]
+    recent = conn.execute('''
+        SELECT title, created_at FROM user_posts
+        ORDER BY created_at DESC, id DESC
+        LIMIT 1
+    ''').fetchone()
+    return {
+        'total_user_posts': total,
+        'categories': categories,
+        'most_recent_post': {
+            'title': recent['title'] if recent else None,
+            'created_at': recent['created_at'] if recent else None
+        }
+    }
+
+
+def rebuild(conn):
+    """Recompute the materialized tables from user_posts"""
+    with conn:
+        conn.execute('DELETE FROM user_post_category_stats')
+        conn.execute('''
+            INSERT INTO user_post_category_stats (category, count)
+            SELECT category, COUNT(*) FROM user_posts GROUP BY category
+        ''')
+        conn.execute('''
+            INSERT OR REPLACE INTO user_post_stats (id, total, latest_id, version)
+            SELECT 1, COUNT(*),
+                   (SELECT id FROM user_posts ORDER BY created_at DESC, id DESC LIMIT 1),
+                   COALESCE((SELECT version FROM user_post_stats WHERE id = 1), 0) + 1
+            FROM user_posts
+        ''')
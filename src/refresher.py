@@ -0,0 +1,170 @@
+"""
+Background refresh of the services catalog
+
+CatalogRefresher runs on a daemon thread inside the web process: every
+`interval` seconds it re-crawls (crawl() writes the CSV through the
+crawler's .partial file + atomic rename) and then has the catalog import
+the new CSV and rebuild its indexes off the request path, swapping them
+in when ready (ServiceCatalog.refresh(reload_csv=True)). Requests keep
+being served from the previous catalog meanwhile.
+
+With several worker processes only one of them crawls per round - the
+one that gets the non-blocking flock on `<csv>.refresh.lock`; the others
+skip the crawl and just pick up the new CSV (already imported into the
+shared database) on their next round. The crawl can also run as a
+sidecar process instead, leaving the web workers to follow it:
+
+    python src/refresher.py --interval 3600
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # no flock (Windows): every process crawls
+    fcntl = None
+
+
+def _now():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+class CatalogRefresher:
+    """Periodic crawl + catalog rebuild on a background thread, with status"""
+
+    def __init__(self, catalog, crawl=None, interval=3600):
+        # crawl() -> stats dict (discovery_engine's); None only follows the CSV
+        self.catalog = catalog
+        self.crawl = crawl
+        self.interval = interval
+        self.lock_path = catalog.csv_path + '.refresh.lock'
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._run_lock = threading.Lock()
+        self._thread = None
+        self._status_lock = threading.Lock()
+        self._status = {'state': 'idle', 'interval': interval, 'crawls': self.crawl is not None,
+                        'runs': 0, 'failures': 0, 'last_started': None,
+                        'last_finished': None, 'last_duration_s': None, 'crawl_s': None,
+                        'rebuild_s': None, 'crawled': None, 'items': None,
+                        'last_error': None, 'next_run': None}
+
+    def status(self):
+        with self._status_lock:
+            return dict(self._status)
+
+    def _update(self, **fields):
+        with self._status_lock:
+            self._status.update(fields)
+
+    @contextmanager
+    def _crawl_lock(self):
+        """Yields whether this process may crawl this round"""
+        if fcntl is None:
+            yield True
+            return
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            yield True
+        finally:
+            os.close(fd)
+
+    def run_once(self):
+        """One refresh: crawl (if we get the lock), then rebuild and swap"""
+        with self._run_lock:
+            started = time.perf_counter()
+            self._update(state='running', last_started=_now(), last_error=None)
+            crawl_s = crawled = None
+            try:
+                if self.crawl is not None:
+                    with self._crawl_lock() as leader:
+                        if leader:
+                            crawl_started = time.perf_counter()
+                            stats = self.crawl()
+                            crawl_s = time.perf_counter() - crawl_started
+                            crawled = {key: len(value) if isinstance(value, set) else value
+                                       for key, value in (stats or {}).items()}
+                rebuild_started = time.perf_counter()
+                self.catalog.refresh(reload_csv=True)
+                rebuild_s = time.perf_counter() - rebuild_started
+            except Exception as e:
+                # Keep serving the last good catalog; try again next round
+                print(f"Catalog refresh failed: {e}")
+                with self._status_lock:
+                    self._status.update(state='failed', last_error=str(e),
+                                        last_finished=_now(),
+                                        last_duration_s=time.perf_counter() - started)
+                    self._status['failures'] += 1
+                return False
+
+            with self._status_lock:
+                self._status.update(state='idle', last_finished=_now(),
+                                    last_duration_s=time.perf_counter() - started,
+                                    crawl_s=crawl_s, rebuild_s=rebuild_s, crawled=crawled,
+                                    items=self.catalog.count())
+                self._status['runs'] += 1
+            return True
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self._update(next_run=datetime.fromtimestamp(
+                time.time() + self.interval).isoformat(timespec='seconds'))
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            self.run_once()
+
+    def start(self):
+        """Start the background thread (first run after one interval)"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name='catalog-refresh',
+                                            daemon=True)
+            self._thread.start()
+        return self
+
+    def trigger(self):
+        """Run a refresh now instead of at the next interval"""
+        self._wake.set()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+def crawl_to(csv_path, start_url=None):
+    """crawl() for CatalogRefresher: discovery_engine writing csv_path"""
+    def crawl():
+        from crawler import START_URL, discovery_engine
+        return discovery_engine(start_url or START_URL, output_path=csv_path)
+    return crawl
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Re-crawl services into the catalog periodically')
+    parser.add_argument('--interval', type=float, default=3600, help='seconds between crawls')
+    parser.add_argument('--once', action='store_true', help='refresh once and exit')
+    args = parser.parse_args()
+
+    import climate_api
+    refresher = CatalogRefresher(climate_api.catalog, crawl_to(climate_api.SERVICES_CSV_PATH),
+                                 args.interval)
+    while True:
+        refresher.run_once()
+        print(refresher.status())
+        if args.once:
+            break
+        time.sleep(args.interval)
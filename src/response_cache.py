@@ -0,0 +1,179 @@
+"""
+LRU cache for rendered pages and JSON responses
+
+Entries are keyed by (scope, endpoint, view args, sorted query args, data
+version), so a write that bumps the version makes older entries
+unreachable; writers also call invalidate(scope) to drop them right away.
+The cache is bounded by entry count and total body bytes, evicting the
+least recently used entry first.
+
+Every cached response carries a strong ETag (hash of the body) and is
+made conditional, so a client or proxy revalidating with If-None-Match
+gets a 304 without the view running.
+
+Bodies of GZIP_MIN_SIZE bytes or more are also gzipped once, when the
+entry is created, and that copy is sent to clients that accept gzip
+(with its own ETag and `Vary: Accept-Encoding`). Responses that are
+streamed or too big to cache are gzipped on the fly instead, and get a
+weak ETag derived from their cache key, i.e. from the data version.
+"""
+
+import functools
+import gzip
+import hashlib
+import threading
+import zlib
+from collections import OrderedDict
+
+from flask import Response, make_response, request
+
+GZIP_MIN_SIZE = 1024
+# Level 3 is within a few percent of 6 on JSON number arrays at a third of the CPU
+GZIP_LEVEL = 3
+
+
+class CachedResponse:
+    """Body and headers of a 200 response, with its ETag and gzipped copy"""
+
+    def __init__(self, body, content_type):
+        self.body = body
+        self.content_type = content_type
+        self.etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+        # mtime=0 keeps the compressed bytes (and so the ETag) deterministic
+        self.gzipped = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0) \
+            if len(body) >= GZIP_MIN_SIZE else None
+
+    @property
+    def size(self):
+        """Bytes held by this entry"""
+        return len(self.body) + (len(self.gzipped) if self.gzipped is not None else 0)
+
+    def respond(self):
+        """A fresh Response for the current request (304 if the ETag matches)"""
+        if self.gzipped is not None and request.accept_encodings['gzip']:
+            response = Response(self.gzipped, status=200, content_type=self.content_type)
+            response.headers['Content-Encoding'] = 'gzip'
+            response.set_etag(self.etag + '-gzip')
+        else:
+            response = Response(self.body, status=200, content_type=self.content_type)
+            response.set_etag(self.etag)
+        if self.gzipped is not None:
+            response.vary.add('Accept-Encoding')
+        # Shared caches may store it but must revalidate with the ETag
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+
+def gzip_chunks(chunks, level=GZIP_LEVEL):
+    """Gzip an iterable of byte chunks as they come"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def respond_uncached(response, key):
+    """
+    A streamed or uncacheably large 200 response, gzipped on the fly when
+    the client accepts it. Its weak ETag comes from the cache key (which
+    includes the data version), so revalidation still gets a 304 without
+    the body being produced or sent.
+    """
+    etag = hashlib.blake2b(repr(key).encode('utf-8'), digest_size=16).hexdigest()
+    if request.accept_encodings['gzip']:
+        if response.is_streamed:
+            response.response = gzip_chunks(response.iter_encoded())
+            response.headers.pop('Content-Length', None)
+        else:
+            response.set_data(gzip.compress(response.get_data(), compresslevel=GZIP_LEVEL,
+                                            mtime=0))
+        response.headers['Content-Encoding'] = 'gzip'
+        etag += '-gzip'
+    response.vary.add('Accept-Encoding')
+    response.set_etag(etag, weak=True)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+class ResponseCache:
+    """Thread-safe LRU of CachedResponses bounded by count and bytes"""
+
+    def __init__(self, max_entries=256, max_bytes=16 * 2**20):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        """Store entry, evicting LRU entries to stay within the bounds"""
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.size
+            self._entries[key] = entry
+            self._bytes += entry.size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+                self.evictions += 1
+
+    def invalidate(self, scope=None):
+        """Drop every entry of one scope (or all entries)"""
+        with self._lock:
+            for key in [k for k in self._entries if scope is None or k[0] == scope]:
+                self._bytes -= self._entries.pop(key).size
+
+    def clear(self):
+        self.invalidate()
+        with self._lock:
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes,
+                    'max_entries': self.max_entries, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+    def cached(self, scope, version):
+        """
+        Decorator for GET views. version() is read before the view runs,
+        so a response rendered while a write lands is filed under the
+        older (already unreachable) version, never the newer one.
+        Non-200 and already encoded responses pass through untouched;
+        streamed and oversized ones uncached (see respond_uncached).
+        """
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                key = (scope, request.endpoint, tuple(sorted(kwargs.items())),
+                       tuple(sorted(request.args.items(multi=True))), version())
+                entry = self.get(key)
+                if entry is None:
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200 or 'Content-Encoding' in response.headers:
+                        return response
+                    if response.is_streamed or \
+                            len(response.get_data()) > self.max_bytes:
+                        return respond_uncached(response, key)
+                    body = response.get_data()
+                    entry = CachedResponse(body, response.content_type)
+                    self.put(key, entry)
+                return entry.respond()
+            return wrapper
+        return decorator
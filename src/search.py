@@ -0,0 +1,94 @@
+"""
+Search index for the services listing
+
+Chinese titles have no word boundaries, so instead of tokenizing on
+whitespace the index maps every character unigram and bigram to the
+documents that contain it. A query is answered from the rarest gram's
+posting list and each candidate is verified with a substring check, so
+the cost tracks the number of matches rather than the catalog size.
+
+Documents can be added at any time; removed ones are tombstoned (skipped
+by matches()) rather than unlinked from every posting list.
+"""
+
+
+def _grams(text):
+    """Unigrams and bigrams of an already lower-cased string"""
+    grams = set(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    return grams
+
+
+def _query_grams(query):
+    """The grams a query needs: its bigrams, or the single character"""
+    if len(query) == 1:
+        return [query]
+    return [query[i:i + 2] for i in range(len(query) - 1)]
+
+
+class NgramIndex:
+    """Character n-gram inverted index over (key, title, description) docs"""
+
+    def __init__(self, docs=()):
+        self._postings = {}
+        self._docs = []
+        self._removed = set()
+        for key, title, description in docs:
+            self.add(key, title, description)
+
+    def __len__(self):
+        return len(self._docs) - len(self._removed)
+
+    @property
+    def tombstones(self):
+        """Number of removed documents still taking up space"""
+        return len(self._removed)
+
+    def add(self, key, title, description):
+        """Index one document under key (e.g. a services.id)"""
+        doc_id = len(self._docs)
+        title = str(title or '').lower()
+        description = str(description or '').lower()
+        self._docs.append((key, title, description))
+        for gram in _grams(title) | _grams(description):
+            self._postings.setdefault(gram, []).append(doc_id)
+
+    def remove(self, key):
+        """Stop returning the document indexed under key"""
+        self._removed.add(key)
+
+    def matches(self, query):
+        """
+        Return (rank, key) pairs for documents containing query.
+        Title hits rank before description hits, then earlier positions;
+        ties go to the larger (newer) key.
+        """
+        query = query.strip().lower()
+        if not query:
+            return []
+
+        postings = []
+        for gram in set(_query_grams(query)):
+            posting = self._postings.get(gram)
+            if not posting:
+                return []
+            postings.append(posting)
+        candidates = min(postings, key=len)
+
+        results = []
+        for doc_id in candidates:
+            key, title, description = self._docs[doc_id]
+            if key in self._removed:
+                continue
+            pos = title.find(query)
+            if pos >= 0:
+                results.append(((0, pos, -key), key))
+                continue
+            pos = description.find(query)
+            if pos >= 0:
+                results.append(((1, pos, -key), key))
+        return results
+
+    def search(self, query):
+        """Return matching keys, best match first"""
+        return [key for _, key in sorted(self.matches(query))]
@@ -8,14 +8,32 @@ This teaches you:
 """
 
 import pytest
+import gzip
+import io
 import json
-from climate_api import app, df
+import os
+import time
+from climate_api import app
+from catalog import ServiceCatalog
+from search import NgramIndex
+from db import ConnectionPool
+from metrics import Metrics
+from climate_store import ClimateStore
+from climate_journal import ClimateJournal
+from climate_analytics import BucketPyramid, group_stats, lttb, rolling_stats
+import climate_snapshot
+from refresher import CatalogRefresher
+from response_cache import CachedResponse, ResponseCache
+from classify import Classifier, build_artifact, load_services
+import numpy as np
 
 
 @pytest.fixture
 def client():
     """Create test client"""
+    import climate_api
     app.config['TESTING'] = True
+    climate_api.response_cache.clear()
     with app.test_client() as client:
         yield client
 
@@ -67,6 +85,1200 @@ class TestClimateAPI:
         data = json.loads(response.data)
         assert isinstance(data, list)
 
+    def test_year_range(self, client):
+        """Test combined temperature and year range filtering"""
+        response = client.get('/api/climate/range?min_year=2019&max_year=2020')
+        data = json.loads(response.data)
+        assert [r['Year'] for r in data] == [2019, 2020]
+        assert client.get('/api/climate/range?min_year=abc').status_code == 400
+
+
+class TestClimateWrites:
+    """Test suite for the journaled climate write path"""
+
+    def test_post_appends_to_journal(self, climate_data, client):
+        """A POST appends one journal line and leaves the CSV alone"""
+        response = client.post('/api/climate', json={'Year': 2024, 'Avg_Temp': 15.8})
+        assert response.status_code == 201
+        assert response.get_json()['record'] == {'Year': 2024, 'Avg_Temp': 15.8}
+        with open(climate_data.journal_path, encoding='utf-8') as f:
+            assert f.read() == '2024,15.8\n'
+        with open(climate_data.csv_path, encoding='utf-8') as f:
+            assert '2024' not in f.read()
+        assert client.get('/api/climate/2024').status_code == 200
+        assert client.post('/api/climate', json={'Year': 2024, 'Avg_Temp': 1}).status_code == 409
+
+    def test_failed_journal_write_leaves_store_unchanged(self, climate_data, client, monkeypatch):
+        """A row whose journal write fails is not served and can be retried"""
+        write = climate_data.write
+        def failing(rows, snapshot=None):
+            monkeypatch.setattr(climate_data, 'write', write)
+            raise OSError('disk full')
+        monkeypatch.setattr(climate_data, 'write', failing)
+
+        response = client.post('/api/climate', json={'Year': 2024, 'Avg_Temp': 15.8})
+        assert response.status_code == 500
+        assert client.get('/api/climate/2024').status_code == 404
+        assert client.post('/api/climate', json={'Year': 2024, 'Avg_Temp': 15.8}).status_code == 201
+        with open(climate_data.journal_path, encoding='utf-8') as f:
+            assert f.read() == '2024,15.8\n'
+
+    def test_non_finite_temperatures_rejected(self, climate_data, client):
+        """NaN/inf would poison the running statistics for good"""
+        for value in ('nan', 'inf', '-Infinity'):
+            assert client.post('/api/climate', json={'Year': 3000, 'Avg_Temp': value}
+                               ).status_code == 400
+        response = client.post('/api/v2/climate/bulk', content_type='text/csv',
+                               data='Year,Avg_Temp\n3000,15.0\n3001,nan\n')
+        assert response.status_code == 400
+        response = client.post('/api/v2/climate/bulk', content_type='application/x-ndjson',
+                               data='{"Year": 3000, "Avg_Temp": NaN}\n')
+        assert response.status_code == 400
+        assert client.get('/api/climate/3000').status_code == 404
+        response = client.get('/api/statistics')
+        assert response.status_code == 200 and b'NaN' not in response.data
+
+    def test_compaction_folds_journal_into_csv(self, climate_data, client):
+        """Reaching compact_every rewrites the CSV and empties the journal"""
+        client.post('/api/v2/climate/bulk', json=[{'Year': y, 'Avg_Temp': 15.0}
+                                                   for y in (2020, 2021, 2022)])
+        assert climate_data.pending_rows == 0
+        with open(climate_data.csv_path, encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        assert lines[0] == 'Year,Avg_Temp'
+        assert [line.split(',')[0] for line in lines[1:]] == \
+            ['2018', '2019', '2020', '2021', '2022']
+
+    def test_bulk_formats_and_duplicates(self, climate_data, client):
+        """JSON, CSV and NDJSON bodies; duplicates skipped and reported"""
+        response = client.post('/api/v2/climate/bulk',
+                               json=[{'Year': 2019, 'Avg_Temp': 1}, {'Year': 2030, 'Avg_Temp': 15}])
+        assert response.status_code == 201
+        assert response.get_json()['duplicates'] == [2019]
+        response = client.post('/api/v2/climate/bulk', content_type='text/csv',
+                               data='Year,Avg_Temp\n2031,15.1\n2031,15.2\n')
+        assert response.get_json() == {'message': '1 records added', 'added': 1,
+                                       'duplicates': [2031]}
+        response = client.post('/api/v2/climate/bulk', content_type='application/x-ndjson',
+                               data='{"Year": 2032, "Avg_Temp": 15.3}\n')
+        assert response.get_json()['added'] == 1
+        response = client.post('/api/v2/climate/bulk', json=[{'Year': 'x'}])
+        assert response.status_code == 400
+
+    def test_replay_and_torn_tail(self, tmp_path):
+        """Journal survives a restart and drops a half-written last line"""
+        csv_path = str(tmp_path / 'c.csv')
+        journal = ClimateJournal(csv_path)
+        journal.append([(2000, 14.5), (2001, 14.6)])
+        with open(journal.journal_path, 'a', encoding='utf-8') as f:
+            f.write('2002,1')
+        reopened = ClimateJournal(csv_path)
+        assert reopened.replay() == [(2000, 14.5), (2001, 14.6)]
+        reopened.append([(2002, 14.7)])
+        assert reopened.replay()[-1] == (2002, 14.7)
+
+    def test_concurrent_appends(self, tmp_path):
+        """Group commit loses nothing under concurrent writers"""
+        import threading
+        journal = ClimateJournal(str(tmp_path / 'c.csv'), fsync=False)
+        threads = [threading.Thread(target=journal.append, args=([(year, 1.0)],))
+                   for year in range(200)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert sorted(y for y, _ in journal.replay()) == list(range(200))
+
+
+class TestClimateFormats:
+    """Test suite for the columnar, streamed and gzipped climate responses"""
+
+    @pytest.fixture
+    def rows(self, climate_data, client):
+        client.post('/api/v2/climate/bulk', json=[{'Year': y, 'Avg_Temp': 14.0 + (y % 7) / 4}
+                                                   for y in range(1800, 2000)])
+        return client.get('/api/climate').get_json()
+
+    def test_columns_match_records(self, rows, client):
+        """?format=columns carries the same rows as the default records"""
+        data = client.get('/api/climate?format=columns').get_json()
+        assert data == {'Year': [r['Year'] for r in rows],
+                        'Avg_Temp': [r['Avg_Temp'] for r in rows]}
+        data = client.get('/api/climate/range?min_temp=15&max_year=1900&format=columns').get_json()
+        expected = client.get('/api/climate/range?min_temp=15&max_year=1900').get_json()
+        assert data['Year'] == [r['Year'] for r in expected]
+
+    def test_streamed_formats(self, rows, client):
+        """CSV and NDJSON stream every row and aren't cached"""
+        import climate_api
+        import pandas as pd
+        response = client.get('/api/climate?format=csv')
+        assert response.mimetype == 'text/csv'
+        frame = pd.read_csv(io.BytesIO(response.data))
+        assert frame.to_dict('records') == rows
+        response = client.get('/api/climate?format=ndjson')
+        assert [json.loads(line) for line in response.data.splitlines()] == rows
+        assert climate_api.response_cache.stats()['entries'] == 1
+        assert client.get('/api/climate?format=xml').status_code == 400
+
+    def test_gzip_negotiation(self, rows, client):
+        """Clients that accept gzip get the precompressed body with its own ETag"""
+        plain = client.get('/api/climate')
+        zipped = client.get('/api/climate', headers={'Accept-Encoding': 'gzip, deflate'})
+        assert 'Content-Encoding' not in plain.headers
+        assert zipped.headers['Content-Encoding'] == 'gzip'
+        assert gzip.decompress(zipped.data) == plain.data
+        assert len(zipped.data) < len(plain.data) / 3
+        assert zipped.headers['ETag'] != plain.headers['ETag']
+        assert 'Accept-Encoding' in zipped.headers['Vary']
+        response = client.get('/api/climate', headers={'Accept-Encoding': 'gzip',
+                                                       'If-None-Match': zipped.headers['ETag']})
+        assert response.status_code == 304
+
+    def test_uncached_responses_gzipped_on_the_fly(self, rows, client, monkeypatch):
+        """Streams and bodies too big to cache are compressed and revalidatable"""
+        import climate_api
+        plain = client.get('/api/climate?format=csv')
+        zipped = client.get('/api/climate?format=csv', headers={'Accept-Encoding': 'gzip'})
+        assert zipped.headers['Content-Encoding'] == 'gzip'
+        assert gzip.decompress(zipped.data) == plain.data
+        assert zipped.headers['ETag'].startswith('W/') and \
+            zipped.headers['ETag'] != plain.headers['ETag']
+        response = client.get('/api/climate?format=csv', headers={
+            'Accept-Encoding': 'gzip', 'If-None-Match': zipped.headers['ETag']})
+        assert response.status_code == 304 and response.data == b''
+
+        monkeypatch.setattr(climate_api.response_cache, 'max_bytes', 1024)
+        climate_api.response_cache.clear()
+        zipped = client.get('/api/climate', headers={'Accept-Encoding': 'gzip'})
+        assert json.loads(gzip.decompress(zipped.data)) == rows
+        assert climate_api.response_cache.stats()['entries'] == 0
+        client.post('/api/climate', json={'Year': 2100, 'Avg_Temp': 15.0})
+        response = client.get('/api/climate', headers={
+            'Accept-Encoding': 'gzip', 'If-None-Match': zipped.headers['ETag']})
+        assert response.status_code == 200
+
+
+class TestClimateStatistics:
+    """Test suite for online and rolling statistics"""
+
+    def test_online_stats_match_full_recompute(self, climate_data, client):
+        """Welford updates agree with a from-scratch computation"""
+        import pandas as pd
+        client.post('/api/climate', json={'Year': 2020, 'Avg_Temp': 14.88})
+        client.post('/api/v2/climate/bulk', json=[{'Year': 2021, 'Avg_Temp': 14.84},
+                                                   {'Year': 2022, 'Avg_Temp': 15.2}])
+        temps = pd.Series([14.83, 14.85, 14.88, 14.84, 15.2])
+        data = client.get('/api/statistics').get_json()
+        assert data['count'] == 5
+        assert data['mean'] == pytest.approx(temps.mean())
+        assert data['std'] == pytest.approx(temps.std())
+        assert (data['min'], data['max']) == (14.83, 15.2)
+
+    def test_rolling_matches_pandas(self):
+        """Cumulative-sum rolling window equals pandas rolling()"""
+        import pandas as pd
+        years = np.arange(1950, 2000)
+        temps = np.random.default_rng(0).normal(14, 0.5, len(years))
+        result = rolling_stats(years, temps, 7)
+        expected = pd.Series(temps).rolling(7)
+        assert [r['Year'] for r in result] == list(range(1956, 2000))
+        assert [r['mean'] for r in result] == pytest.approx(expected.mean().dropna().tolist())
+        assert [r['std'] for r in result] == pytest.approx(expected.std().dropna().tolist())
+
+    def test_decade_groups(self):
+        """Per-decade aggregates"""
+        groups = group_stats(np.array([1989, 1990, 1995, 2001]),
+                             np.array([13.0, 14.0, 16.0, 15.0]))
+        assert [(g['start'], g['count'], g['mean']) for g in groups] == \
+            [(1980, 1, 13.0), (1990, 2, 15.0), (2000, 1, 15.0)]
+        assert groups[0]['std'] is None
+        assert groups[1]['min'] == 14.0 and groups[1]['max'] == 16.0
+
+    def test_rolling_endpoint(self, client):
+        """Endpoint validates window and returns both views"""
+        data = client.get('/api/v2/statistics/rolling?window=2').get_json()
+        import climate_api
+        assert len(data['rolling']) == len(climate_api.climate_store) - 1
+        assert data['buckets'][0]['start'] == 2010
+        assert client.get('/api/v2/statistics/rolling?window=0').status_code == 400
+
+    def test_pyramid_matches_group_stats(self):
+        """Buckets read from the pyramid equal a full group-by, for any size"""
+        rng = np.random.default_rng(1)
+        years = np.sort(rng.integers(-500, 2024, 5000))
+        temps = rng.normal(14, 2, len(years))
+        pyramid = BucketPyramid(years, temps)
+        for size in (1, 7, 10, 20, 100, 250):
+            expected = group_stats(years, temps, size)
+            columns = pyramid.buckets(size)
+            assert columns['start'] == [g['start'] for g in expected]
+            assert columns['count'] == [g['count'] for g in expected]
+            assert columns['mean'] == pytest.approx([g['mean'] for g in expected])
+            assert columns['min'] == [g['min'] for g in expected]
+            assert columns['max'] == [g['max'] for g in expected]
+        assert pyramid.buckets(10, 1900, 1949)['start'] == list(range(1900, 1950, 10))
+
+    def test_pyramid_clips_edge_buckets(self):
+        """Bounds inside a bucket count only the rows within them"""
+        rng = np.random.default_rng(2)
+        years = np.sort(rng.integers(1800, 2024, 3000))
+        temps = rng.normal(14, 2, len(years))
+        pyramid = BucketPyramid(years, temps)
+        for size, min_year, max_year in ((10, 2015, 2025), (100, 1855, 1999), (7, 1901, 1960)):
+            inside = (years >= min_year) & (years <= max_year)
+            expected = group_stats(years[inside], temps[inside], size)
+            columns = pyramid.buckets(size, min_year, max_year)
+            assert columns['start'] == [g['start'] for g in expected]
+            assert columns['count'] == [g['count'] for g in expected]
+            assert columns['mean'] == pytest.approx([g['mean'] for g in expected])
+            assert columns['min'] == [g['min'] for g in expected]
+            assert columns['max'] == [g['max'] for g in expected]
+
+    def test_lttb_keeps_shape(self):
+        """LTTB returns ordered indices with both ends and the spike"""
+        x = np.arange(10000)
+        y = np.sin(x / 500.0)
+        y[4321] = 50.0
+        keep = lttb(x, y, 100)
+        assert len(keep) == 100
+        assert keep[0] == 0 and keep[-1] == 9999
+        assert np.all(np.diff(keep) > 0)
+        assert 4321 in keep
+        assert len(lttb(x[:50], y[:50], 100)) == 50
+
+    def test_aggregate_endpoint(self, climate_data, client):
+        """Bucketed and downsampled views, with parameter validation"""
+        client.post('/api/v2/climate/bulk', json=[{'Year': y, 'Avg_Temp': 14.0 + y % 3}
+                                                   for y in range(2020, 2040)])
+        data = client.get('/api/v2/climate/aggregate?bucket=decade').get_json()
+        assert data['start'] == [2010, 2020, 2030]
+        assert data['count'] == [2, 10, 10]
+        assert client.get('/api/v2/climate/aggregate?bucket=5&min_year=2030'
+                          ).get_json()['start'] == [2030, 2035]
+        data = client.get('/api/v2/climate/aggregate?min_year=2015&max_year=2025').get_json()
+        assert data['start'] == [2010, 2020]
+        assert data['count'] == [2, 6]
+        data = client.get('/api/v2/climate/aggregate?points=5').get_json()
+        assert (data['points'], data['total']) == (5, 22)
+        assert data['Year'][0] == 2018 and data['Year'][-1] == 2039
+        for query in ('bucket=week', 'bucket=0', 'points=2', 'points=x'):
+            assert client.get(f'/api/v2/climate/aggregate?{query}').status_code == 400
+
+    def test_chart_page_fetches_series(self, client):
+        """The chart page no longer inlines the dataset"""
+        response = client.get('/climate')
+        assert response.status_code == 200
+        assert b'/api/v2/climate/aggregate' in response.data
+        assert len(response.data) < 4096
+
+
+class TestClimateStore:
+    """Test suite for the indexed climate store"""
+
+    @pytest.fixture
+    def store(self):
+        return ClimateStore([2000, 2001, 2002, 2003], [15.0, 14.0, 16.0, 14.5])
+
+    def test_year_lookup(self, store):
+        """Hash index lookup"""
+        assert store.get(2002) == {'Year': 2002, 'Avg_Temp': 16.0}
+        assert store.get(1999) is None
+
+    def test_range_queries(self, store):
+        """Temperature and year bounds are inclusive, results in row order"""
+        assert [r['Year'] for r in store.query(14.5, 15.0)] == [2000, 2003]
+        assert [r['Year'] for r in store.query(min_year=2001, max_year=2002)] == [2001, 2002]
+        assert [r['Year'] for r in store.query(14.0, 15.0, min_year=2001)] == [2001, 2003]
+        assert store.query(20, 30) == []
+
+    def test_append_updates_indexes(self, store):
+        """Appends are visible to every index without a rebuild"""
+        for year in range(2004, 2040):
+            store.append(year, 10 + (year % 7))
+        assert len(store) == 40
+        assert store.get(2039) == {'Year': 2039, 'Avg_Temp': 10.0 + 2039 % 7}
+        expected = [y for y, t in zip(store.years, store.temps) if 12 <= t <= 14.5]
+        assert [r['Year'] for r in store.query(12, 14.5)] == expected
+        with pytest.raises(KeyError):
+            store.append(2000, 1.0)
+
+
+class TestClimateSnapshot:
+    """Test suite for the memory-mapped columnar snapshot"""
+
+    @pytest.fixture
+    def csv_path(self, tmp_path):
+        path = tmp_path / 'climate_data.csv'
+        path.write_text('Year,Avg_Temp\n2019,14.9\n2018,14.8\n2020,15.1\n', encoding='utf-8')
+        return str(path)
+
+    def test_cold_start_maps_snapshot(self, csv_path, monkeypatch):
+        """Once written, the snapshot is memory-mapped without parsing the CSV"""
+        climate_snapshot.load(csv_path)
+        monkeypatch.setattr(climate_snapshot, 'read_csv_columns', None)
+        columns = climate_snapshot.load(csv_path)
+        assert isinstance(columns['Year'], np.memmap)
+        assert columns['year_sorted'].tolist() == [2018, 2019, 2020]
+        store = ClimateStore.from_snapshot(columns)
+        assert store.query(14.85, 16) == [{'Year': 2019, 'Avg_Temp': 14.9},
+                                          {'Year': 2020, 'Avg_Temp': 15.1}]
+
+    def test_stale_snapshot_rebuilt(self, csv_path):
+        """A changed CSV invalidates the snapshot; old generations are removed"""
+        climate_snapshot.load(csv_path)
+        with open(csv_path, 'a', encoding='utf-8') as f:
+            f.write('2021,15.3\n')
+        assert climate_snapshot.open_snapshot(csv_path) is None
+        assert climate_snapshot.load(csv_path)['Year'].tolist()[-1] == 2021
+        directory = climate_snapshot.snapshot_dir(csv_path)
+        assert len([d for d in os.listdir(directory) if d != 'CURRENT']) == 1
+
+    def test_writes_copy_on_write(self, csv_path):
+        """Appending to a mapped store leaves the snapshot files untouched"""
+        store = ClimateStore.from_snapshot(climate_snapshot.load(csv_path))
+        store.append(2021, 14.0)
+        store.extend([(2022, 16.0)])
+        assert store.get(2022) == {'Year': 2022, 'Avg_Temp': 16.0}
+        assert store.statistics()['count'] == 5
+        assert len(climate_snapshot.open_snapshot(csv_path)['Year']) == 3
+
+    def test_compaction_refreshes_snapshot(self, csv_path):
+        """Compacting the journal publishes a snapshot matching the new CSV"""
+        store = ClimateStore.from_snapshot(climate_snapshot.load(csv_path))
+        journal = ClimateJournal(csv_path, compact_every=2, on_compact=lambda years, temps:
+                                 climate_snapshot.write(csv_path, years, temps))
+        for year in (2021, 2022):
+            store.append(year, 15.0)
+            journal.append([(year, 15.0)], snapshot=store.snapshot)
+        columns = climate_snapshot.open_snapshot(csv_path)
+        assert columns['Year'].tolist() == [2019, 2018, 2020, 2021, 2022]
+
+    def test_unwritable_directory_falls_back(self, csv_path, tmp_path):
+        """Without a writable snapshot directory the CSV is used in memory"""
+        blocker = tmp_path / 'blocker'
+        blocker.write_text('')
+        columns = climate_snapshot.load(csv_path, directory=str(blocker / 'snap'))
+        assert columns['Avg_Temp'].tolist() == [14.9, 14.8, 15.1]
+
+
+class TestMultiWorker:
+    """Test suite for sharing the climate dataset between worker processes"""
+
+    @pytest.fixture
+    def csv_path(self, tmp_path, monkeypatch):
+        """Point the app at a fresh CSV; this process plays one worker"""
+        import climate_api
+        path = tmp_path / 'climate_data.csv'
+        path.write_text('Year,Avg_Temp\n2018,14.83\n2019,14.85\n', encoding='utf-8')
+        monkeypatch.setattr(climate_api, 'CLIMATE_CSV_PATH', str(path))
+        monkeypatch.setattr(climate_api, 'climate_journal', ClimateJournal(
+            str(path), compact_every=3, on_compact=climate_api.write_climate_snapshot))
+        monkeypatch.setattr(climate_api, 'climate_store', climate_api.load_climate_store())
+        return str(path)
+
+    def other_worker(self, csv_path):
+        """A second worker's journal and store over the same files"""
+        store = ClimateStore.from_snapshot(climate_snapshot.load(csv_path))
+        journal = ClimateJournal(csv_path, compact_every=3, on_compact=lambda years, temps:
+                                 climate_snapshot.write(csv_path, years, temps))
+        store.extend(journal.replay())
+        return store, journal
+
+    def test_sees_other_workers_writes(self, csv_path, client):
+        """Rows journaled elsewhere show up on the next read, cache included"""
+        assert client.get('/api/statistics').get_json()['count'] == 2
+        store, journal = self.other_worker(csv_path)
+        store.append(2020, 15.0)
+        journal.append([(2020, 15.0)], snapshot=store.snapshot)
+        assert client.get('/api/climate/2020').get_json() == {'Year': 2020, 'Avg_Temp': 15.0}
+        assert client.get('/api/statistics').get_json()['count'] == 3
+
+    def test_duplicate_check_spans_workers(self, csv_path, client):
+        """A year written by another worker is a 409 here, not a second row"""
+        client.get('/api/climate')
+        store, journal = self.other_worker(csv_path)
+        store.append(2021, 15.0)
+        journal.append([(2021, 15.0)], snapshot=store.snapshot)
+        response = client.post('/api/climate', json={'Year': 2021, 'Avg_Temp': 1.0})
+        assert response.status_code == 409
+        assert [y for y, _ in journal.replay()] == [2021]
+
+    def test_reload_after_compaction_elsewhere(self, csv_path, client):
+        """When another worker compacts, this one reloads the CSV and new journal"""
+        client.post('/api/climate', json={'Year': 2020, 'Avg_Temp': 15.0})
+        store, journal = self.other_worker(csv_path)
+        for year in (2021, 2022):
+            store.append(year, 15.0)
+            journal.append([(year, 15.0)], snapshot=store.snapshot)
+        assert journal.pending_rows == 0  # compacted into the CSV
+        store.append(2023, 15.0)
+        journal.append([(2023, 15.0)], snapshot=store.snapshot)
+
+        years = [r['Year'] for r in client.get('/api/climate').get_json()]
+        assert years == [2018, 2019, 2020, 2021, 2022, 2023]
+
+    def test_reload_does_not_deadlock_with_writer(self, csv_path):
+        """A reader reloading after a compaction elsewhere while a writer holds exclusive()"""
+        import threading
+        import climate_api
+        climate_api.sync_climate()
+        store, journal = self.other_worker(csv_path)
+        for year in (2020, 2021):
+            store.append(year, 15.0)
+            journal.append([(year, 15.0)], snapshot=store.snapshot)
+        journal.compact(store.snapshot)  # new journal inode: readers must reload
+
+        results = {}
+        def writer():
+            with climate_api.climate_journal.exclusive():
+                time.sleep(0.2)  # let the reader block on the shared flock
+                results['writer'] = len(climate_api.sync_climate(locked=True))
+        def reader():
+            time.sleep(0.05)
+            results['reader'] = len(climate_api.sync_climate())
+        threads = [threading.Thread(target=writer, daemon=True),
+                   threading.Thread(target=reader, daemon=True)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=10)
+        assert not any(thread.is_alive() for thread in threads)
+        assert results == {'writer': 4, 'reader': 4}
+
+    def test_concurrent_processes(self, tmp_path):
+        """Appends from several processes are all journaled, none torn"""
+        import subprocess
+        import sys
+        csv_path = str(tmp_path / 'c.csv')
+        script = ('import sys; from climate_journal import ClimateJournal\n'
+                  'journal = ClimateJournal(sys.argv[1], compact_every=10**9, fsync=False)\n'
+                  'for i in range(50): journal.append([(int(sys.argv[2]) + i, 1.0)])\n')
+        workers = [subprocess.Popen([sys.executable, '-c', script, csv_path, str(base)],
+                                    cwd=os.path.dirname(os.path.abspath(__file__)))
+                   for base in range(0, 200, 50)]
+        assert all(worker.wait(timeout=60) == 0 for worker in workers)
+        assert sorted(y for y, _ in ClimateJournal(csv_path).replay()) == list(range(200))
+
+
+@pytest.fixture
+def climate_data(tmp_path, monkeypatch):
+    """Point the climate endpoints at a throwaway CSV + journal"""
+    import climate_api
+    csv_path = tmp_path / 'climate_data.csv'
+    csv_path.write_text('Year,Avg_Temp\n2018,14.83\n2019,14.85\n', encoding='utf-8')
+    journal = ClimateJournal(str(csv_path), compact_every=3)
+    store = ClimateStore([2018, 2019], [14.83, 14.85])
+    monkeypatch.setattr(climate_api, 'climate_journal', journal)
+    monkeypatch.setattr(climate_api, 'climate_store', store)
+    return journal
+
+
+@pytest.fixture
+def services_db(tmp_path, monkeypatch):
+    """Point the app at a throwaway database and services CSV"""
+    import climate_api
+    csv_path = tmp_path / 'bayarea_services.csv'
+    rows = ['Title,Source'] + [f'租房(Queens) 第{i}号,https://example.com/{i % 3}'
+                               for i in range(45)]
+    csv_path.write_text('\n'.join(rows) + '\n', encoding='utf-8')
+    pool = ConnectionPool(str(tmp_path / 'test.db'))
+    monkeypatch.setattr(climate_api, 'db_pool', pool)
+    monkeypatch.setattr(climate_api, 'SERVICES_CSV_PATH', str(csv_path))
+    climate_api.init_database()
+    catalog = ServiceCatalog(str(csv_path),
+                             load_scraped=climate_api.get_services,
+                             connect=climate_api.get_db_connection)
+    monkeypatch.setattr(climate_api, 'catalog', catalog)
+    yield catalog
+    pool.close()
+
+
+class TestAppFactory:
+    """Test suite for create_app() and lazy initialization"""
+
+    def test_import_is_lazy(self):
+        """Importing the app loads no data, no schema and no pandas"""
+        import subprocess
+        import sys
+        script = ('import sys, climate_api\n'
+                  'assert "pandas" not in sys.modules\n'
+                  'assert climate_api.climate_store is None and climate_api._database_ready is None\n'
+                  'assert climate_api.startup_report["import_ms"] > 0\n')
+        subprocess.run([sys.executable, '-c', script], check=True,
+                       cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    def test_climate_loaded_on_first_use(self, tmp_path, monkeypatch):
+        """The first climate request opens the journal and loads the store"""
+        import climate_api
+        path = tmp_path / 'climate_data.csv'
+        path.write_text('Year,Avg_Temp\n2018,14.83\n', encoding='utf-8')
+        monkeypatch.setattr(climate_api, 'CLIMATE_CSV_PATH', str(path))
+        monkeypatch.setattr(climate_api, 'climate_journal', None)
+        monkeypatch.setattr(climate_api, 'climate_store', None)
+        with climate_api.create_app({'TESTING': True}).test_client() as client:
+            assert client.get('/api/health').get_json()['startup']['create_app_ms'] >= 0
+            assert climate_api.climate_store is None
+            assert client.get('/api/climate/2018').get_json()['Avg_Temp'] == 14.83
+        assert len(climate_api.climate_store) == 1
+
+    def test_preload(self, climate_data, services_db, monkeypatch):
+        """PRELOAD initializes the schema of the current pool up front"""
+        import climate_api
+        pool = ConnectionPool(services_db.csv_path + '.db')
+        monkeypatch.setattr(climate_api, 'db_pool', pool)
+        flask_app = climate_api.create_app({'PRELOAD': True})
+        assert climate_api._database_ready is pool
+        assert flask_app.config['PRELOAD'] and 'climate_api.index' in flask_app.view_functions
+        pool.close()
+
+
+class TestMetrics:
+    """Test suite for /api/metrics and the profiling hook"""
+
+    def test_render_histogram(self):
+        """Cumulative buckets, sum and count in Prometheus text format"""
+        registry = Metrics(buckets=(0.1, 1.0))
+        registry.observe('latency_seconds', 0.05, route='a')
+        registry.observe('latency_seconds', 0.5, route='a')
+        registry.inc('hits_total', route='a"b')
+        text = registry.render({'rows': 3})
+        assert 'latency_seconds_bucket{route="a",le="0.1"} 1' in text
+        assert 'latency_seconds_bucket{route="a",le="1.0"} 2' in text
+        assert 'latency_seconds_bucket{route="a",le="+Inf"} 2' in text
+        assert 'latency_seconds_count{route="a"} 2' in text
+        assert 'hits_total{route="a\\"b"} 1' in text
+        assert '# TYPE rows gauge\nrows 3' in text
+
+    def test_request_and_internal_metrics(self, services_db, client, monkeypatch):
+        """Routes, SQLite statements, templates and JSON are all timed"""
+        import climate_api
+        monkeypatch.setattr(climate_api, 'metrics', Metrics())
+        pool = ConnectionPool(services_db.csv_path + '.db', on_query=climate_api.observe_query)
+        monkeypatch.setattr(climate_api, 'db_pool', pool)
+        client.get('/')
+        client.get('/api/database-stats')
+        client.get('/api/nope')
+        text = client.get('/api/metrics').data.decode()
+        assert 'http_requests_total{endpoint="climate_api.index",method="GET",status="200"} 1' \
+            in text
+        assert 'http_requests_total{endpoint="unmatched",method="GET",status="404"} 1' in text
+        assert 'sqlite_query_duration_seconds_count{statement="SELECT"}' in text
+        assert 'template_render_duration_seconds_count{template="bayarea.html"} 1' in text
+        assert climate_api.metrics.value('json_serialize_duration_seconds')[0] >= 1
+        pool.close()
+
+    def test_profile_flag(self, client):
+        """?profile=1 returns a cProfile summary only when enabled in config"""
+        assert client.get('/api/health?profile=1').is_json
+        app.config['PROFILING'] = True
+        try:
+            response = client.get('/api/health?profile=1')
+        finally:
+            app.config['PROFILING'] = False
+        assert response.mimetype == 'text/plain'
+        assert b'function calls' in response.data and b'health_check' in response.data
+
+
+class TestServiceCatalog:
+    """Test suite for the SQLite-backed service catalog"""
+
+    def test_csv_imported_once(self, services_db, monkeypatch):
+        """Unchanged file is not re-imported, even by a new process"""
+        import climate_api
+        services_db.refresh()
+        calls = []
+        catalog = ServiceCatalog(services_db.csv_path,
+                                 load_scraped=lambda: calls.append(1) or [],
+                                 connect=climate_api.get_db_connection)
+        catalog.refresh()
+        catalog.refresh()
+        assert calls == []
+        assert catalog.count() == 45
+
+    def test_reimport_when_file_changes(self, services_db):
+        """A new mtime/size replaces the scraped rows"""
+        services_db.refresh()
+        with open(services_db.csv_path, 'a', encoding='utf-8') as f:
+            f.write('招聘厨师,https://example.com/x\n')
+        services_db.refresh()
+        assert services_db.count() == 46
+        assert services_db.categories() == ['生活服务', '租房']
+
+    def test_keyset_pages_match_offset_pages(self, services_db):
+        """after/before/last cursors walk the same pages as OFFSET"""
+        services_db.refresh()
+        page1 = services_db.page(per_page=20)
+        page2 = services_db.page(after=page1[-1]['cursor'], per_page=20)
+        assert page2 == services_db.page(offset=20, per_page=20)
+        assert page1[0]['Title'] == '租房(Queens) 第0号'
+
+        last = services_db.page(last=True, per_page=20)
+        assert [s['Title'] for s in last] == [f'租房(Queens) 第{i}号' for i in range(40, 45)]
+        assert services_db.page(before=last[0]['cursor'], per_page=20) == \
+            services_db.page(offset=20, per_page=20)
+
+    def test_user_posts_mirrored_by_trigger(self, services_db):
+        """Inserting into user_posts lists and indexes the post"""
+        import climate_api
+        services_db.refresh()
+        with climate_api.get_db_connection() as conn:
+            conn.execute("INSERT INTO user_posts (category, title) VALUES ('二手', '出售二手沙发')")
+            conn.commit()
+        services_db.refresh()
+        assert services_db.count('二手') == 1
+        assert services_db.fetch(services_db.search('沙发'))[0]['Contact'] == '未提供'
+        assert services_db.page(per_page=1)[0]['Title'] == '出售二手沙发'
+
+    def test_homepage_cursor_link(self, services_db, client):
+        """Homepage renders keyset links and follows them"""
+        response = client.get('/')
+        html = response.data.decode()
+        assert response.status_code == 200
+        assert '共找到 <strong>45</strong>' in html
+        assert 'after=' in html
+        cursor = services_db.page(per_page=20)[-1]['cursor']
+        response = client.get('/', query_string={'page': 2, 'after': cursor})
+        assert '租房(Queens) 第20号' in response.data.decode()
+
+    def test_post_service(self, services_db, client):
+        """Posting a service shows it on the first page"""
+        services_db.refresh()
+        response = client.post('/post', data={'category': '二手', 'title': '九成新自行车'})
+        html = response.data.decode()
+        assert '信息发布成功' in html
+        assert '九成新自行车' in html
+        assert '共找到 <strong>46</strong>' in html
+
+
+class TestClassify:
+    """Test suite for vectorized classification and the catalog artifact"""
+
+    @pytest.fixture
+    def scraped_csv(self, tmp_path):
+        path = tmp_path / 'bayarea_services.csv'
+        path.write_text('Title,Source\n租房(Queens) 单间,u1\n招聘·厨师,u2\n(无分类)标题,u3\n'
+                        f'二手自行车,u4\n{"长" * 120},u5\n,u6\n', encoding='utf-8')
+        return str(path)
+
+    def test_default_rules(self, scraped_csv):
+        """Separator prefixes, the empty-prefix and default categories, truncation"""
+        services = load_services(scraped_csv)
+        assert [s['Category'] for s in services] == ['租房', '招聘', '其他', '生活服务', '生活服务']
+        assert services[4]['Description'] == '长' * 100 + '...'
+        assert services[0]['Contact'] == services[0]['Source'] == 'u1'
+
+    def test_keyword_rules(self, scraped_csv):
+        """Keyword rules win over prefixes, longest keyword first"""
+        classifier = Classifier({'二手': '二手', '二手自行车': '单车', '厨师': '餐饮'})
+        services = load_services(scraped_csv, classifier)
+        assert [s['Category'] for s in services] == ['租房', '餐饮', '其他', '单车', '生活服务']
+
+    def test_artifact_reused_until_stale(self, scraped_csv, monkeypatch):
+        """A fresh artifact skips classification; a changed CSV or rule set rebuilds it"""
+        build_artifact(scraped_csv)
+        calls = []
+        original = Classifier.classify
+        monkeypatch.setattr(Classifier, 'classify',
+                            lambda self, frame: calls.append(1) or original(self, frame))
+        assert len(load_services(scraped_csv)) == 5
+        assert calls == []
+
+        with open(scraped_csv, 'a', encoding='utf-8') as f:
+            f.write('家政·钟点工,u7\n')
+        assert len(load_services(scraped_csv)) == 6
+        assert calls == [1]
+        load_services(scraped_csv, Classifier({'钟点': '家政'}))
+        assert calls == [1, 1]
+
+
+class TestCategoryFacets:
+    """Test suite for the category facet index"""
+
+    @pytest.fixture
+    def posts(self, services_db, client):
+        services_db.refresh()
+        for category, title in [('二手', '出售二手沙发'), ('二手', '二手自行车转让'),
+                                ('招聘', '餐馆招聘服务员')]:
+            client.post('/post', data={'category': category, 'title': title})
+        return services_db
+
+    def test_counts_follow_posts(self, posts, client):
+        """Facets count scraped and user rows and follow deletes"""
+        assert posts.facets() == [('二手', 2), ('招聘', 1), ('租房', 45)]
+        assert posts.count(['二手', '招聘']) == 3
+        post_id = client.get('/api/user-posts').get_json()['posts'][0]['id']
+        client.delete(f'/api/user-posts/{post_id}')
+        posts.refresh()
+        assert posts.facets() == [('二手', 2), ('租房', 45)]
+
+    def test_posts_applied_as_deltas(self, posts, monkeypatch):
+        """Posts and deletes update the user indexes without rebuilding them"""
+        import climate_api
+        built = []
+        build = ServiceCatalog._build_indexes
+        def counting(conn, origin, generation=0):
+            built.append(origin)
+            return build(conn, origin, generation)
+        monkeypatch.setattr(ServiceCatalog, '_build_indexes', staticmethod(counting))
+        with climate_api.get_db_connection() as conn:
+            conn.execute("INSERT INTO user_posts (category, title) VALUES ('搬家', '周末搬家帮手')")
+            conn.execute("DELETE FROM user_posts WHERE title = '出售二手沙发'")
+            conn.commit()
+        posts.refresh()
+        assert posts.facets() == [('二手', 1), ('招聘', 1), ('搬家', 1), ('租房', 45)]
+        assert posts.search('沙发') == []
+        assert [s['Title'] for s in posts.fetch(posts.search('搬家'))] == ['周末搬家帮手']
+        assert posts.search('二手', '二手') and posts.search('搬家', '二手') == []
+        assert built == []
+
+    def test_homepage_refreshes_once(self, posts, client, monkeypatch):
+        """A faceted, searched homepage request refreshes the catalog once"""
+        calls = []
+        refresh = ServiceCatalog.refresh
+        monkeypatch.setattr(ServiceCatalog, 'refresh',
+                            lambda self, *a, **k: calls.append(1) or refresh(self, *a, **k))
+        page = client.get('/?category=二手&category=招聘&search=二手&last=1').data.decode()
+        assert '二手自行车转让' in page
+        assert calls == [1]
+
+    def test_multi_category_page_and_search(self, posts):
+        """Several categories page together; search intersects with the facets"""
+        titles = [s['Title'] for s in posts.page(['二手', '招聘'], per_page=20)]
+        assert titles == ['餐馆招聘服务员', '二手自行车转让', '出售二手沙发']
+        ids = posts.search('二手', ['二手', '招聘'])
+        assert [s['Title'] for s in posts.fetch(ids)] == ['二手自行车转让', '出售二手沙发']
+        assert posts.search('二手', '招聘') == []
+
+    def test_dropdown_counts(self, posts, client):
+        """The homepage dropdown shows counts and keeps every selected category"""
+        html = client.get('/?category=二手&category=招聘').data.decode()
+        assert '二手 (2)' in html and '租房 (45)' in html
+        assert '共找到 <strong>3</strong>' in html
+        assert html.count('selected') == 2
+
+
+class TestCatalogRefresh:
+    """Test suite for the background catalog refresh and hot-swap"""
+
+    @staticmethod
+    def write_csv(path, count):
+        """Replace the services CSV atomically, like the crawler does"""
+        rows = ['Title,Source'] + [f'招聘(Queens) 第{i}号,https://example.com/{i}'
+                                   for i in range(count)]
+        with open(path + '.partial', 'w', encoding='utf-8') as f:
+            f.write('\n'.join(rows) + '\n')
+        os.replace(path + '.partial', path)
+
+    def test_run_once_swaps_in_new_catalog(self, services_db):
+        """Requests don't import the new CSV; the refresher does, then swaps"""
+        services_db.watch_csv = False
+        assert services_db.count() == 45
+        def crawl():
+            self.write_csv(services_db.csv_path, 50)
+            return {'written': 50, 'duplicates': 0, 'changed': {'list_jobs.html'}}
+        refresher = CatalogRefresher(services_db, crawl)
+        crawl()
+        assert services_db.count() == 45
+        assert refresher.run_once()
+        assert services_db.count() == 50
+        assert services_db.categories() == ['招聘']
+        status = refresher.status()
+        assert (status['state'], status['runs'], status['items']) == ('idle', 1, 50)
+        assert status['crawled'] == {'written': 50, 'duplicates': 0, 'changed': 1}
+        assert status['crawl_s'] >= 0 and status['rebuild_s'] >= 0
+
+    def test_readers_not_blocked_during_rebuild(self, services_db):
+        """While a rebuild runs, readers get the previous indexes at once"""
+        import threading
+        import climate_api
+        release = threading.Event()
+        def slow_load():
+            release.wait(10)
+            return climate_api.get_services()
+        services_db.refresh()
+        catalog = ServiceCatalog(services_db.csv_path, load_scraped=slow_load,
+                                 connect=climate_api.get_db_connection)
+        catalog.refresh()  # already imported into the database: no load needed
+        self.write_csv(services_db.csv_path, 60)
+        worker = threading.Thread(target=catalog.refresh, kwargs={'reload_csv': True})
+        worker.start()
+        try:
+            for _ in range(100):
+                if catalog._refresh_lock.locked():
+                    break
+                time.sleep(0.01)
+            started = time.perf_counter()
+            assert catalog.count() == 45
+            assert catalog.search('第1号')
+            assert time.perf_counter() - started < 1
+        finally:
+            release.set()
+            worker.join()
+        assert catalog.count() == 60
+
+    def test_old_indexes_keep_their_rows_during_rebuild(self, services_db, monkeypatch):
+        """Between the import commit and the swap, readers get old indexes and old rows"""
+        import threading
+        services_db.refresh()
+        built, release = threading.Event(), threading.Event()
+        build = ServiceCatalog._build_indexes
+        def slow_build(conn, origin, generation=0):
+            if origin == 'scraped':
+                built.set()
+                release.wait(10)
+            return build(conn, origin, generation)
+        monkeypatch.setattr(ServiceCatalog, '_build_indexes', staticmethod(slow_build))
+        self.write_csv(services_db.csv_path, 60)
+        worker = threading.Thread(target=services_db.refresh, kwargs={'reload_csv': True})
+        worker.start()
+        try:
+            assert built.wait(10)  # the new rows are committed, their indexes not built
+            ids = services_db.search('Queens')
+            assert len(ids) == 45
+            assert len(services_db.fetch(ids)) == 45
+            listed = services_db.page(per_page=100)
+            assert len(listed) == services_db.count() == 45
+            assert {s['Category'] for s in listed} == {'租房'}
+            assert len(services_db.page(last=True, per_page=20)) == 5
+        finally:
+            release.set()
+            worker.join()
+        assert len(services_db.page(per_page=100)) == services_db.count() == 60
+        assert services_db.categories() == ['招聘']
+
+    def test_workers_follow_imports_by_other_processes(self, services_db):
+        """A worker that never reads the CSV still picks up another's import"""
+        import climate_api
+        services_db.refresh()
+        worker = ServiceCatalog(services_db.csv_path, load_scraped=climate_api.get_services,
+                                connect=climate_api.get_db_connection, watch_csv=False)
+        assert worker.count() == 45
+        version = worker.version
+
+        # The sidecar (or the worker holding the crawl lock) imports a new CSV
+        self.write_csv(services_db.csv_path, 50)
+        services_db.refresh(reload_csv=True)
+        assert worker.version != version
+        worker.refresh()
+        assert worker.count() == 50
+        assert worker.fetch(worker.search('第49号'))[0]['Title'] == '招聘(Queens) 第49号'
+
+        # Importing the same CSV again elsewhere keeps the ids the worker indexed
+        ids, version = worker.search('第7号'), worker.version
+        other = ServiceCatalog(services_db.csv_path, load_scraped=climate_api.get_services,
+                               connect=climate_api.get_db_connection)
+        other.refresh(reload_csv=True)
+        assert worker.version == version
+        assert [s['Title'] for s in worker.fetch(ids)] == ['招聘(Queens) 第7号']
+
+    def test_failed_refresh_keeps_catalog(self, services_db):
+        """A crawl error is reported and the current catalog stays"""
+        def crawl():
+            raise RuntimeError('site down')
+        refresher = CatalogRefresher(services_db, crawl)
+        assert not refresher.run_once()
+        status = refresher.status()
+        assert (status['state'], status['failures'], status['last_error']) == \
+            ('failed', 1, 'site down')
+        assert services_db.count() == 45
+
+    def test_background_thread_and_api(self, services_db, client, monkeypatch):
+        """The thread refreshes on its interval; the API reports and triggers"""
+        import climate_api
+        assert client.get('/api/v2/catalog/refresh').get_json() == {'enabled': False}
+        assert client.post('/api/v2/catalog/refresh').status_code == 409
+
+        refresher = CatalogRefresher(services_db, interval=0.05).start()
+        monkeypatch.setattr(climate_api, 'catalog_refresher', refresher)
+        try:
+            for _ in range(200):
+                if refresher.status()['runs']:
+                    break
+                time.sleep(0.01)
+            data = client.get('/api/v2/catalog/refresh').get_json()
+            assert data['enabled'] and data['runs'] >= 1 and data['items'] == 45
+            assert data['crawls'] is False
+            assert client.post('/api/v2/catalog/refresh').status_code == 202
+        finally:
+            refresher.stop(timeout=5)
+
+
+class TestUserPostsAPI:
+    """Test suite for the paginated /api/user-posts endpoint"""
+
+    @pytest.fixture
+    def posts(self, services_db, client):
+        for i in range(5):
+            client.post('/post', data={'category': '二手', 'title': f'二手物品{i}'})
+
+    def test_cursor_pagination(self, posts, client):
+        """limit/after walk every post exactly once, newest first"""
+        titles, after = [], None
+        while True:
+            query = {'limit': 2, **({'after': after} if after else {})}
+            data = client.get('/api/user-posts', query_string=query).get_json()
+            assert data['total'] == 5
+            titles += [p['title'] for p in data['posts']]
+            after = data['next_cursor']
+            if after is None:
+                break
+        assert titles == [f'二手物品{i}' for i in reversed(range(5))]
+
+    def test_ndjson_stream(self, posts, client):
+        """format=ndjson returns one JSON object per line"""
+        response = client.get('/api/user-posts?format=ndjson')
+        assert response.mimetype == 'application/x-ndjson'
+        lines = response.data.decode().splitlines()
+        assert len(lines) == 5
+        assert json.loads(lines[0])['title'] == '二手物品4'
+
+    def test_invalid_params(self, services_db, client):
+        """Bad limit or cursor is a 400"""
+        assert client.get('/api/user-posts?limit=0').status_code == 400
+        assert client.get('/api/user-posts?after=nope').status_code == 400
+
+
+class TestDatabaseStats:
+    """Test suite for the materialized /api/database-stats"""
+
+    def test_counts_follow_inserts_and_deletes(self, services_db, client):
+        """Triggers keep totals, categories and the latest post current"""
+        for category, title in [('二手', '沙发'), ('二手', '书桌'), ('招聘', '厨师')]:
+            client.post('/post', data={'category': category, 'title': title})
+        data = client.get('/api/database-stats').get_json()
+        assert data['total_user_posts'] == 3
+        assert data['categories'] == [{'category': '二手', 'count': 2},
+                                      {'category': '招聘', 'count': 1}]
+        assert data['most_recent_post']['title'] == '厨师'
+
+        latest = client.get('/api/user-posts?limit=1').get_json()['posts'][0]
+        assert client.delete(f"/api/user-posts/{latest['id']}").status_code == 200
+        data = client.get('/api/database-stats').get_json()
+        assert data['total_user_posts'] == 2
+        assert data['categories'] == [{'category': '二手', 'count': 2}]
+        assert data['most_recent_post']['title'] == '书桌'
+
+    def test_verify_repairs_drift(self, services_db, client):
+        """?verify=1 detects and rebuilds tampered stats"""
+        import climate_api
+        client.post('/post', data={'category': '二手', 'title': '沙发'})
+        with climate_api.get_db_connection() as conn:
+            conn.execute('UPDATE user_post_stats SET total = 42')
+            conn.commit()
+        data = client.get('/api/database-stats?verify=1').get_json()
+        assert data['verified'] == {'drifted': True}
+        assert data['total_user_posts'] == 1
+        data = client.get('/api/database-stats?verify=1').get_json()
+        assert data['verified'] == {'drifted': False}
+
+    def test_posts_from_other_workers_invalidate(self, services_db, client, tmp_path):
+        """Cached pages and the search index follow writes made by another process"""
+        assert '出售二手沙发' not in client.get('/?search=沙发').data.decode()
+        assert client.get('/api/user-posts').get_json()['total'] == 0
+
+        # Another worker: its own connections, and no access to our cache
+        other = ConnectionPool(str(tmp_path / 'test.db'))
+        with other.connection() as conn:
+            conn.execute("INSERT INTO user_posts (category, title) VALUES ('二手', '出售二手沙发')")
+            conn.commit()
+        assert '出售二手沙发' in client.get('/?search=沙发').data.decode()
+        assert client.get('/api/user-posts').get_json()['total'] == 1
+
+        with other.connection() as conn:
+            conn.execute('DELETE FROM user_posts')
+            conn.commit()
+        other.close()
+        assert '出售二手沙发' not in client.get('/?search=沙发').data.decode()
+        assert client.get('/api/user-posts').get_json()['total'] == 0
+
+    def test_version_column_added_to_old_tables(self, tmp_path):
+        """Databases from before the version counter are migrated in place"""
+        import sqlite3
+        import post_stats
+        conn = sqlite3.connect(str(tmp_path / 'old.db'))
+        conn.row_factory = sqlite3.Row
+        conn.execute('CREATE TABLE user_posts (id INTEGER PRIMARY KEY, category TEXT, '
+                     'title TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)')
+        for statement in post_stats.SCHEMA:
+            conn.execute(statement.replace('version = version + 1,', '')
+                         .replace(',\n        version INTEGER NOT NULL DEFAULT 0', ''))
+        conn.execute('INSERT INTO user_post_stats (id, total) VALUES (1, 0)')
+        post_stats.install(conn)
+        before = post_stats.version(conn)
+        conn.execute("INSERT INTO user_posts (category, title) VALUES ('二手', '沙发')")
+        assert post_stats.version(conn) == before + 1
+        assert post_stats.total(conn) == 1
+        conn.close()
+
+
+class TestConnectionPool:
+    """Test suite for the pooled SQLite connection layer"""
+
+    @pytest.fixture
+    def pool(self, tmp_path):
+        pool = ConnectionPool(str(tmp_path / 'pool.db'), size=2)
+        yield pool
+        pool.close()
+
+    def test_wal_and_pragmas(self, pool):
+        """Connections are configured for concurrent access"""
+        with pool.connection() as conn:
+            assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+            assert conn.execute('PRAGMA synchronous').fetchone()[0] == 1  # NORMAL
+
+    def test_connection_reused(self, pool):
+        """A returned connection is handed out again"""
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            assert second is first
+        assert pool.stats()['open'] == 1
+
+    def test_rollback_on_error(self, pool):
+        """An open transaction is rolled back before reuse"""
+        with pool.connection() as conn:
+            conn.execute('CREATE TABLE t (x INTEGER)')
+        with pytest.raises(RuntimeError):
+            with pool.connection() as conn:
+                conn.execute('INSERT INTO t VALUES (1)')
+                raise RuntimeError('boom')
+        with pool.connection() as conn:
+            assert conn.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 0
+
+    def test_close(self, pool):
+        """close() releases idle connections and refuses new borrows"""
+        with pool.connection():
+            pass
+        pool.close()
+        assert pool.stats()['open'] == 0
+        with pytest.raises(Exception):
+            with pool.connection():
+                pass
+
+
+class TestSearchIndex:
+    """Test suite for the n-gram search index"""
+
+    @pytest.fixture
+    def index(self):
+        return NgramIndex([
+            (1, '纽约中餐馆·小吃', '法拉盛租房附近'),
+            (2, '租房(皇后Queens)', '租房(皇后Queens)'),
+            (3, '招聘厨师', '中餐馆'),
+        ])
+
+    def test_cjk_query(self, index):
+        """Two-character Chinese query matches without word boundaries"""
+        assert sorted(index.search('租房')) == [1, 2]
+
+    def test_title_hits_rank_first(self, index):
+        """Title matches come before description-only matches"""
+        assert index.search('租房') == [2, 1]
+        assert index.search('中餐馆') == [1, 3]
+
+    def test_single_char_and_case(self, index):
+        """Single characters and mixed case are supported"""
+        assert index.search('聘') == [3]
+        assert index.search('queens') == [2]
+
+    def test_bigrams_must_be_contiguous(self, index):
+        """Candidates sharing grams but not the substring are rejected"""
+        assert index.search('租房皇') == []
+        assert index.search('不存在') == []
+
+    def test_add_and_remove(self, index):
+        """Documents can be added later; removed ones stop matching"""
+        index.add(4, '租房转让', '')
+        assert index.search('租房') == [4, 2, 1]
+        index.remove(2)
+        assert index.search('租房') == [4, 1]
+        assert (len(index), index.tombstones) == (3, 1)
+
+
+class TestResponseCache:
+    """Test suite for the versioned response cache and ETags"""
+
+    def test_hit_and_not_modified(self, climate_data, client):
+        """Repeat GETs are served from the cache; a matching ETag gets a 304"""
+        import climate_api
+        first = client.get('/api/climate')
+        second = client.get('/api/climate')
+        assert second.data == first.data
+        assert first.headers['ETag'] == second.headers['ETag']
+        assert climate_api.response_cache.stats()['hits'] == 1
+
+        response = client.get('/api/climate', headers={'If-None-Match': first.headers['ETag']})
+        assert response.status_code == 304
+        assert response.data == b''
+
+    def test_climate_write_invalidates(self, climate_data, client):
+        """POST /api/climate changes what /api/climate and /api/statistics return"""
+        etag = client.get('/api/climate').headers['ETag']
+        count = client.get('/api/statistics').get_json()['count']
+        client.post('/api/climate', json={'Year': 2024, 'Avg_Temp': 15.8})
+        response = client.get('/api/climate', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.get_json()[-1]['Year'] == 2024
+        assert client.get('/api/statistics').get_json()['count'] == count + 1
+
+    def test_services_writes_invalidate(self, services_db, client):
+        """/post and DELETE /api/user-posts/<id> refresh the homepage and post list"""
+        assert '共找到 <strong>45</strong>' in client.get('/').data.decode()
+        client.post('/post', data={'category': '二手', 'title': '九成新自行车'})
+        assert '共找到 <strong>46</strong>' in client.get('/').data.decode()
+        post_id = client.get('/api/user-posts').get_json()['posts'][0]['id']
+        client.delete(f'/api/user-posts/{post_id}')
+        assert client.get('/api/user-posts').get_json()['total'] == 0
+        assert '共找到 <strong>45</strong>' in client.get('/').data.decode()
+
+    def test_query_args_normalized(self, climate_data, client):
+        """Argument order doesn't matter; errors and streams aren't cached"""
+        import climate_api
+        client.get('/api/climate/range?min_temp=14&max_temp=15')
+        client.get('/api/climate/range?max_temp=15&min_temp=14')
+        client.get('/api/climate/range?min_temp=abc')
+        client.get('/api/climate/1900')
+        assert climate_api.response_cache.stats()['entries'] == 1
+        assert climate_api.response_cache.stats()['hits'] == 1
+
+    def test_lru_bounds(self):
+        """Least recently used entries are evicted by count and by bytes"""
+        cache = ResponseCache(max_entries=2, max_bytes=10)
+        cache.put('a', CachedResponse(b'aaa', 'text/plain'))
+        cache.put('b', CachedResponse(b'bbb', 'text/plain'))
+        cache.get('a')
+        cache.put('c', CachedResponse(b'ccc', 'text/plain'))
+        assert cache.get('b') is None and cache.get('a') is not None
+        cache.put('d', CachedResponse(b'dddddddd', 'text/plain'))
+        assert cache.stats()['entries'] == 1
+        assert cache.stats()['bytes'] == 8
+        cache.put('e', CachedResponse(b'x' * 11, 'text/plain'))
+        assert cache.get('e') is None
+
+class TestBenchmark:
+    """Smoke test for the benchmark suite at a tiny scale"""
+
+    def test_endpoints_and_baseline(self, tmp_path):
+        """Every case runs against generated data; slowdowns are flagged"""
+        import climate_api
+        import benchmark
+        original = climate_api.climate_store
+        with benchmark.synthetic_app(str(tmp_path), services=300, climate=500,
+                                     posts=50) as flask_app:
+            results = benchmark.bench_endpoints(flask_app, requests=3)
+            # 300 scraped + 50 posts + warm-up, 3 timed and 1 traced /post
+            assert climate_api.catalog.count() == 355
+        assert climate_api.climate_store is original
+        assert set(results) == {name for name, *_ in benchmark.CASES}
+        for summary in results.values():
+            assert summary['requests'] == 3
+            assert 0 < summary['p50_ms'] <= summary['p95_ms'] <= summary['p99_ms']
+
+        slower = {case: dict(r, p50_ms=r['p50_ms'] * 2) for case, r in results.items()}
+        assert benchmark.compare(results, results) == []
+        assert {case for case, *_ in benchmark.compare(slower, results)} == set(results)
+
 
 if __name__ == '__main__':
     pytest.main([__file__, '-v'])
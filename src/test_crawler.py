@@ -0,0 +1,245 @@
+"""
+Unit Tests for the Bay Area services crawler
+
+Runs the crawler against a local fixture site (fixtures/dadi360) instead
+of the real website.
+"""
+
+import csv
+
+import pytest
+
+from bench_extract import bench, load_pages
+from classify import load_services
+from crawler import Deduper, discovery_engine
+from extract import BACKENDS, anchors, decode, detect_charset
+from fetcher import FetchEngine, TokenBucket
+from fixture_site import FixtureSite
+
+
+@pytest.fixture
+def site():
+    with FixtureSite() as site:
+        yield site
+
+
+def read_output(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        return list(csv.DictReader(f))
+
+
+@pytest.fixture
+def engine():
+    engine = FetchEngine(concurrency=4, rate=1000, burst=10, retries=2, backoff=0.01)
+    yield engine
+    engine.close()
+
+
+class TestFetchEngine:
+    """Test suite for the concurrent fetcher"""
+
+    def test_retries_with_backoff(self, site, engine):
+        """Transient 503s are retried"""
+        site.fail('list_jobs.html', 2)
+        result = engine.fetch(site.url + 'c/forums/list_jobs.html')
+        assert result.ok
+        assert result.attempts == 3
+        assert engine.summary()['retries'] == 2
+
+    def test_gives_up_after_retries(self, site, engine):
+        """A persistently failing URL is reported, not raised"""
+        site.fail('list_jobs.html', 10)
+        result = engine.fetch(site.url + 'list_jobs.html')
+        assert result.status == 503
+        assert result.attempts == 3
+
+    def test_fetch_all_keeps_order(self, site, engine):
+        """Concurrent fetches come back in input order with timings"""
+        urls = [site.url + name for name in ('list_rent.html', 'missing.html', 'class_food.html')]
+        results = list(engine.fetch_all(urls))
+        assert [r.url for r in results] == urls
+        assert [r.status for r in results] == [200, 404, 200]
+        assert len(engine.timings) == 3
+
+
+class TestTokenBucket:
+    """Test suite for the per-host rate limiter"""
+
+    def test_rate_limit(self):
+        """Bursts are free, then acquisitions are spaced 1/rate apart"""
+        now, slept = [0.0], []
+        bucket = TokenBucket(rate=2, capacity=2, clock=lambda: now[0], sleep=slept.append)
+        waits = [bucket.acquire() for _ in range(4)]
+        assert waits == [0.0, 0.0, 0.5, 1.0]
+        assert slept == [0.5, 1.0]
+
+    def test_refill(self):
+        """Tokens refill over time up to capacity"""
+        now = [0.0]
+        bucket = TokenBucket(rate=1, capacity=1, clock=lambda: now[0], sleep=lambda s: None)
+        bucket.acquire()
+        now[0] = 5.0
+        assert bucket.acquire() == 0.0
+
+
+class TestExtract:
+    """Test suite for anchor-only extraction"""
+
+    def test_backends_agree_on_fixtures(self):
+        """Every backend extracts the same titles as a full soup"""
+        results = bench(load_pages(), repeat=1)
+        assert set(results) == set(BACKENDS)
+        titles = {backend: r['titles'] for backend, r in results.items()}
+        assert all(t == titles['soup'] for t in titles.values())
+
+    def test_anchor_text_and_href(self):
+        """Nested markup and entities are flattened into the anchor text"""
+        html = '<p><a href="/t/1"><b>Room</b> &amp; board</a><a>no href</a></p>'
+        for backend in BACKENDS:
+            assert anchors(html, backend) == [('/t/1', 'Room & board'), (None, 'no href')]
+        # Like a browser, the streaming parser ends an unclosed anchor at the next <a>
+        assert anchors('<a>one<a href="/t/2">two', 'htmlparser') == [(None, 'one'),
+                                                                     ('/t/2', 'two')]
+        with pytest.raises(ValueError):
+            anchors(html, 'nope')
+
+    def test_detects_charset(self):
+        """Header charset wins, then <meta>, then UTF-8"""
+        page = '<meta charset="gbk"><a href="/t/1">法拉盛一室一厅出租</a>'
+        body = page.encode('gbk')
+        assert detect_charset(body) == 'gbk'
+        assert detect_charset(body, 'text/html; charset=GB18030') == 'gb18030'
+        assert detect_charset('<a>法拉盛</a>'.encode('utf-8')) == 'utf-8'
+        assert decode(body) == page
+
+
+class TestDiscoveryEngine:
+    """Test suite for the end-to-end crawl"""
+
+    def test_crawl_fixture_site(self, site, engine, tmp_path):
+        """Category pages are discovered and their titles captured"""
+        output = tmp_path / 'out.csv'
+        discovery_engine(site.url, engine, output_path=str(output))
+        rows = read_output(output)
+        sources = {row['Source'] for row in rows}
+        assert sources == {site.url + 'c/forums/list_rent.html',
+                           site.url + 'c/forums/list_jobs.html',
+                           site.url + 'class_food.html'}
+        titles = [row['Title'] for row in rows]
+        assert '招聘·法拉盛中餐馆诚聘炒锅、打杂数名' in titles
+        assert '短标题' not in titles
+        assert site.hits['list_rent.html'] == 1
+        assert not (tmp_path / 'out.csv.partial').exists()
+        assert (tmp_path / 'out.catalog.json').exists()
+        assert len(load_services(str(output))) == len(rows)
+
+
+class TestOutputPipeline:
+    """Test suite for the extract -> dedupe -> write pipeline"""
+
+    def test_dedupes_normalized_titles(self):
+        """Titles equal after whitespace/width/case folding are dropped"""
+        dedupe = Deduper()
+        rows = [{'Title': t, 'Source': 's'} for t in
+                ('Room For Rent  Near BART', 'room for rent near bart', 'Ｒｏｏｍ For Rent Near BART',
+                 'Room for rent near Caltrain')]
+        kept = [r['Title'] for r in dedupe(rows)]
+        assert kept == ['Room For Rent  Near BART', 'Room for rent near Caltrain']
+        assert dedupe.duplicates == 2
+
+    def test_crawl_output_has_no_duplicates(self, site, engine, tmp_path):
+        """The repeated listing on the rent page is written once"""
+        output = tmp_path / 'out.csv'
+        stats = discovery_engine(site.url, engine, output_path=str(output))
+        titles = [row['Title'] for row in read_output(output)]
+        assert len(titles) == len(set(titles)) == stats['written']
+        assert stats['duplicates'] >= 1
+
+    def test_partial_output_survives_failure(self, site, engine, tmp_path, monkeypatch):
+        """Rows flushed before a crash stay in .partial; the output is untouched"""
+        output = tmp_path / 'out.csv'
+        discovery_engine(site.url, engine, output_path=str(output))
+        before = output.read_text(encoding='utf-8')
+
+        import crawler
+        original = crawler.extract_titles
+        calls = []
+
+        def flaky(html):
+            calls.append(html)
+            if len(calls) > 1:
+                raise KeyboardInterrupt
+            return original(html)
+
+        monkeypatch.setattr(crawler, 'extract_titles', flaky)
+        site.validators = False
+        site.overrides['list_jobs.html'] = site.overrides['list_rent.html'] = (
+            '<a href="/t/1">招聘·新开张奶茶店招聘店员 时间灵活</a>'
+            '<a href="/c/forums/list_rent.html">租房·米尔布雷独立套房 近BART 拎包入住</a>').encode('utf-8')
+        with pytest.raises(KeyboardInterrupt):
+            discovery_engine(site.url, engine, output_path=str(output), batch_size=1)
+        assert output.read_text(encoding='utf-8') == before
+        partial = read_output(str(output) + '.partial')
+        assert len(partial) == 2
+
+        # Page state is only stored once the output is committed, so a run
+        # that dies at commit() re-extracts the changed pages next time
+        monkeypatch.setattr(crawler, 'extract_titles', original)
+        commit = crawler.BatchedCsvWriter.commit
+        def failing(writer):
+            monkeypatch.setattr(crawler.BatchedCsvWriter, 'commit', commit)
+            raise OSError('disk full')
+        monkeypatch.setattr(crawler.BatchedCsvWriter, 'commit', failing)
+        with pytest.raises(OSError):
+            discovery_engine(site.url, engine, output_path=str(output))
+        assert output.read_text(encoding='utf-8') == before
+        discovery_engine(site.url, engine, output_path=str(output))
+        titles = {row['Title'] for row in read_output(str(output))}
+        assert '租房·米尔布雷独立套房 近BART 拎包入住' in titles
+        assert '招聘·新开张奶茶店招聘店员 时间灵活' in titles
+
+
+class TestIncrementalCrawl:
+    """Test suite for conditional GETs and change detection"""
+
+    @pytest.fixture
+    def output(self, site, engine, tmp_path):
+        output = tmp_path / 'out.csv'
+        discovery_engine(site.url, engine, output_path=str(output))
+        return output
+
+    @pytest.fixture
+    def extractions(self, monkeypatch):
+        """Record which pages get parsed"""
+        import crawler
+        calls = []
+        original = crawler.extract_titles
+        monkeypatch.setattr(crawler, 'extract_titles',
+                            lambda html: calls.append(html) or original(html))
+        return calls
+
+    def test_not_modified_skips_parsing(self, site, engine, output, extractions):
+        """A revisit gets 304s and leaves the output untouched"""
+        before = output.read_text(encoding='utf-8')
+        stats = discovery_engine(site.url, engine, output_path=str(output))
+        assert extractions == []
+        assert engine.summary()['not_modified'] == 4  # start page + 3 categories
+        assert output.read_text(encoding='utf-8') == before
+        assert stats['unchanged'] == 3 and stats['changed'] == 0
+
+    def test_unchanged_hash_without_validators(self, site, engine, output, extractions):
+        """Servers without ETags are caught by the body hash"""
+        site.validators = False
+        discovery_engine(site.url, engine, output_path=str(output))
+        assert extractions == []
+
+    def test_only_changed_page_is_merged(self, site, engine, output, extractions):
+        """A changed page replaces just its own rows"""
+        site.overrides['list_jobs.html'] = (
+            '<a href="/t/99">招聘·新开张奶茶店招聘店员 时间灵活</a>').encode('utf-8')
+        discovery_engine(site.url, engine, output_path=str(output))
+        rows = read_output(output)
+        assert len(extractions) == 1
+        jobs = [r['Title'] for r in rows if r['Source'].endswith('list_jobs.html')]
+        assert jobs == ['招聘·新开张奶茶店招聘店员 时间灵活']
+        assert any(r['Source'].endswith('list_rent.html') for r in rows)